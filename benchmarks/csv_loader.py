@@ -0,0 +1,68 @@
+"""CSV loader benchmark: utils.read_rows() against csv.DictReader.
+
+Generates a synthetic books table (see generate_library.py), then reads
+it back both ways, consuming every row with 'quantity' and 'available'
+parsed to int as the store needs them:
+
+    python -m benchmarks.csv_loader [--rows 1000000] [--tabs] [--repeat 3] [--min-speedup 3]
+
+Prints the best time of each and the speedup; the exit status is 1 when
+the speedup is below --min-speedup.
+"""
+import argparse
+import collections
+import csv
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.generate_library import generate
+from utils import BOOK_FIELDNAMES, file_delimiter, read_rows
+
+
+def dictreader_rows(file_path):
+    """What loading looked like before read_rows(): one dict per row, counts parsed afterwards."""
+    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file, delimiter=file_delimiter(file_path)):
+            row['quantity'] = int(row['quantity'])
+            row['available'] = int(row['available'])
+            yield row
+
+def best_time(read, file_path, repeat):
+    """Returns the fastest of 'repeat' full reads, in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        collections.deque(read(file_path), maxlen=0) # Consume without keeping the rows
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare read_rows() with csv.DictReader on a large table.")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--tabs', action='store_true', help="tab-separated, like the shipped data files")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--min-speedup', type=float, default=3.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='csv-loader-') as data_dir:
+        generate(data_dir, args.rows, members=1, loan_density=0, delimiter='\t' if args.tabs else ',')
+        books_file = os.path.join(data_dir, 'books.csv')
+        size = os.path.getsize(books_file)
+        print(f"{args.rows:,} rows, {size / 1e6:.1f} MB, delimiter {file_delimiter(books_file)!r}")
+
+        baseline = best_time(dictreader_rows, books_file, args.repeat)
+        loader = best_time(lambda path: read_rows(path, BOOK_FIELDNAMES), books_file, args.repeat)
+
+    speedup = baseline / loader
+    print(f"csv.DictReader  {baseline:7.2f}s  {args.rows / baseline:12,.0f} rows/s")
+    print(f"read_rows       {loader:7.2f}s  {args.rows / loader:12,.0f} rows/s")
+    print(f"speedup         {speedup:7.2f}x (required {args.min_speedup:g}x)")
+    if speedup < args.min_speedup:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Synthetic library generator for benchmarks.
+
+Writes books.csv, member.csv, loans.csv and sequences.json in the
+current file formats, streaming rows so a million-book library does not
+have to fit in memory while it is written:
+
+    python -m benchmarks.generate_library DATA_DIR --books 100000 [--loan-density 0.3] [--overdue-ratio 0.1] [--tabs]
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+
+from utils import BOOK_FIELDNAMES, MEMBER_FIELDNAMES, LOAN_FIELDNAMES, LOAN_PERIOD, MEMBERS_FILE, ensure_data_dir_exists
+
+_SYLLABLES = ['an', 'bel', 'cor', 'da', 'el', 'fin', 'gar', 'hol', 'is', 'jun',
+              'kel', 'lo', 'mar', 'nor', 'os', 'pen', 'quil', 'ro', 'sen', 'tor']
+_WORDS = [a + b for a in _SYLLABLES for b in _SYLLABLES] # 400 title words
+_FIRST_NAMES = ['Ada', 'Ali', 'Bilal', 'Chen', 'Dana', 'Eva', 'Farah', 'Hassan', 'Ivan', 'Maya']
+_LAST_NAMES = ['Khan', 'Smith', 'Garcia', 'Ito', 'Novak', 'Okafor', 'Rossi', 'Silva', 'Wang', 'Young']
+
+
+def title_words():
+    """Returns the vocabulary titles are made of, for picking search terms."""
+    return list(_WORDS)
+
+def generate(data_dir, books, members=None, loan_density=0.3, overdue_ratio=0.1, max_copies=5, seed=0,
+             delimiter=','):
+    """Writes a synthetic library into data_dir. Returns {'books', 'members', 'loans', 'overdue'} counts.
+
+    Each book gets 1..max_copies copies; every copy is on loan with
+    probability loan_density, to a random member, and each loan is overdue
+    with probability overdue_ratio. delimiter='\t' writes tab-separated
+    files like the shipped data.
+    """
+    rng = random.Random(seed)
+    members = members if members is not None else max(1, books // 4)
+    today = datetime.date.today()
+    ensure_data_dir_exists(data_dir)
+
+    with open(os.path.join(data_dir, os.path.basename(MEMBERS_FILE)), mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, delimiter=delimiter)
+        writer.writerow(MEMBER_FIELDNAMES)
+        for member_id in range(1, members + 1):
+            writer.writerow([member_id, f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}",
+                             f"member{member_id}@example.org"])
+
+    loan_count = overdue = 0
+    with open(os.path.join(data_dir, 'books.csv'), mode='w', newline='', encoding='utf-8') as books_file, \
+         open(os.path.join(data_dir, 'loans.csv'), mode='w', newline='', encoding='utf-8') as loans_file:
+        books_writer = csv.writer(books_file, delimiter=delimiter)
+        loans_writer = csv.writer(loans_file, delimiter=delimiter)
+        books_writer.writerow(BOOK_FIELDNAMES)
+        loans_writer.writerow(LOAN_FIELDNAMES)
+        for book_id in range(1, books + 1):
+            quantity = rng.randint(1, max_copies)
+            on_loan = sum(rng.random() < loan_density for _ in range(quantity))
+            title = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(2, 4))).title()
+            author = f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}"
+            books_writer.writerow([book_id, title, author, f"978{book_id:010d}", quantity, quantity - on_loan])
+            for _ in range(on_loan):
+                loan_count += 1
+                if rng.random() < overdue_ratio:
+                    overdue += 1
+                    borrowed_on = today - LOAN_PERIOD - datetime.timedelta(days=rng.randint(1, 60))
+                else:
+                    borrowed_on = today - datetime.timedelta(days=rng.randint(0, LOAN_PERIOD.days - 1))
+                loans_writer.writerow([loan_count, rng.randint(1, members), book_id,
+                                       borrowed_on.isoformat(), (borrowed_on + LOAN_PERIOD).isoformat()])
+
+    journal = os.path.join(data_dir, 'loans.journal')
+    if os.path.exists(journal):
+        os.remove(journal) # Left over from an earlier run; would replay onto the new rows
+    with open(os.path.join(data_dir, 'sequences.json'), mode='w', encoding='utf-8') as file:
+        json.dump({'books': books, 'members': members, 'loans': loan_count}, file)
+    return {'books': books, 'members': members, 'loans': loan_count, 'overdue': overdue}
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic library data directory.")
+    parser.add_argument('data_dir')
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--members', type=int, help="default: a quarter of the books")
+    parser.add_argument('--loan-density', type=float, default=0.3, help="share of copies on loan")
+    parser.add_argument('--overdue-ratio', type=float, default=0.1, help="share of loans past due")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tabs', action='store_true', help="tab-separated, like the shipped data files")
+    args = parser.parse_args()
+    counts = generate(args.data_dir, args.books, args.members, args.loan_density, args.overdue_ratio, seed=args.seed,
+                      delimiter='\t' if args.tabs else ',')
+    print(f"Wrote {counts['books']} books, {counts['members']} members and {counts['loans']} loans "
+          f"({counts['overdue']} overdue) to '{args.data_dir}'.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Benchmark suite for the menu operations.
+
+Generates a synthetic library (see generate_library.py), then drives the
+real menu functions with scripted input() answers and output thrown
+away, and reports per operation:
+
+- latency percentiles over --repeat runs,
+- peak Python memory allocated during one traced run (tracemalloc),
+- bytes written to files per run (Linux /proc/self/io; null elsewhere).
+
+The overdue list and the report are cached per data version, so
+'overdue' and 'report' time cache hits; their '_after_write' variants
+borrow or return a book first (untimed), so each run computes them.
+
+    python -m benchmarks.run_benchmarks --books 100000 --output results.json [--baseline old.json]
+
+With --baseline, operations whose median got more than --threshold slower
+than in the baseline results are listed and the exit status is 1.
+"""
+import argparse
+import builtins
+import contextlib
+import datetime
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import modules.book_manager as bm
+import modules.library_api as api
+import modules.report_manager as rm
+from benchmarks.generate_library import generate, title_words
+from modules.library_store import configure_store, get_store, migrate_csv_to_sqlite
+from modules.storage import open_repository
+
+
+class _Discard:
+    """stdout replacement that drops everything the menu prints."""
+
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+def _bytes_written():
+    """Bytes this process has written through system calls so far, or None if unknown."""
+    try:
+        with open('/proc/self/io', encoding='ascii') as file:
+            for line in file:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+@contextlib.contextmanager
+def _scripted(answers):
+    """Answers input() prompts from the list and silences the output."""
+    answers = iter(answers)
+    real_input = builtins.input
+    builtins.input = lambda prompt='': next(answers)
+    try:
+        with contextlib.redirect_stdout(_Discard()):
+            yield
+    finally:
+        builtins.input = real_input
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Operations:
+    """The benchmarked operations; each prepare_* returns (function, input answers) for one run."""
+
+    def __init__(self, backend, data_dir, counts, seed):
+        self.backend = backend
+        self.data_dir = data_dir
+        self.counts = counts
+        self.rng = random.Random(seed)
+        self.words = title_words()
+        self.borrowed = [] # (member id, book id) of loans made by the borrow runs
+        self.written = None # (member id, book id) of the loan _write() made last, until it returns it
+
+    def prepare_load(self):
+        # A cold start: a new store reading everything from storage.
+        def load():
+            configure_store(open_repository(self.backend, self.data_dir)).books()
+        return load, []
+
+    def prepare_search(self):
+        term = self.rng.choice(self.words)
+        return bm.search_books, [term[:self.rng.randint(3, len(term))]]
+
+    def prepare_borrow(self):
+        store = get_store()
+        while True:
+            book = store.get_book(str(self.rng.randint(1, self.counts['books'])))
+            if int(book['available']) > 0:
+                break
+        member_id = str(self.rng.randint(1, self.counts['members']))
+        self.borrowed.append((member_id, book['id']))
+        return bm.borrow_a_book, [member_id, book['id']]
+
+    def prepare_return(self):
+        if self.borrowed:
+            member_id, book_id = self.borrowed.pop()
+        else:
+            loan = self.rng.choice(get_store().loans())
+            member_id, book_id = loan['member_id'], loan['book_id']
+        return bm.return_a_book, [member_id, book_id]
+
+    def prepare_overdue(self):
+        return bm.view_overdue_books, []
+
+    def prepare_report(self):
+        return rm.generate_library_report, []
+
+    def _write(self):
+        """Borrows a book, or returns the one borrowed last time, so the data version changes."""
+        if self.written:
+            api.return_book(*self.written)
+            self.written = None
+            return
+        store = get_store()
+        while True:
+            book = store.get_book(str(self.rng.randint(1, self.counts['books'])))
+            if book['available'] > 0:
+                break
+        member_id = str(self.rng.randint(1, self.counts['members']))
+        api.borrow_book(member_id, book['id'])
+        self.written = (member_id, book['id'])
+
+    def prepare_overdue_after_write(self):
+        self._write()
+        return self.prepare_overdue()
+
+    def prepare_report_after_write(self):
+        self._write()
+        return self.prepare_report()
+
+OPERATIONS = ['load', 'search', 'borrow', 'return', 'overdue', 'report', 'overdue_after_write', 'report_after_write']
+
+
+def measure(operations, name, repeat):
+    """Runs one operation 'repeat' times plus once under tracemalloc. Returns its result dict."""
+    prepare = getattr(operations, 'prepare_' + name)
+    latencies = []
+    written = 0
+    for _ in range(repeat):
+        function, answers = prepare()
+        before = _bytes_written()
+        with _scripted(answers):
+            started = time.perf_counter()
+            function()
+            latencies.append(time.perf_counter() - started)
+        if before is not None:
+            written += _bytes_written() - before
+
+    function, answers = prepare()
+    tracemalloc.start()
+    with _scripted(answers):
+        function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'runs': repeat,
+        'mean_ms': sum(latencies) / repeat * 1000,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p90_ms': percentile(latencies, 0.90) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'peak_memory_bytes': peak,
+        'bytes_written_per_run': written / repeat if before is not None else None,
+    }
+
+def compare(results, baseline, threshold):
+    """Returns [(operation, baseline p50, new p50)] for medians more than 'threshold' slower."""
+    regressions = []
+    for name, result in results['operations'].items():
+        old = baseline.get('operations', {}).get(name)
+        if old and result['p50_ms'] > old['p50_ms'] * (1 + threshold):
+            regressions.append((name, old['p50_ms'], result['p50_ms']))
+    return regressions
+
+def run(args):
+    with tempfile.TemporaryDirectory() as data_dir:
+        started = time.perf_counter()
+        counts = generate(data_dir, args.books, args.members, args.loan_density, args.overdue_ratio, seed=args.seed)
+        if args.backend == 'sqlite':
+            migrate_csv_to_sqlite(data_dir)
+        print(f"Generated {counts['books']:,} books, {counts['members']:,} members and "
+              f"{counts['loans']:,} loans ({counts['overdue']:,} overdue) in {time.perf_counter() - started:.1f}s.",
+              file=sys.stderr)
+
+        operations = Operations(args.backend, data_dir, counts, args.seed)
+        configure_store(open_repository(args.backend, data_dir))
+        results = {
+            'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'dataset': dict(counts, loan_density=args.loan_density, overdue_ratio=args.overdue_ratio,
+                            seed=args.seed),
+            'operations': {},
+        }
+        for name in args.operations or OPERATIONS:
+            repeat = min(args.repeat, args.load_repeat) if name == 'load' else args.repeat
+            results['operations'][name] = result = measure(operations, name, repeat)
+            print(f"{name:<19} p50 {result['p50_ms']:9.2f} ms  p90 {result['p90_ms']:9.2f} ms  "
+                  f"p99 {result['p99_ms']:9.2f} ms  peak {result['peak_memory_bytes'] / 1024:10,.0f} KiB",
+                  file=sys.stderr)
+        get_store().compact() # Before the data directory goes away
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the library menu operations on synthetic data.")
+    parser.add_argument('--books', type=int, default=1000, help="catalogue size (1k to 1M is sensible)")
+    parser.add_argument('--members', type=int, help="default: a quarter of the books")
+    parser.add_argument('--loan-density', type=float, default=0.3, help="share of copies on loan")
+    parser.add_argument('--overdue-ratio', type=float, default=0.1, help="share of loans past due")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default='csv')
+    parser.add_argument('--repeat', type=int, default=50, help="timed runs per operation")
+    parser.add_argument('--load-repeat', type=int, default=3, help="timed runs of the cold load")
+    parser.add_argument('--operation', dest='operations', action='append', choices=OPERATIONS,
+                        help="operation to run (repeatable; default: all)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the results as JSON to this file (default: stdout)")
+    parser.add_argument('--baseline', help="earlier results JSON to check for regressions")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed median slowdown (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: median {old:.2f} ms -> {new:.2f} ms", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Concurrent checkout stress test.
+
+Runs several processes that borrow and return books against one data
+directory at the same time, then checks that no copy was lent twice:
+
+    python -m benchmarks.stress_checkout [--backend csv|sqlite] [--workers 8] [--ops 200]
+"""
+import argparse
+import collections
+import multiprocessing
+import random
+import sys
+import tempfile
+import time
+
+from modules.library_store import LibraryStore, LibraryError
+from modules.storage import open_repository
+from utils import ensure_data_dir_exists
+
+
+def _seed(backend, data_dir, books, members, copies):
+    store = LibraryStore(open_repository(backend, data_dir))
+    first_book = store.reserve_ids('books', books)
+    store.add_books([{'id': str(first_book + i), 'title': f"Stress Book {i}", 'author': "Stress",
+                      'isbn': f"978{i:010d}", 'quantity': str(copies), 'available': str(copies)}
+                     for i in range(books)])
+    first_member = store.reserve_ids('members', members)
+    store.add_members([{'id': str(first_member + i), 'name': f"Member {i}", 'contact': ''}
+                       for i in range(members)])
+
+def _worker(backend, data_dir, ops, seed, results):
+    """Borrows or returns at random; reports what it believes succeeded."""
+    rng = random.Random(seed)
+    store = LibraryStore(open_repository(backend, data_dir))
+    borrowed, returned, refused = [], [], 0
+    for _ in range(ops):
+        member = rng.choice(store.members())
+        loans = store.loans_for_member(member['id'])
+        try:
+            if loans and rng.random() < 0.4:
+                loan = rng.choice(loans)
+                store.return_loan(loan)
+                returned.append(loan['loan_id'])
+            else:
+                loan = store.borrow(member, rng.choice(store.books()))
+                borrowed.append(loan['loan_id'])
+        except LibraryError:
+            refused += 1 # Out of stock, already returned, or lost every retry
+    results.put((borrowed, returned, refused))
+
+def check_invariants(store, borrowed, returned):
+    """Returns a list of problems found in the final data; empty if none."""
+    problems = []
+    loans = store.loans()
+    loans_per_book = collections.Counter(loan['book_id'] for loan in loans)
+    for book in store.books():
+        quantity, available = int(book['quantity']), int(book['available'])
+        if not 0 <= available <= quantity:
+            problems.append(f"book {book['id']}: available {available} outside 0..{quantity}")
+        if available + loans_per_book[book['id']] != quantity:
+            problems.append(f"book {book['id']}: {available} available + "
+                            f"{loans_per_book[book['id']]} on loan != {quantity} copies")
+    if len(borrowed) != len(set(borrowed)):
+        problems.append("the same loan id was handed out twice")
+    if len(returned) != len(set(returned)):
+        problems.append("the same loan was returned twice")
+    open_loans = set(borrowed) - set(returned)
+    if open_loans != {loan['loan_id'] for loan in loans}:
+        problems.append(f"{len(open_loans)} loans reported open but {len(loans)} stored")
+    drift = store.totals().drift(store.recount_totals())
+    if drift:
+        problems.append(f"running totals drifted: {drift}")
+    return problems
+
+def run(backend, workers, ops, books, members, copies):
+    with tempfile.TemporaryDirectory() as data_dir:
+        ensure_data_dir_exists(data_dir)
+        _seed(backend, data_dir, books, members, copies)
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_worker, args=(backend, data_dir, ops, seed, results))
+                     for seed in range(workers)]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        borrowed = [loan_id for outcome in outcomes for loan_id in outcome[0]]
+        returned = [loan_id for outcome in outcomes for loan_id in outcome[1]]
+        refused = sum(outcome[2] for outcome in outcomes)
+        problems = check_invariants(LibraryStore(open_repository(backend, data_dir)), borrowed, returned)
+
+    total = workers * ops
+    print(f"{backend}: {workers} workers x {ops} ops in {elapsed:.2f}s ({total / elapsed:,.0f} ops/s) - "
+          f"{len(borrowed)} borrowed, {len(returned)} returned, {refused} refused")
+    for problem in problems:
+        print(f"  FAILED: {problem}")
+    return not problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress concurrent borrows and returns.")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], action='append',
+                        help="Backend to test (repeatable; default: both)")
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=200, help="Operations per worker")
+    parser.add_argument('--books', type=int, default=5, help="Few books keep workers contending")
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--copies', type=int, default=3)
+    args = parser.parse_args()
+    ok = all([run(backend, args.workers, args.ops, args.books, args.members, args.copies)
+              for backend in args.backend or ['csv', 'sqlite']])
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,17 @@
+import argparse
+import contextlib
 import os
 import modules.book_manager as bm
+import modules.branches as branches
+import modules.instrumentation as instrumentation
+import modules.library_api as api
 import modules.member_manager as mm
 import modules.report_manager as rm
-from utils import ensure_data_dir_exists # Import the function to create data dir
+from modules.bulk_import import import_file
+from modules.library_service import serve
+from modules.library_store import get_store, configure_store, migrate_csv_to_sqlite
+from modules.storage import open_repository
+from utils import ensure_data_dir_exists, METRICS_FILE # Import the function to create data dir
 
 
 def clear_screen():
@@ -26,44 +35,147 @@ def display_menu():
     print("9. Library Report")
     print("10. Add New Book")
     print("11. Register New Member")
+    print("12. Batch Checkout")
+    print("13. Batch Return")
+    print("14. Performance Stats")
+    print("15. Circulation Analytics")
+    print("16. Place a Hold")
+    print("17. View Member's Holds")
+    print("18. Search All Branches")
+    print("19. Find a Copy at Any Branch")
+    print("20. All-Branch Report")
     print("0. Exit")
     print("=" * 40)
 
+def parse_args(argv=None):
+    """Parses the command line; with no command the interactive menu runs."""
+    parser = argparse.ArgumentParser(description="Library Management System")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'],
+                        help="storage backend (default: $LIBRARY_BACKEND, else csv)")
+    parser.add_argument('--branches', metavar='NAME=DIR,...',
+                        help="data directories of the branches for cross-branch queries (default: $LIBRARY_BRANCHES)")
+    parser.add_argument('--profile', action='store_true',
+                        help="run under cProfile and print the hottest functions and per-operation stats on exit")
+    subparsers = parser.add_subparsers(dest='command')
+    report_parser = subparsers.add_parser('report', help="print the library report and exit")
+    report_parser.add_argument('--verify', action='store_true',
+                               help="recount the summary totals from the raw data and flag any drift")
+    report_parser.add_argument('--all-branches', action='store_true',
+                               help="report on every branch, with the totals combined")
+    import_parser = subparsers.add_parser('import', help="bulk-load books or members from a CSV feed")
+    import_parser.add_argument('kind', choices=['books', 'members'])
+    import_parser.add_argument('feed', help="CSV file with a header row")
+    subparsers.add_parser('migrate-sqlite', help="copy the CSV data files into the SQLite database")
+    subparsers.add_parser('compact', help="fold the loans journal into the CSV files and write the binary "
+                                          "snapshot and search index that make startup fast on large catalogues")
+    analytics_parser = subparsers.add_parser('analytics', help="print the circulation analytics and exit")
+    analytics_parser.add_argument('--period', choices=['day', 'week', 'month', 'all'], default='month')
+    analytics_parser.add_argument('--export', metavar='FOLDER',
+                                  help="also write the full lists as CSV files into this folder")
+    serve_parser = subparsers.add_parser('serve', help="run the HTTP/JSON library service")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    return parser.parse_args(argv)
+
 def main():
     """Main function to run the Library Management System."""
+    args = parse_args()
     ensure_data_dir_exists() # Ensure data directory exists on startup
+    instrumentation.log_to(METRICS_FILE)
+    if args.backend:
+        configure_store(open_repository(args.backend))
+    try:
+        branches.configure(args.branches, args.backend)
+    except ValueError as error: # A mistyped --branches or $LIBRARY_BRANCHES
+        raise SystemExit(f"Branches: {error}")
+    with instrumentation.profiled() if args.profile else contextlib.nullcontext():
+        run(args)
+
+def run(args):
+    """Runs the command given on the command line, or the interactive menu."""
+    if args.command == 'report':
+        if args.all_branches:
+            rm.generate_branch_report()
+        else:
+            rm.generate_library_report(verify=args.verify)
+        return
+    if args.command == 'import':
+        import_file(args.kind, args.feed)
+        return
+    if args.command == 'migrate-sqlite':
+        books, members, loans, holds = migrate_csv_to_sqlite()
+        print(f"Copied {books} books, {members} members, {loans} loans and {holds} holds into the SQLite database.")
+        print("Run with --backend sqlite or LIBRARY_BACKEND=sqlite to use it.")
+        return
+    if args.command == 'compact':
+        snapshot = get_store().compact(snapshot=True)
+        if snapshot:
+            print(f"Wrote binary snapshot '{snapshot}' ({os.path.getsize(snapshot) / 1e6:.1f} MB); "
+                  "later starts load from it while the CSV files are unchanged.")
+        else:
+            print("Storage compacted. The SQLite backend does not use binary snapshots.")
+        print("Saved the search index; later starts load it instead of rebuilding it.")
+        return
+    if args.command == 'analytics':
+        rm.display_circulation_analytics(args.period, export_folder=args.export)
+        return
+    if args.command == 'serve':
+        serve(args.host, args.port)
+        return
     
+    api.start_report_worker() # Keeps the report computed after changes, so option 9 opens at once
+
     while True:
         display_menu()
-        choice = input("Enter your choice (0-11): ").strip()
+        choice = input("Enter your choice (0-20): ").strip()
 
-        if choice == '1':
-            bm.display_all_books()
-        elif choice == '2':
-            bm.display_available_books()
-        elif choice == '3':
-            mm.display_all_members()
-        elif choice == '4':
-            bm.search_books()
-        elif choice == '5':
-            bm.borrow_a_book()
-        elif choice == '6':
-            bm.return_a_book()
-        elif choice == '7':
-            mm.view_member_borrowed_books()
-        elif choice == '8':
-            bm.view_overdue_books()
-        elif choice == '9':
-            rm.generate_library_report()
-        elif choice == '10':
-            bm.add_new_book()
-        elif choice == '11':
-            mm.register_new_member()
-        elif choice == '0':
-            print("Exiting Library Management System. Goodbye!")
-            break
-        else:
-            print("Invalid choice. Please enter a number between 0 and 11.")
+        with api.store_lock: # The report worker reads the store between actions only
+            if choice == '1':
+                bm.display_all_books()
+            elif choice == '2':
+                bm.display_available_books()
+            elif choice == '3':
+                mm.display_all_members()
+            elif choice == '4':
+                bm.search_books()
+            elif choice == '5':
+                bm.borrow_a_book()
+            elif choice == '6':
+                bm.return_a_book()
+            elif choice == '7':
+                mm.view_member_borrowed_books()
+            elif choice == '8':
+                bm.view_overdue_books()
+            elif choice == '9':
+                rm.generate_library_report()
+            elif choice == '10':
+                bm.add_new_book()
+            elif choice == '11':
+                mm.register_new_member()
+            elif choice == '12':
+                bm.batch_checkout()
+            elif choice == '13':
+                bm.batch_return()
+            elif choice == '14':
+                rm.display_performance_stats()
+            elif choice == '15':
+                rm.circulation_analytics()
+            elif choice == '16':
+                bm.place_a_hold()
+            elif choice == '17':
+                mm.view_member_holds()
+            elif choice == '18':
+                bm.search_all_branches()
+            elif choice == '19':
+                bm.find_copy_at_any_branch()
+            elif choice == '20':
+                rm.generate_branch_report()
+            elif choice == '0':
+                get_store().compact() # Fold the loans journal into the CSV files
+                print("Exiting Library Management System. Goodbye!")
+                break
+            else:
+                print("Invalid choice. Please enter a number between 0 and 20.")
         
         input("\nPress Enter to continue...") # Pause for user to read output
 
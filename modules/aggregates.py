@@ -0,0 +1,66 @@
+def _to_int(value):
+    """Converts a CSV counter to int, treating blanks and junk as 0."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class LibraryTotals:
+    """Running totals behind the summary sections of the library report.
+
+    LibraryStore updates them as books, members and loans change, so the
+    report never has to sum over every row. count() rebuilds them from the
+    rows for verification.
+    """
+
+    FIELDS = ['unique_books', 'total_copies', 'total_available',
+              'total_members', 'members_with_loans', 'active_loans']
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    @classmethod
+    def count(cls, books, members, loans):
+        """Computes the totals from scratch; 'books' is a BookTable."""
+        totals = cls()
+        # Sums over the typed count columns, no per-book parsing.
+        totals.unique_books = len(books)
+        totals.total_copies = sum(books.quantity)
+        totals.total_available = sum(books.available)
+        for _ in members:
+            totals.add_member()
+        totals.active_loans = len(loans)
+        totals.members_with_loans = len({loan['member_id'] for loan in loans})
+        return totals
+
+    def add_book(self, book):
+        self.unique_books += 1
+        self.total_copies += _to_int(book.get('quantity'))
+        self.total_available += _to_int(book.get('available'))
+
+    def add_member(self):
+        self.total_members += 1
+
+    def set_available(self, old_value, new_value):
+        """Records a change to one book's 'available' counter."""
+        self.total_available += _to_int(new_value) - _to_int(old_value)
+
+    def open_loan(self, first_for_member):
+        self.active_loans += 1
+        if first_for_member:
+            self.members_with_loans += 1
+
+    def close_loan(self, last_for_member):
+        self.active_loans -= 1
+        if last_for_member:
+            self.members_with_loans -= 1
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def drift(self, expected):
+        """Returns {field: (counted, expected)} for every field that disagrees."""
+        return {field: (getattr(self, field), getattr(expected, field))
+                for field in self.FIELDS if getattr(self, field) != getattr(expected, field)}
@@ -0,0 +1,376 @@
+"""Circulation analytics kept up to date from borrow and return events.
+
+Each borrow and return the store records is also appended as one JSON
+line to a circulation log (utils.CIRCULATION_LOG_FILE). The loans
+journal is folded away on compaction and loans.csv only holds open
+loans; this log is never truncated, so the lending history is kept.
+Circulation replays the log into:
+
+- lifetime counters per book (borrows, days on loan) and per member
+  (borrows, returns, last activity);
+- a Rollup per day, ISO week and month: borrows and returns, per book
+  and per member, plus the days each book spent on loan in the month.
+
+"Most borrowed this month" or "utilization per title" is then a look at
+one bucket, whatever the size of the history. The lifetime counters are
+saved to a rollup file (utils.CIRCULATION_ROLLUP_FILE) with the log
+offset they cover, so a start only replays the events written since.
+The buckets are saved one file per month (the days, the month, and the
+part of each week that falls in it) in a directory beside it, and a
+month's file is only read when that month is asked for or gets events.
+A save rewrites only the months that changed, so neither a start nor a
+save grows with the length of the history.
+
+Month files are written under a new name and only take effect when the
+rollup file naming them is replaced, so a crash part-way through a
+save leaves the previous save whole.
+"""
+import collections
+import datetime
+import json
+import os
+import threading
+from modules.instrumentation import instrumented, record_io
+from modules.storage import read_journal
+from utils import (save_json, ensure_data_dir_exists,
+                   CIRCULATION_LOG_FILE, CIRCULATION_ROLLUP_FILE)
+
+PERIODS = ['day', 'week', 'month']
+ROLLUP_EVERY = 1000 # Events replayed since the last save before compaction saves the rollup again
+
+
+def period_key(period, day):
+    """Returns the bucket key of a date: '2024-05-17', '2024-W20' or '2024-05'."""
+    if period == 'day':
+        return day.isoformat()
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == 'month':
+        return f"{day.year}-{day.month:02d}"
+    raise ValueError(f"Unknown period '{period}' (expected one of {', '.join(PERIODS)}).")
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def _next_month(day):
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+def _days_by_month(start, end):
+    """Yields (month key, days) for the days from start up to, not including, end."""
+    while start < end:
+        stop = min(end, _next_month(start))
+        yield period_key('month', start), (stop - start).days
+        start = stop
+
+
+class Rollup:
+    """Circulation counts for one day, week or month."""
+
+    __slots__ = ('borrows', 'returns', 'book_borrows', 'member_borrows', 'loan_days')
+
+    def __init__(self):
+        self.borrows = 0
+        self.returns = 0
+        self.book_borrows = collections.Counter() # book_id -> borrows
+        self.member_borrows = collections.Counter() # member_id -> borrows
+        self.loan_days = collections.Counter() # book_id -> days on loan (closed loans; months only)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, values):
+        rollup = cls()
+        rollup.borrows = values['borrows']
+        rollup.returns = values['returns']
+        for field in ('book_borrows', 'member_borrows', 'loan_days'):
+            setattr(rollup, field, collections.Counter(values[field]))
+        return rollup
+
+    @classmethod
+    def merged(cls, rollups):
+        """Returns one rollup adding up several, e.g. the two months' parts of a week."""
+        total = cls()
+        for rollup in rollups:
+            total.borrows += rollup.borrows
+            total.returns += rollup.returns
+            for field in ('book_borrows', 'member_borrows', 'loan_days'):
+                getattr(total, field).update(getattr(rollup, field))
+        return total
+
+
+def _empty_month():
+    return {period: {} for period in PERIODS}
+
+
+class Circulation:
+    """Counters and rollups replayed from the circulation log.
+
+    record() appends events; every query first reads what was appended
+    since, by this or any other process. Safe to share between threads.
+    """
+
+    def __init__(self, log_file=CIRCULATION_LOG_FILE, rollup_file=CIRCULATION_ROLLUP_FILE):
+        self.log_file = log_file
+        self.rollup_file = rollup_file
+        self.months_dir = os.path.splitext(rollup_file)[0] # data/circulation/ beside data/circulation.json
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._reset()
+
+    def _reset(self):
+        self._offset = 0 # Log bytes replayed so far
+        self._unsaved = 0 # Events replayed since the rollup file was written
+        self.first_day = None
+        self.book_borrows = collections.Counter()
+        self.book_loan_days = collections.Counter() # Closed loans only
+        self.member_borrows = collections.Counter()
+        self.member_returns = collections.Counter()
+        self.member_last_active = {} # member_id -> ISO date
+        self.open_loans = {} # loan_id -> [book_id, borrowed_on]
+        self._months = {} # month key -> {period: {key: Rollup}}, for the months read or changed so far
+        self._month_files = {} # month key -> its file in months_dir, as of the last load or save
+        self._dirty = set() # Months changed since their file was written
+        self._dates = {} # ISO date -> (date, month key, its [day, week, month] rollups); events share few dates
+
+    def _load_rollup(self):
+        """Starts from the saved rollup file, if there is a readable one."""
+        self._reset()
+        try:
+            with open(self.rollup_file, encoding='utf-8') as file:
+                saved = json.load(file)
+            self.first_day = saved['first_day'] and datetime.date.fromisoformat(saved['first_day'])
+            self.book_borrows = collections.Counter(saved['book_borrows'])
+            self.book_loan_days = collections.Counter(saved['book_loan_days'])
+            self.member_borrows = collections.Counter(saved['member_borrows'])
+            self.member_returns = collections.Counter(saved['member_returns'])
+            self.member_last_active = saved['member_last_active']
+            self.open_loans = saved['open_loans']
+            self._month_files = dict(saved['months'])
+            self._offset = saved['offset']
+        except (OSError, ValueError, KeyError, TypeError):
+            self._reset() # Missing, unreadable or from before month files: replay the whole log
+
+    def _month(self, month):
+        """Returns a month's buckets, {period: {key: Rollup}}, reading its file on first use."""
+        buckets = self._months.get(month)
+        if buckets is None:
+            buckets = self._months[month] = self._load_month(month)
+        return buckets
+
+    def _load_month(self, month):
+        name = self._month_files.get(month)
+        if name is None:
+            return _empty_month()
+        try:
+            with open(os.path.join(self.months_dir, name), encoding='utf-8') as file:
+                saved = json.load(file)
+            return {period: {key: Rollup.from_dict(values) for key, values in saved[period].items()}
+                    for period in PERIODS}
+        except (OSError, ValueError, KeyError, TypeError):
+            # Damaged, or replaced by another process's save since we read the
+            # rollup file: replay the month from the log up to where we are.
+            replayed = Circulation(self.log_file, self.rollup_file)
+            replayed._loaded = True # Nothing saved to start from
+            for event in read_journal(self.log_file, 0, self._offset)[0]:
+                replayed._apply(event)
+            return replayed._months.get(month) or _empty_month()
+
+    def _bucket(self, period, day):
+        """Returns the rollup of the day, week or month holding a date, or None."""
+        key = period_key(period, day)
+        if period != 'week':
+            return self._month(period_key('month', day))[period].get(key)
+        # A week can span two months, each holding the part in it.
+        monday = day - datetime.timedelta(days=day.weekday())
+        months = {period_key('month', monday), period_key('month', monday + datetime.timedelta(days=6))}
+        parts = [part for part in (self._month(month)['week'].get(key) for month in sorted(months)) if part]
+        return parts[0] if len(parts) == 1 else Rollup.merged(parts) if parts else None
+
+    def refresh(self):
+        """Replays the events appended to the log since the last call."""
+        with self._lock:
+            if not self._loaded:
+                self._load_rollup()
+                self._loaded = True
+            if os.path.exists(self.log_file) and os.path.getsize(self.log_file) < self._offset:
+                self._reset() # The log was replaced: start over from it
+            events, offset = read_journal(self.log_file, self._offset)
+            for event in events:
+                self._apply(event)
+            self._offset = offset # Only now: a month read meanwhile is replayed up to the events above
+            self._unsaved += len(events)
+
+    def _rollup(self, period, day):
+        buckets = self._month(period_key('month', day))[period]
+        key = period_key(period, day)
+        rollup = buckets.get(key)
+        if rollup is None:
+            rollup = buckets[key] = Rollup()
+        return rollup
+
+    def _dated(self, on):
+        """Returns (date, month key, [day, week, month rollups]) for an ISO date."""
+        dated = self._dates.get(on)
+        if dated is None:
+            day = datetime.date.fromisoformat(on)
+            dated = self._dates[on] = (day, period_key('month', day), [self._rollup(period, day) for period in PERIODS])
+        return dated
+
+    def _apply(self, event):
+        on = event['on']
+        day, month, rollups = self._dated(on)
+        self._dirty.add(month)
+        book_id, member_id = event['book_id'], event['member_id']
+        if self.first_day is None or day < self.first_day:
+            self.first_day = day
+        if on > self.member_last_active.get(member_id, ''):
+            self.member_last_active[member_id] = on
+        if event['op'] == 'borrow':
+            self.book_borrows[book_id] += 1
+            self.member_borrows[member_id] += 1
+            self.open_loans[event['loan_id']] = [book_id, on]
+            for rollup in rollups:
+                rollup.borrows += 1
+                rollup.book_borrows[book_id] += 1
+                rollup.member_borrows[member_id] += 1
+        else:
+            self.member_returns[member_id] += 1
+            self.open_loans.pop(event['loan_id'], None)
+            for rollup in rollups:
+                rollup.returns += 1
+            borrowed_on = datetime.date.fromisoformat(event['borrowed_on'])
+            days = (day - borrowed_on).days
+            if days <= 0:
+                return
+            self.book_loan_days[book_id] += days
+            if event['borrowed_on'][:7] == on[:7]: # Most loans start and end in one month
+                rollups[2].loan_days[book_id] += days
+                return
+            for month, days in _days_by_month(borrowed_on, day): # Split across the months it spans
+                buckets = self._month(month)['month']
+                rollup = buckets.get(month)
+                if rollup is None:
+                    rollup = buckets[month] = Rollup()
+                rollup.loan_days[book_id] += days
+                self._dirty.add(month)
+
+    @instrumented('analytics.record')
+    def record(self, events):
+        """Appends events to the log in one write.
+
+        Unlike the loans journal the log is not fsynced: losing the last
+        few events to a power cut costs some statistics, not a loan.
+        """
+        if not events:
+            return
+        ensure_data_dir_exists(os.path.dirname(self.log_file) or '.')
+        text = ''.join(json.dumps(event) + '\n' for event in events)
+        with open(self.log_file, mode='a', encoding='utf-8') as file:
+            file.write(text)
+        record_io(rows_written=len(events), bytes_written=len(text.encode('utf-8')))
+
+    def save(self, force=False):
+        """Writes the months that changed, then the counters and the log offset they cover to the rollup file.
+
+        Without force, only once ROLLUP_EVERY events were replayed since
+        the last save and only if this process has loaded the analytics.
+        Callers serialize saves across processes (LibraryStore.compact()
+        holds the repository's write lock).
+        """
+        with self._lock:
+            if not self._loaded and not force:
+                return False
+            self.refresh()
+            if self._unsaved < (1 if force else ROLLUP_EVERY):
+                return False
+            month_files = dict(self._month_files)
+            for month in sorted(self._dirty):
+                month_files[month] = name = f"{month}.{self._offset}.json"
+                save_json(os.path.join(self.months_dir, name), {
+                    period: {key: rollup.as_dict() for key, rollup in buckets.items()}
+                    for period, buckets in self._month(month).items()})
+            saved = {
+                'offset': self._offset,
+                'first_day': self.first_day and self.first_day.isoformat(),
+                'book_borrows': self.book_borrows,
+                'book_loan_days': self.book_loan_days,
+                'member_borrows': self.member_borrows,
+                'member_returns': self.member_returns,
+                'member_last_active': self.member_last_active,
+                'open_loans': self.open_loans,
+                'months': month_files,
+            }
+            save_json(self.rollup_file, saved) # The new month files take effect here
+            self._month_files = month_files
+            self._dirty.clear()
+            self._unsaved = 0
+            current = set(month_files.values())
+            for name in os.listdir(self.months_dir) if os.path.isdir(self.months_dir) else ():
+                if name not in current: # Superseded, or left by a save that did not finish
+                    os.remove(os.path.join(self.months_dir, name))
+            return True
+
+    # --- Queries ---
+
+    def totals(self, period, day):
+        """Returns (borrows, returns) in the period holding the date."""
+        with self._lock:
+            self.refresh()
+            rollup = self._bucket(period, day)
+            return (rollup.borrows, rollup.returns) if rollup else (0, 0)
+
+    def top_books(self, period=None, day=None, limit=50):
+        """Returns [(book_id, borrows)], most borrowed first, in a period or (period None) ever."""
+        with self._lock:
+            self.refresh()
+            if period is None:
+                return self.book_borrows.most_common(limit)
+            rollup = self._bucket(period, day)
+            return rollup.book_borrows.most_common(limit) if rollup else []
+
+    def top_members(self, period=None, day=None, limit=50):
+        """Returns [(member_id, borrows)], most active first, in a period or (period None) ever."""
+        with self._lock:
+            self.refresh()
+            if period is None:
+                return self.member_borrows.most_common(limit)
+            rollup = self._bucket(period, day)
+            return rollup.member_borrows.most_common(limit) if rollup else []
+
+    def member_activity(self, member_id):
+        """Returns a member's lifetime borrows and returns and last active date."""
+        with self._lock:
+            self.refresh()
+            return {'member_id': member_id, 'borrows': self.member_borrows[member_id],
+                    'returns': self.member_returns[member_id],
+                    'last_active': self.member_last_active.get(member_id)}
+
+    def utilization(self, month_day, today, copies):
+        """Returns [(book_id, loan_days, utilization)] for the month holding month_day, busiest first.
+
+        Utilization is the share of copy-days the book was out: days on
+        loan over copies(book_id) times the days of the month up to today.
+        Closed loans come from the month's rollup; loans still open count
+        from their borrow date (or the month's start) to today. Books with
+        no copies left are skipped.
+        """
+        with self._lock:
+            self.refresh()
+            start = _month_start(month_day)
+            end = min(_next_month(month_day), max(today, start + datetime.timedelta(days=1)))
+            rollup = self._bucket('month', month_day)
+            days = collections.Counter(rollup.loan_days) if rollup else collections.Counter()
+            for book_id, borrowed_on in self.open_loans.values():
+                overlap = (end - max(start, datetime.date.fromisoformat(borrowed_on))).days
+                if overlap > 0:
+                    days[book_id] += overlap
+        period_days = (end - start).days
+        rows = []
+        for book_id, loan_days in days.items():
+            count = copies(book_id)
+            if count > 0:
+                rows.append((book_id, loan_days, loan_days / (count * period_days)))
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
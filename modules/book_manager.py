@@ -1,27 +1,18 @@
-import datetime
-from utils import load_data, save_data, generate_id, BOOKS_FILE, MEMBERS_FILE
-
-BOOK_FIELDNAMES = ['id', 'title', 'author', 'isbn', 'quantity', 'available']
-
-def _get_books():
-    """Helper to load books data."""
-    return load_data(BOOKS_FILE)
-
-def _save_books(books):
-    """Helper to save books data."""
-    save_data(BOOKS_FILE, books, BOOK_FIELDNAMES)
+import modules.branches as branches
+import modules.library_api as api
+from modules.library_api import LibraryError, OutOfStockError, SEARCH_RESULT_LIMIT
+from modules.pager import page_through, api_pages, PAGE_SIZE
 
 def add_new_book():
     """Adds a new book to the system."""
-    books = _get_books()
     print("\n" + "="*40)
     print("           ADD NEW BOOK")
     print("="*40)
-    
+
     title = input("Enter title: ").strip()
     author = input("Enter author: ").strip()
     isbn = input("Enter ISBN: ").strip()
-    
+
     while True:
         try:
             quantity = int(input("Enter quantity: ").strip())
@@ -31,290 +22,344 @@ def add_new_book():
         except ValueError:
             print("Invalid quantity. Please enter a non-negative number.")
 
-    book_id = generate_id(books)
-    new_book = {
-        'id': book_id,
-        'title': title,
-        'author': author,
-        'isbn': isbn,
-        'quantity': str(quantity), # Store as string for CSV consistency
-        'available': str(quantity) # Store as string
-    }
-    books.append(new_book)
-    _save_books(books)
-    print(f"\nBook '{title}' added successfully with ID: {book_id}.")
+    book = api.add_book(title, author, isbn, quantity)
+    print(f"\nBook '{title}' added successfully with ID: {book['id']}.")
     print("="*40)
 
 def display_all_books():
-    """Displays all books in the library."""
-    books = _get_books()
+    """Displays all books in the library, one page at a time."""
     print("\n" + "="*60)
     print("               ALL BOOKS IN LIBRARY")
     print("="*60)
-    if not books:
+    total = api.library_totals()['unique_books']
+    if not total:
         print("No books in the library.")
         return
 
-    print(f"{'ID':<5} {'Title':<30} {'Author':<20} {'ISBN':<15} {'Qty':<5} {'Avail':<5}")
-    print("-" * 60)
-    for book in books:
-        print(f"{book['id']:<5} {book['title']:<30} {book['author']:<20} {book['isbn']:<15} {book['quantity']:<5} {book['available']:<5}")
-    print("="*60)
+    def print_page(books, page_number):
+        print(f"\nPage {page_number} of {-(-total // PAGE_SIZE)} ({total} books)")
+        print(f"{'ID':<5} {'Title':<30} {'Author':<20} {'ISBN':<15} {'Qty':<5} {'Avail':<5}")
+        print("-" * 60)
+        for book in books:
+            print(f"{book['id']:<5} {book['title']:<30} {book['author']:<20} {book['isbn']:<15} {book['quantity']:<5} {book['available']:<5}")
+        print("="*60)
+
+    page_through(api_pages(api.book_page, 'books'), print_page)
 
 def display_available_books():
-    """Displays only the available books."""
-    books = _get_books()
+    """Displays only the available books, one page at a time."""
     print("\n" + "="*60)
     print("             AVAILABLE BOOKS IN LIBRARY")
     print("="*60)
-    available_books = [b for b in books if int(b['available']) > 0]
-    if not available_books:
+    total = api.library_totals()['available_titles']
+    if not total:
         print("No books currently available.")
         return
 
-    print(f"{'ID':<5} {'Title':<30} {'Author':<20} {'ISBN':<15} {'Avail':<5}")
-    print("-" * 60)
-    for book in available_books:
-        print(f"{book['id']:<5} {book['title']:<30} {book['author']:<20} {book['isbn']:<15} {book['available']:<5}")
-    print("="*60)
+    def print_page(books, page_number):
+        print(f"\nPage {page_number} of {-(-total // PAGE_SIZE)} ({total} books available)")
+        print(f"{'ID':<5} {'Title':<30} {'Author':<20} {'ISBN':<15} {'Avail':<5}")
+        print("-" * 60)
+        for book in books:
+            print(f"{book['id']:<5} {book['title']:<30} {book['author']:<20} {book['isbn']:<15} {book['available']:<5}")
+        print("="*60)
+
+    page_through(api_pages(api.book_page, 'books', available_only=True), print_page)
 
 def search_books():
-    """Searches for books by title or author."""
-    books = _get_books()
+    """Searches for books by title, author or ISBN."""
     print("\n" + "="*40)
     print("             SEARCH BOOKS")
     print("="*40)
-    search_term = input("Enter title or author to search: ").strip().lower()
-    
-    found_books = [
-        book for book in books 
-        if search_term in book['title'].lower() or search_term in book['author'].lower()
-    ]
+    search_term = input("Enter title, author or ISBN to search: ").strip().lower()
+
+    found_books = api.search_books(search_term, limit=SEARCH_RESULT_LIMIT)
 
     if not found_books:
         print(f"No books found matching '{search_term}'.")
         return
 
-    print(f"\nBooks matching '{search_term}':")
+    print(f"\nBooks matching '{search_term}' (best matches first, up to {SEARCH_RESULT_LIMIT}):")
     print(f"{'ID':<5} {'Title':<30} {'Author':<20} {'ISBN':<15} {'Qty':<5} {'Avail':<5}")
     print("-" * 60)
     for book in found_books:
         print(f"{book['id']:<5} {book['title']:<30} {book['author']:<20} {book['isbn']:<15} {book['quantity']:<5} {book['available']:<5}")
     print("="*60)
 
+def _print_branch_errors(errors):
+    for branch, error in errors.items():
+        print(f"Branch '{branch}' could not be reached: {error}")
+
+def search_all_branches():
+    """Searches the catalogues of every branch for a title, author or ISBN."""
+    print("\n" + "="*70)
+    print("                   SEARCH ALL BRANCHES")
+    print("="*70)
+    search_term = input("Enter title, author or ISBN to search: ").strip().lower()
+
+    result = branches.search_books(search_term, limit=SEARCH_RESULT_LIMIT)
+    _print_branch_errors(result['errors'])
+    if not result['books']:
+        print(f"No books found matching '{search_term}' at any branch.")
+        return
+
+    print(f"\nBooks matching '{search_term}' (best matches first, up to {SEARCH_RESULT_LIMIT}):")
+    print(f"{'Branch':<10} {'ID':<5} {'Title':<30} {'Author':<20} {'ISBN':<15} {'Avail':<5}")
+    print("-" * 70)
+    for book in result['books']:
+        print(f"{book['branch']:<10} {book['id']:<5} {book['title']:<30} {book['author']:<20} {book['isbn']:<15} {book['available']:<5}")
+    print("="*70)
+
+def find_copy_at_any_branch():
+    """Shows which branches hold a title, by ISBN, and how many copies each has free."""
+    print("\n" + "="*70)
+    print("                 FIND A COPY AT ANY BRANCH")
+    print("="*70)
+    try:
+        result = branches.availability(input("Enter ISBN: ").strip())
+    except LibraryError as error:
+        print(error)
+        return
+    _print_branch_errors(result['errors'])
+    if not result['copies']:
+        print("No branch holds this ISBN.")
+        return
+
+    print(f"\n'{result['copies'][0]['title']}' by {result['copies'][0]['author']}:")
+    print(f"{'Branch':<10} {'Book ID':<8} {'Qty':<5} {'On shelf':<9} {'Held':<5} {'Free':<5}")
+    print("-" * 70)
+    for copy in result['copies']:
+        free = max(copy['available'] - copy['held'], 0)
+        print(f"{copy['branch']:<10} {copy['book_id']:<8} {copy['quantity']:<5} {copy['available']:<9} {copy['held']:<5} {free:<5}")
+    print("="*70)
+
 def borrow_a_book():
     """Handles borrowing a book."""
-    books = _get_books()
-    members = load_data(MEMBERS_FILE)
+    totals = api.library_totals()
 
     print("\n" + "="*40)
     print("             BORROW A BOOK")
     print("="*40)
 
-    if not books:
+    if not totals['unique_books']:
         print("No books in the library to borrow.")
         return
-    if not members:
+    if not totals['total_members']:
         print("No registered members to borrow books.")
         return
 
-    member_id = input("Enter Member ID: ").strip()
-    member = next((m for m in members if m['id'] == member_id), None)
-
-    if not member:
-        print(f"Member with ID '{member_id}' not found.")
+    try:
+        member = api.get_member(input("Enter Member ID: ").strip())
+        book_id = input("Enter Book ID: ").strip()
+        loan = api.borrow_book(member['id'], book_id)
+    except OutOfStockError as error:
+        print(error)
+        if input("Place a hold on it? (y/N): ").strip().lower() == 'y':
+            _place_hold(member['id'], book_id)
         return
-
-    book_id = input("Enter Book ID: ").strip()
-    book = next((b for b in books if b['id'] == book_id), None)
-
-    if not book:
-        print(f"Book with ID '{book_id}' not found.")
-        return
-
-    if int(book['available']) <= 0:
-        print(f"Book '{book['title']}' is currently out of stock.")
+    except LibraryError as error:
+        print(error)
         return
-    
-    # Update book availability
-    book['available'] = str(int(book['available']) - 1)
 
-    # Update member's borrowed books
-    if 'borrowed_books' not in member:
-        member['borrowed_books'] = []
-    else:
-        # Convert string representation of list back to list
-        # This is a bit hacky for CSV, better to have a separate borrowing log
-        # For simplicity, we'll assume it's a string representation of a list of book_id:borrow_date
-        if isinstance(member['borrowed_books'], str) and member['borrowed_books']:
-            member['borrowed_books'] = eval(member['borrowed_books'])
-        elif not member['borrowed_books']:
-             member['borrowed_books'] = []
-
-    borrow_date = datetime.date.today().isoformat()
-    member['borrowed_books'].append(f"{book_id}:{borrow_date}")
-    
-    # Convert list back to string for CSV storage
-    member['borrowed_books'] = str(member['borrowed_books'])
-    
-    _save_books(books)
-    save_data(MEMBERS_FILE, members, ['id', 'name', 'contact', 'borrowed_books']) # Ensure all member fields are saved
-
-    print(f"\nBook '{book['title']}' borrowed by '{member['name']}' successfully.")
-    print("New available quantity: ", book['available'])
+    print(f"\nBook '{loan['book']['title']}' borrowed by '{member['name']}' successfully.")
+    print("New available quantity: ", loan['book']['available'])
     print("="*40)
 
 
 def return_a_book():
     """Handles returning a book."""
-    books = _get_books()
-    members = load_data(MEMBERS_FILE)
+    totals = api.library_totals()
 
     print("\n" + "="*40)
     print("             RETURN A BOOK")
     print("="*40)
 
-    if not books:
+    if not totals['unique_books']:
         print("No books in the library.")
         return
-    if not members:
+    if not totals['total_members']:
         print("No registered members.")
         return
 
     member_id = input("Enter Member ID: ").strip()
-    member = next((m for m in members if m['id'] == member_id), None)
-
-    if not member:
-        print(f"Member with ID '{member_id}' not found.")
+    try:
+        member = api.get_member(member_id)
+    except LibraryError as error:
+        print(error)
         return
-    
-    # Handle the 'borrowed_books' string representation
-    borrowed_books_list = []
-    if 'borrowed_books' in member and isinstance(member['borrowed_books'], str) and member['borrowed_books']:
-        try:
-            borrowed_books_list = eval(member['borrowed_books'])
-        except (SyntaxError, NameError):
-            print("Error: Could not parse member's borrowed books data.")
-            member['borrowed_books'] = [] # Reset to empty list if parsing fails
-            borrowed_books_list = []
 
-    if not borrowed_books_list:
+    if not api.member_loans(member_id):
         print(f"Member '{member['name']}' has no borrowed books.")
         return
 
     print("\n" + "="*40)
     print(f"Borrowed books by {member['name']} (ID: {member_id}):")
-    
+
     display_member_borrowed_books(member_id)
 
     book_id_to_return = input("Enter Book ID to return: ").strip()
-    
-    book_entry_to_remove = None
-    for entry in borrowed_books_list:
-        if entry.startswith(f"{book_id_to_return}:"):
-            book_entry_to_remove = entry
-            break
+    try:
+        loan = api.return_book(member_id, book_id_to_return)
+    except LibraryError as error:
+        print(error)
+        return
+
+    print(f"\nBook '{loan['book']['title']}' returned by '{member['name']}' successfully.")
+    print("New available quantity: ", loan['book']['available'])
+    _print_holds_ready(loan['holds_ready'])
+    print("="*40)
+
+def _print_holds_ready(holds):
+    """Tells the desk which returned copies to set aside, and for whom."""
+    for hold in holds:
+        print(f"Set a copy of '{hold['title']}' aside for hold #{hold['hold_id']} "
+              f"({hold['member_name']}, ID: {hold['member_id']}) until {hold['expires_on']}.")
+
+def _scan_items():
+    """Reads book IDs or ISBNs one per line until a blank line."""
+    items = []
+    while True:
+        item = input(f"Scan or enter Book ID/ISBN #{len(items) + 1} (blank line to finish): ").strip()
+        if not item:
+            return items
+        items.append(item)
+
+def batch_checkout():
+    """Checks out several books to one member in a single transaction."""
+    print("\n" + "="*40)
+    print("            BATCH CHECKOUT")
+    print("="*40)
+
+    try:
+        member = api.get_member(input("Enter Member ID: ").strip())
+    except LibraryError as error:
+        print(error)
+        return
+
+    items = _scan_items()
+    if not items:
+        print("No books entered.")
+        return
+    try:
+        result = api.borrow_books(member['id'], items)
+    except LibraryError as error:
+        print("Nothing was borrowed:")
+        print(error)
+        return
+
+    print(f"\n{len(result['loans'])} books borrowed by '{member['name']}', due {result['loans'][0]['due_on']}:")
+    print(f"{'ID':<5} {'Title':<30} {'Avail':<5}")
+    print("-" * 40)
+    for book in result['books']:
+        print(f"{book['id']:<5} {book['title']:<30} {book['available']:<5}")
+    print("="*40)
+
+def batch_return():
+    """Takes back several books from one member in a single transaction."""
+    print("\n" + "="*40)
+    print("             BATCH RETURN")
+    print("="*40)
+
+    member_id = input("Enter Member ID: ").strip()
+    try:
+        member = api.get_member(member_id)
+    except LibraryError as error:
+        print(error)
+        return
+
+    if not api.member_loans(member_id):
+        print(f"Member '{member['name']}' has no borrowed books.")
+        return
+    display_member_borrowed_books(member_id)
 
-    if not book_entry_to_remove:
-        print(f"Book with ID '{book_id_to_return}' was not found in {member['name']}'s borrowed list.")
+    items = _scan_items()
+    if not items:
+        print("No books entered.")
+        return
+    try:
+        result = api.return_books(member_id, items)
+    except LibraryError as error:
+        print("Nothing was returned:")
+        print(error)
+        return
+
+    print(f"\n{len(result['loans'])} books returned by '{member['name']}':")
+    print(f"{'ID':<5} {'Title':<30} {'Avail':<5}")
+    print("-" * 40)
+    for book in result['books']:
+        print(f"{book['id']:<5} {book['title']:<30} {book['available']:<5}")
+    _print_holds_ready(result['holds_ready'])
+    print("="*40)
+
+def _place_hold(member_id, book_id):
+    try:
+        priority = int(input("Priority (blank for 0, higher is served first): ").strip() or 0)
+    except ValueError:
+        print("Invalid priority. Please enter a whole number.")
+        return
+    try:
+        hold = api.place_hold(member_id, book_id, priority)
+    except LibraryError as error:
+        print(error)
         return
+    if hold['status'] == 'ready':
+        print(f"\nA copy of '{hold['title']}' is set aside for '{hold['member_name']}' "
+              f"(hold #{hold['hold_id']}) until {hold['expires_on']}.")
+    else:
+        print(f"\nHold #{hold['hold_id']} placed: '{hold['member_name']}' is number {hold['position']} "
+              f"of {hold['queue_length']} waiting for '{hold['title']}'.")
 
-    book = next((b for b in books if b['id'] == book_id_to_remove), None)
+def place_a_hold():
+    """Puts a member in the queue for a book that is out."""
+    print("\n" + "="*40)
+    print("             PLACE A HOLD")
+    print("="*40)
 
-    if not book:
-        print(f"Book with ID '{book_id_to_return}' not found in library inventory. (Data inconsistency)")
+    try:
+        member = api.get_member(input("Enter Member ID: ").strip())
+    except LibraryError as error:
+        print(error)
         return
-    
-    # Remove from member's list
-    borrowed_books_list.remove(book_entry_to_remove)
-    member['borrowed_books'] = str(borrowed_books_list) # Save back as string
-
-    # Increase book availability
-    book['available'] = str(int(book['available']) + 1)
-    
-    _save_books(books)
-    save_data(MEMBERS_FILE, members, ['id', 'name', 'contact', 'borrowed_books']) # Ensure all member fields are saved
-
-    print(f"\nBook '{book['title']}' returned by '{member['name']}' successfully.")
-    print("New available quantity: ", book['available'])
+    _place_hold(member['id'], input("Enter Book ID: ").strip())
     print("="*40)
 
 def view_overdue_books():
-    """Displays books that are overdue (e.g., borrowed more than 14 days ago)."""
-    books = _get_books()
-    members = load_data(MEMBERS_FILE)
-    
+    """Displays books that are past their due date."""
     print("\n" + "="*60)
     print("                OVERDUE BOOKS REPORT")
     print("="*60)
 
-    overdue_found = False
-    today = datetime.date.today()
-    borrow_duration_limit = datetime.timedelta(days=14) # Example: 14 days limit
+    overdue = api.overdue_loans()
 
     print(f"{'Member ID':<10} {'Member Name':<20} {'Book Title':<30} {'Borrowed Date':<15} {'Overdue By (days)':<20}")
     print("-" * 100)
 
-    for member in members:
-        borrowed_books_list = []
-        if 'borrowed_books' in member and isinstance(member['borrowed_books'], str) and member['borrowed_books']:
-            try:
-                borrowed_books_list = eval(member['borrowed_books'])
-            except (SyntaxError, NameError):
-                pass # Skip if data is malformed
-
-        for entry in borrowed_books_list:
-            try:
-                book_id, borrow_date_str = entry.split(':')
-                borrow_date = datetime.date.fromisoformat(borrow_date_str)
-                
-                if today - borrow_date > borrow_duration_limit:
-                    book = next((b for b in books if b['id'] == book_id), None)
-                    if book:
-                        overdue_by_days = (today - borrow_date - borrow_duration_limit).days
-                        print(f"{member['id']:<10} {member['name']:<20} {book['title']:<30} {borrow_date_str:<15} {overdue_by_days:<20}")
-                        overdue_found = True
-            except (ValueError, IndexError):
-                # Handle malformed entry in borrowed_books
-                pass
-
-    if not overdue_found:
+    for loan in overdue:
+        print(f"{loan['member_id']:<10} {loan['member_name']:<20} {loan['book_title']:<30} {loan['borrowed_date']:<15} {loan['overdue_by_days']:<20}")
+
+    if not overdue:
         print("No overdue books found.")
     print("="*100)
 
 def display_member_borrowed_books(member_id):
     """Internal function to display a specific member's borrowed books."""
-    books = _get_books()
-    members = load_data(MEMBERS_FILE)
-
-    member = next((m for m in members if m['id'] == member_id), None)
-    if not member:
-        print(f"Member with ID '{member_id}' not found.")
+    try:
+        member = api.get_member(member_id)
+    except LibraryError as error:
+        print(error)
         return
 
-    borrowed_books_list = []
-    if 'borrowed_books' in member and isinstance(member['borrowed_books'], str) and member['borrowed_books']:
-        try:
-            borrowed_books_list = eval(member['borrowed_books'])
-        except (SyntaxError, NameError):
-            print("Error: Could not parse member's borrowed books data.")
-            return
+    borrowed_loans = api.member_loans(member_id)
 
-    if not borrowed_books_list:
+    if not borrowed_loans:
         print(f"Member '{member['name']}' has no books currently borrowed.")
         return
 
     print(f"{'Book ID':<10} {'Title':<30} {'Author':<20} {'Borrowed Date':<15}")
     print("-" * 75)
-    
-    for entry in borrowed_books_list:
-        try:
-            book_id, borrow_date_str = entry.split(':')
-            book = next((b for b in books if b['id'] == book_id), None)
-            if book:
-                print(f"{book['id']:<10} {book['title']:<30} {book['author']:<20} {borrow_date_str:<15}")
-        except (ValueError, IndexError):
-            # Skip malformed entries
-            pass
-    print("-" * 75)
 
+    for loan in borrowed_loans:
+        book = loan['book']
+        if book:
+            print(f"{book['id']:<10} {book['title']:<30} {book['author']:<20} {loan['borrowed_on']:<15}")
+    print("-" * 75)
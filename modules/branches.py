@@ -0,0 +1,191 @@
+"""Queries across every branch of the library at once.
+
+Each branch is a shard: the data directory one branch's main.py runs on
+(see utils.branches(); LIBRARY_BRANCHES or main.py --branches list
+them). A cross-branch query runs on all the shards in parallel, each in
+a worker process of its own (a one-process ProcessPoolExecutor per
+branch) that loads the branch's LibraryStore on first use and keeps it
+up to date after that, like any store. The parsing and searching of a
+large catalogue so runs beside the other branches' and outside the
+caller's process; the answers are merged here. The workers are started
+with 'spawn', not fork, as the caller may have other threads holding
+locks at the time (the HTTP service, the report worker). A branch that
+does not answer within BRANCH_TIMEOUT is reported like one that failed.
+
+Every branch's answer is also cached here against the signatures of
+the branch's data files (utils.shard_signature()), so asking again only
+reruns the query on the branches whose data changed since.
+"""
+import collections
+import datetime
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import modules.library_api as api
+from modules.instrumentation import instrumented
+from modules.library_api import InvalidRequestError, SEARCH_RESULT_LIMIT
+from modules.library_store import get_store, configure_store
+from modules.storage import open_repository
+from utils import branches, shard_signature
+
+CACHE_SIZE = 256 # Branch answers kept; the least recently used go first
+BRANCH_TIMEOUT = 60 # Seconds a query waits for the branches, loading a large one included
+
+_lock = threading.Lock() # Guards the state below; the HTTP service queries from several threads
+_spec = None # Branch list set by configure(); None: $LIBRARY_BRANCHES
+_backend = None
+_executors = {} # Branch -> its ProcessPoolExecutor
+_cache = collections.OrderedDict() # (branch, query, arguments) -> (shard signature, answer)
+
+
+def configure(spec=None, backend=None):
+    """Sets the branches to query, as utils.branches() takes them, instead of the environment's."""
+    global _spec, _backend
+    branches(spec, backend) # Fails now on a bad list rather than at the first query
+    with _lock:
+        _spec, _backend = spec, backend
+
+def branch_list():
+    """Returns the configured Branch shards."""
+    return branches(_spec, _backend)
+
+def shutdown():
+    """Stops the branch worker processes."""
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown()
+
+# --- In the branch worker processes ---
+
+def _open_branch(branch):
+    """Worker initializer: makes the branch's store the process-wide one."""
+    configure_store(open_repository(branch.backend, branch.data_dir))
+
+def _search(query, limit):
+    return [dict(book.as_dict(), score=score) for book, score in get_store().search_books(query, limit, scored=True)]
+
+def _availability(isbn):
+    store = get_store()
+    book = store.get_book_by_isbn(isbn)
+    return None if book is None else dict(book.as_dict(), held=store.held_copies(book['id']))
+
+def _report(today):
+    return api.library_report(today)
+
+# --- Here ---
+
+def _executor(branch):
+    with _lock:
+        executor = _executors.get(branch)
+        if executor is None:
+            executor = _executors[branch] = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_open_branch, initargs=(branch,))
+        return executor
+
+def _drop_executor(branch):
+    """Forgets a branch's worker, so the next query starts a fresh one instead of queueing behind it."""
+    with _lock:
+        executor = _executors.pop(branch, None)
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _run(query, *args):
+    """Runs query(*args) on every branch. Returns ({branch name: answer}, {branch name: error}).
+
+    Cached answers are used for branches whose data has not changed. A
+    branch that fails or takes longer than BRANCH_TIMEOUT is reported in
+    the errors and the others still answer.
+    """
+    answers, errors, pending = {}, {}, []
+    deadline = time.monotonic() + BRANCH_TIMEOUT
+    for branch in branch_list():
+        if not os.path.isdir(branch.data_dir):
+            errors[branch.name] = f"No data directory '{branch.data_dir}'."
+            continue
+        key = (branch, query.__name__, args)
+        signature = shard_signature(branch) # Taken first: a change made meanwhile shows at the next query
+        with _lock:
+            cached = _cache.get(key)
+            if cached is not None and cached[0] == signature:
+                _cache.move_to_end(key)
+                answers[branch.name] = cached[1]
+                continue
+        pending.append((branch, key, signature, _executor(branch).submit(query, *args)))
+    for branch, key, signature, future in pending:
+        try:
+            answer = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except TimeoutError:
+            _drop_executor(branch)
+            errors[branch.name] = f"No answer within {BRANCH_TIMEOUT} seconds."
+            continue
+        except BrokenProcessPool:
+            _drop_executor(branch)
+            errors[branch.name] = "The branch worker stopped unexpectedly."
+            continue
+        except Exception as error:
+            errors[branch.name] = str(error) or type(error).__name__
+            continue
+        answers[branch.name] = answer
+        with _lock:
+            _cache[key] = (signature, answer)
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    # In branch order, whichever answered first
+    order = {branch.name: index for index, branch in enumerate(branch_list())}
+    return dict(sorted(answers.items(), key=lambda item: order.get(item[0], len(order)))), errors
+
+@instrumented()
+def search_books(query, limit=SEARCH_RESULT_LIMIT):
+    """Searches every branch's catalogue.
+
+    Returns {'books': the best matches over all branches, each with its
+    'branch', 'errors': {branch: message} for branches that could not be
+    searched}.
+    """
+    answers, errors = _run(_search, query.strip().lower(), limit)
+    books = [dict(book, branch=name) for name, found in answers.items() for book in found]
+    books.sort(key=lambda book: book['score'], reverse=True) # Stable: equal scores stay in branch order
+    return {'books': books[:limit] if limit else books, 'errors': errors}
+
+@instrumented()
+def availability(isbn):
+    """Finds a title by ISBN at every branch.
+
+    Returns {'copies': [{'branch', 'book_id', 'title', 'quantity',
+    'available', 'held'}] for the branches that hold it, 'errors'}.
+    'held' copies are on the shelf but set aside for holds.
+    """
+    isbn = isbn.strip()
+    if not isbn:
+        raise InvalidRequestError("No ISBN given.")
+    answers, errors = _run(_availability, isbn)
+    copies = []
+    for name, book in answers.items():
+        if book is not None:
+            copies.append({'branch': name, 'book_id': book['id'], 'title': book['title'], 'author': book['author'],
+                           'quantity': book['quantity'], 'available': book['available'], 'held': book['held']})
+    return {'copies': copies, 'errors': errors}
+
+@instrumented()
+def library_report(today=None):
+    """Builds the library report of every branch and combines them.
+
+    Returns {'branches': [{'branch', 'overdue', the branch's totals}],
+    'totals': the totals summed, 'overdue': every overdue loan with its
+    'branch', earliest due first, 'errors'}.
+    """
+    answers, errors = _run(_report, today or datetime.date.today())
+    rows, totals, overdue = [], collections.Counter(), []
+    for name, report in answers.items():
+        rows.append(dict(report['totals'], branch=name, overdue=len(report['overdue'])))
+        totals.update(report['totals'])
+        overdue.extend(dict(loan, branch=name) for loan in report['overdue'])
+    overdue.sort(key=lambda loan: loan['due_date'])
+    return {'branches': rows, 'totals': dict(totals), 'overdue': overdue, 'errors': errors}
@@ -0,0 +1,129 @@
+import csv
+import os
+import time
+from modules.library_store import get_store
+from utils import file_delimiter, normalize_isbn
+
+REJECTS_SHOWN = 10 # Rejected rows echoed to the console; all of them go to the rejects file
+
+
+def _is_padding(row):
+    """True for a row with nothing in any field, like the ',,,' lines spreadsheets leave at the end."""
+    return not any(value.strip() for value in row.values() if isinstance(value, str))
+
+def _validate_book(row, seen):
+    """Returns (book fields, None) for a good feed row or (None, reason) for a bad one.
+
+    'seen' collects the normalized ISBNs accepted so far from this feed.
+    """
+    title = (row.get('title') or '').strip()
+    author = (row.get('author') or '').strip()
+    isbn = (row.get('isbn') or '').strip()
+    if not title:
+        return None, "missing title"
+    try:
+        quantity = int((row.get('quantity') or '').strip())
+        if quantity < 0:
+            raise ValueError
+    except ValueError:
+        return None, f"invalid quantity '{row.get('quantity')}'"
+    available = quantity
+    if (row.get('available') or '').strip():
+        try:
+            available = int(row['available'].strip())
+            if not 0 <= available <= quantity:
+                raise ValueError
+        except ValueError:
+            return None, f"invalid available count '{row.get('available')}'"
+    key = normalize_isbn(isbn)
+    if key:
+        if key in seen:
+            return None, f"duplicate ISBN {isbn} in feed"
+        seen.add(key)
+    return {'title': title, 'author': author, 'isbn': isbn,
+            'quantity': str(quantity), 'available': str(available)}, None
+
+def _stored_book(store, book):
+    """Returns why a validated book cannot be added to what is stored now, or None."""
+    if normalize_isbn(book['isbn']) in store.isbns():
+        return f"ISBN {book['isbn']} already in catalogue"
+    return None
+
+def _validate_member(row, seen):
+    """Returns (member fields, None) for a good feed row or (None, reason) for a bad one."""
+    name = (row.get('name') or '').strip()
+    if not name:
+        return None, "missing name"
+    return {'name': name, 'contact': (row.get('contact') or '').strip()}, None
+
+_IMPORTERS = { # kind -> (validate, check against what is stored, commit)
+    'books': (_validate_book, _stored_book, lambda store, rows: store.add_books(rows)),
+    'members': (_validate_member, lambda store, member: None, lambda store, rows: store.add_members(rows)),
+}
+
+def import_file(kind, feed_path):
+    """Streams a CSV feed of books or members into the library in one batched commit.
+
+    Rows are validated as they are read and empty ones skipped. Under the
+    store's write lock the accepted ones are then checked against what is
+    stored (so two imports at once cannot both add an ISBN) and get a block
+    of consecutive ids reserved from the entity's sequence. Rejected rows
+    are written to '<feed>.rejects.csv' with the reason. Returns
+    (imported, rejected) counts.
+    """
+    validate, stored, commit = _IMPORTERS[kind]
+    store = get_store()
+    started = time.perf_counter()
+
+    accepted = []
+    rejects = []
+    seen = set()
+    rows_read = 0
+
+    with open(feed_path, mode='r', newline='', encoding='utf-8') as feed:
+        reader = csv.DictReader(feed, delimiter=file_delimiter(feed_path))
+        reader.fieldnames = [name.strip() for name in reader.fieldnames or []] # 'title, author' finds 'author'
+        for row in reader:
+            if _is_padding(row):
+                continue
+            rows_read += 1
+            record, reason = validate(row, seen)
+            if record is None:
+                rejects.append((reader.line_num, reason, row))
+                continue
+            accepted.append((reader.line_num, record, row))
+
+    records = []
+    if accepted:
+        with store.write_lock():
+            # Checked against storage as it is now, with other writers kept out until the commit.
+            store.refresh()
+            for line_number, record, row in accepted:
+                reason = stored(store, record)
+                if reason:
+                    rejects.append((line_number, reason, row))
+                else:
+                    records.append(record)
+            if records:
+                first_id = store.reserve_ids(kind, len(records)) # One block for the whole feed
+                for record_id, record in enumerate(records, start=first_id):
+                    record['id'] = str(record_id)
+                commit(store, records)
+    rejects.sort(key=lambda reject: reject[0])
+    elapsed = time.perf_counter() - started
+
+    print(f"\nImported {len(records)} of {rows_read} {kind} rows from '{feed_path}' "
+          f"in {elapsed:.2f}s ({rows_read / elapsed if elapsed else 0:,.0f} rows/s).")
+    if rejects:
+        rejects_path = os.path.splitext(feed_path)[0] + '.rejects.csv'
+        with open(rejects_path, mode='w', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file)
+            writer.writerow(['line', 'reason'] + reader.fieldnames)
+            for line_number, reason, row in rejects:
+                writer.writerow([line_number, reason] + [row.get(field) for field in reader.fieldnames])
+        print(f"Rejected {len(rejects)} rows (details in '{rejects_path}'):")
+        for line_number, reason, _ in rejects[:REJECTS_SHOWN]:
+            print(f"  line {line_number}: {reason}")
+        if len(rejects) > REJECTS_SHOWN:
+            print(f"  ... and {len(rejects) - REJECTS_SHOWN} more")
+    return len(records), len(rejects)
@@ -0,0 +1,35 @@
+import bisect
+
+
+class DueDateIndex:
+    """Active loans ordered by due date.
+
+    Keys are (due_on, loan_id) tuples kept in a sorted list. ISO dates sort
+    the same as strings, so "overdue as of today" is a bisect to today's
+    date and a slice of everything before it.
+    """
+
+    def __init__(self, loans=()):
+        # Sorting once is far cheaper than an insort per loan when loading.
+        self._keys = sorted((loan['due_on'], loan['loan_id']) for loan in loans if loan.get('due_on'))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, loan):
+        """Indexes an active loan."""
+        if not loan.get('due_on'):
+            return # Nothing to order it by
+        bisect.insort(self._keys, (loan['due_on'], loan['loan_id']))
+
+    def remove(self, loan):
+        """Drops a loan from the index, if it is there."""
+        key = (loan.get('due_on'), loan['loan_id'])
+        position = bisect.bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def due_before(self, date_str):
+        """Returns ids of loans due strictly before an ISO date, earliest first."""
+        end = bisect.bisect_left(self._keys, (date_str,))
+        return [loan_id for _, loan_id in self._keys[:end]]
@@ -0,0 +1,170 @@
+"""Hold queues: members waiting for a copy of a book that is out.
+
+A hold is 'waiting' in its book's queue until a copy is free for it,
+then 'ready': one copy is set aside for the member until its pickup
+expiry (utils.HOLD_PICKUP_PERIOD). The store decides when; this module
+keeps the holds and their indexes:
+
+- per book, the waiting holds in a list sorted by Hold.queue_key()
+  (higher priority first, then first come), so placing or cancelling
+  is a bisect and a member's place in the queue is bisect_left() + 1;
+- per book, how many copies are set aside for ready holds;
+- a heap of ready holds by expiry date, so an expiry sweep only looks
+  at the holds that are due.
+
+Nothing here scans every hold or member. Holds are stored by the
+repository with the books and loans (see modules.storage.Repository): hold
+changes are entries like the loan ones, recorded together with the
+borrow or return that causes them. They hold new values, so applying
+one twice is harmless:
+
+    {'op': 'hold_place', 'hold': {...}}
+    {'op': 'hold_ready', 'hold_id': ..., 'book_id': ..., 'expires_on': ...}
+    {'op': 'hold_close', 'hold_id': ..., 'reason': 'fulfilled', 'cancelled' or 'expired'}
+"""
+import bisect
+import heapq
+from collections import Counter
+from modules.records import Hold
+
+HOLD_OPS = {'hold_place', 'hold_ready', 'hold_close'}
+
+
+class HoldQueues:
+    """The open holds of a data directory, indexed per book, per member and by expiry.
+
+    The store fills it with load() and keeps it current with apply(), as
+    it does its books and loans.
+    """
+
+    def __init__(self, rows=()):
+        self.load(rows)
+
+    def load(self, rows):
+        """Replaces every hold with rows of HOLD_FIELDNAMES values."""
+        self._holds = {} # hold_id -> Hold, open holds only
+        self._by_member = {} # member_id -> {hold_id: Hold}
+        self._waiting = {} # book_id -> sorted [(queue key, Hold)]
+        self._ready = Counter() # book_id -> copies set aside
+        self._expiry = [] # Heap of (expires_on, hold_id) of ready holds; stale entries are skipped
+        for hold in map(Hold.from_values, rows):
+            self._add(hold)
+
+    def holds(self):
+        """Returns the open holds, as rows to store."""
+        return list(self._holds.values())
+
+    # --- Indexes ---
+
+    def _add(self, hold):
+        self._holds[hold.hold_id] = hold
+        self._by_member.setdefault(hold.member_id, {})[hold.hold_id] = hold
+        if hold.status == 'ready':
+            self._ready[hold.book_id] += 1
+            heapq.heappush(self._expiry, (hold.expires_on, hold.hold_id))
+        else:
+            bisect.insort(self._waiting.setdefault(hold.book_id, []), (hold.queue_key(), hold))
+
+    def _unqueue(self, hold):
+        queue = self._waiting[hold.book_id]
+        del queue[bisect.bisect_left(queue, (hold.queue_key(),))]
+        if not queue:
+            del self._waiting[hold.book_id]
+
+    def apply(self, entry):
+        """Applies one hold entry (see HOLD_OPS)."""
+        if entry['op'] == 'hold_place':
+            if entry['hold']['hold_id'] not in self._holds:
+                self._add(Hold(entry['hold']))
+            return
+        hold = self._holds.get(entry['hold_id'])
+        if hold is None:
+            return # Already closed
+        if entry['op'] == 'hold_ready':
+            if hold.status != 'ready':
+                self._unqueue(hold)
+                hold.status = 'ready'
+                hold.expires_on = entry['expires_on']
+                self._ready[hold.book_id] += 1
+                heapq.heappush(self._expiry, (hold.expires_on, hold.hold_id))
+        elif entry['op'] == 'hold_close':
+            del self._holds[hold.hold_id]
+            member_holds = self._by_member[hold.member_id]
+            del member_holds[hold.hold_id]
+            if not member_holds:
+                del self._by_member[hold.member_id]
+            if hold.status == 'ready':
+                self._ready[hold.book_id] -= 1 # Its heap entry goes stale
+                if not self._ready[hold.book_id]:
+                    del self._ready[hold.book_id]
+            else:
+                self._unqueue(hold)
+
+    # --- Queries ---
+
+    def ids(self):
+        return self._holds.keys()
+
+    def get(self, hold_id):
+        return self._holds.get(hold_id)
+
+    def for_member(self, member_id):
+        """Returns the member's open holds, oldest first."""
+        return sorted(self._by_member.get(member_id, {}).values(), key=lambda hold: hold.queue_key()[1:])
+
+    def open_hold(self, member_id, book_id):
+        """Returns the member's open hold on a book, or None."""
+        return next((hold for hold in self._by_member.get(member_id, {}).values() if hold.book_id == book_id), None)
+
+    def position(self, hold):
+        """Returns a waiting hold's place in its book's queue (1 is next), or 0 for a ready hold."""
+        if hold.status == 'ready':
+            return 0
+        return bisect.bisect_left(self._waiting[hold.book_id], (hold.queue_key(),)) + 1
+
+    def queue_length(self, book_id):
+        return len(self._waiting.get(book_id, ()))
+
+    def next_waiting(self, book_id, count):
+        """Returns up to 'count' holds from the front of the book's queue."""
+        return [hold for _, hold in self._waiting.get(book_id, [])[:max(count, 0)]]
+
+    def ready_count(self, book_id):
+        """Returns how many copies of the book are set aside for ready holds."""
+        return self._ready.get(book_id, 0)
+
+    def reserved_for_others(self, book_id, member_id):
+        """Copies of the book set aside for holds of members other than this one."""
+        reserved = self.ready_count(book_id)
+        hold = self.open_hold(member_id, book_id) if reserved else None
+        return reserved - 1 if hold and hold.status == 'ready' else reserved
+
+    def expired(self, today):
+        """Returns the ready holds whose pickup expiry (ISO date) is before today, soonest first.
+
+        The heap is walked in order without popping, so a write that
+        loses its compare-and-swap and is retried finds them again.
+        """
+        while self._expiry and not self._current(*self._expiry[0]):
+            heapq.heappop(self._expiry) # Closed or re-dated since it was pushed
+        expired = []
+        candidates = [(self._expiry[0], 0)] if self._expiry else []
+        while candidates:
+            (expires_on, hold_id), index = heapq.heappop(candidates)
+            if expires_on >= today:
+                continue # Nothing below it is due either
+            hold = self._current(expires_on, hold_id)
+            if hold:
+                expired.append(hold)
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(self._expiry):
+                    heapq.heappush(candidates, (self._expiry[child], child))
+        return expired
+
+    def _current(self, expires_on, hold_id):
+        """Returns the hold an expiry heap entry stands for, or None if the entry is stale."""
+        hold = self._holds.get(hold_id)
+        return hold if hold and hold.status == 'ready' and hold.expires_on == expires_on else None
+
+    def __len__(self):
+        return len(self._holds)
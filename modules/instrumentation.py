@@ -0,0 +1,160 @@
+"""Timing and I/O counters for storage calls and library operations.
+
+Functions wrapped with @instrumented() are counted per name: calls, wall
+time (total and slowest), rows read, rows written and bytes written.
+Storage code reports its I/O with record_io(); the figures count towards
+every instrumented call in progress on the thread, so an operation's
+row and byte counts include those of the storage calls it made.
+
+The totals are kept in memory (stats(), stats_table()) for the
+"Performance stats" menu entry. After log_to(), each finished top-level
+call is also written as one JSON line to a metrics file that rotates at
+METRICS_MAX_BYTES. profiled() runs a block under cProfile and prints the
+hottest functions and the totals when it ends (main.py --profile).
+"""
+import contextlib
+import cProfile
+import datetime
+import functools
+import json
+import logging
+import logging.handlers
+import pstats
+import sys
+import threading
+import time
+
+METRICS_MAX_BYTES = 1024 * 1024 # Size at which the metrics file is rotated
+METRICS_BACKUPS = 3 # Rotated metrics files kept (metrics.log.1 ... .3)
+PROFILE_LINES = 25 # Functions listed in the profile summary
+
+_lock = threading.Lock() # Guards _stats; operations run on several threads in the service
+_stats = {} # name -> OperationStats
+_local = threading.local() # .stack: I/O counters of the calls in progress on this thread
+_metrics = logging.getLogger('library.metrics')
+_metrics.propagate = False
+_metrics.setLevel(logging.INFO)
+
+
+class OperationStats:
+    """Running totals for one instrumented name."""
+
+    __slots__ = ('name', 'calls', 'seconds', 'slowest', 'rows_read', 'rows_written', 'bytes_written')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.bytes_written = 0
+
+    def add(self, seconds, rows_read, rows_written, bytes_written):
+        self.calls += 1
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+        self.rows_read += rows_read
+        self.rows_written += rows_written
+        self.bytes_written += bytes_written
+
+    def as_dict(self):
+        return {'name': self.name, 'calls': self.calls, 'seconds': self.seconds,
+                'mean_ms': self.seconds * 1000 / self.calls if self.calls else 0.0,
+                'max_ms': self.slowest * 1000, 'rows_read': self.rows_read,
+                'rows_written': self.rows_written, 'bytes_written': self.bytes_written}
+
+
+def instrumented(name=None):
+    """Decorator that times each call and collects the I/O reported during it.
+
+    The name defaults to '<module>.<function>', e.g. 'storage.save_data'.
+    """
+    def decorate(function):
+        label = name or f"{function.__module__.rsplit('.', 1)[-1]}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stack = getattr(_local, 'stack', None)
+            if stack is None:
+                stack = _local.stack = []
+            counters = [0, 0, 0] # rows read, rows written, bytes written
+            stack.append(counters)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                stack.pop()
+                with _lock:
+                    stats = _stats.get(label)
+                    if stats is None:
+                        stats = _stats[label] = OperationStats(label)
+                    stats.add(elapsed, *counters)
+                if not stack and _metrics.handlers:
+                    _log(label, elapsed, counters)
+        return wrapper
+    return decorate
+
+def record_io(rows_read=0, rows_written=0, bytes_written=0):
+    """Adds I/O to every instrumented call in progress on this thread."""
+    for counters in getattr(_local, 'stack', ()):
+        counters[0] += rows_read
+        counters[1] += rows_written
+        counters[2] += bytes_written
+
+def _log(name, seconds, counters):
+    rows_read, rows_written, bytes_written = counters
+    _metrics.info(json.dumps({
+        'time': datetime.datetime.now().isoformat(timespec='milliseconds'), 'op': name,
+        'ms': round(seconds * 1000, 3), 'rows_read': rows_read,
+        'rows_written': rows_written, 'bytes_written': bytes_written,
+    }))
+
+def log_to(file_path, max_bytes=METRICS_MAX_BYTES, backups=METRICS_BACKUPS):
+    """Starts writing a JSON line per finished top-level call to a rotating metrics file."""
+    for handler in list(_metrics.handlers):
+        _metrics.removeHandler(handler)
+        handler.close()
+    handler = logging.handlers.RotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backups,
+                                                   encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    _metrics.addHandler(handler)
+
+def stats():
+    """Returns the totals per name as dicts, most total time first."""
+    with _lock:
+        rows = [stats.as_dict() for stats in _stats.values()]
+    return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+def reset():
+    """Forgets every total collected so far."""
+    with _lock:
+        _stats.clear()
+
+def stats_table():
+    """Returns the totals as lines of a text table, ready to print."""
+    lines = [f"{'Operation':<32} {'Calls':>7} {'Total s':>9} {'Mean ms':>9} {'Max ms':>9} "
+             f"{'Rows read':>10} {'Rows written':>12} {'Bytes written':>13}",
+             "-" * 108]
+    for row in stats():
+        lines.append(f"{row['name']:<32} {row['calls']:>7} {row['seconds']:>9.3f} {row['mean_ms']:>9.2f} "
+                     f"{row['max_ms']:>9.2f} {row['rows_read']:>10} {row['rows_written']:>12} "
+                     f"{row['bytes_written']:>13}")
+    return lines
+
+@contextlib.contextmanager
+def profiled(lines=PROFILE_LINES, stream=None):
+    """Runs the block under cProfile, then prints its hottest functions and the totals."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        stream = stream or sys.stdout
+        print("\n" + "=" * 108, file=stream)
+        print(f"Profile: top {lines} functions by cumulative time", file=stream)
+        print("=" * 108, file=stream)
+        pstats.Stats(profiler, stream=stream).strip_dirs().sort_stats('cumulative').print_stats(lines)
+        print("\n".join(stats_table()), file=stream)
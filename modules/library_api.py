@@ -0,0 +1,435 @@
+"""Library operations without any input() or print().
+
+The menu and the HTTP service (modules/library_service.py) are both
+clients of these functions. Results are plain dicts and lists, ready to
+print or to send as JSON. Problems a user can fix are raised as
+LibraryError (or the subclasses below), whose message is meant to be
+shown as it is. Every operation is timed by modules/instrumentation.py.
+
+The library report and the overdue list are memoized against the
+store's data version and the date. start_report_worker() keeps them
+computed in the background, so opening the report right after a change
+does not wait for it.
+"""
+import datetime
+import functools
+import os
+import threading
+import time
+from modules.analytics import PERIODS, period_key
+from modules.instrumentation import instrumented
+from modules.library_store import get_store, LibraryError, OutOfStockError
+from modules.storage import save_data
+
+SEARCH_RESULT_LIMIT = 50 # Most matches returned by one search
+TOP_LIMIT = 50 # Rows in a most-borrowed or most-active list
+REPORT_CACHE_SIZE = 16 # (data version, date) pairs whose report and overdue list are kept
+PRECOMPUTE_INTERVAL = 0.5 # Seconds between the report worker's looks for changes
+
+# Held by the menu around each action and by the report worker while it
+# reads the store, so the worker never reads it mid-change.
+store_lock = threading.RLock()
+_precomputed = None # (data version, date) the report worker last brought the cache up to
+
+
+class NotFoundError(LibraryError):
+    """A member, book or loan that does not exist."""
+
+
+class InvalidRequestError(LibraryError):
+    """Input that can never be valid, such as a negative quantity."""
+
+
+def _row(record):
+    return record.as_dict() if hasattr(record, 'as_dict') else dict(record)
+
+def _quantity(value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise InvalidRequestError("Invalid quantity. Please enter a non-negative number.") from None
+    if quantity < 0:
+        raise InvalidRequestError("Invalid quantity. Please enter a non-negative number.")
+    return quantity
+
+# --- Books ---
+
+@instrumented()
+def get_book(book_id):
+    """Returns a book, or raises NotFoundError."""
+    book = get_store().get_book(book_id)
+    if not book:
+        raise NotFoundError(f"Book with ID '{book_id}' not found.")
+    return _row(book)
+
+@instrumented()
+def book_page(start=0, size=20, available_only=False):
+    """Returns {'books': [...], 'next_start': position of the next page or None}."""
+    books, next_start = get_store().book_page(start, size, available_only=available_only)
+    return {'books': [_row(book) for book in books], 'next_start': next_start}
+
+@instrumented()
+def search_books(query, limit=SEARCH_RESULT_LIMIT):
+    """Returns books matching every word of the query, best match first."""
+    return [_row(book) for book in get_store().search_books(query.strip().lower(), limit=limit)]
+
+@instrumented()
+def add_book(title, author, isbn, quantity):
+    """Adds a book with all its copies on the shelf. Returns the new book."""
+    quantity = _quantity(quantity)
+    store = get_store()
+    book = {
+        'id': str(store.reserve_ids('books')),
+        'title': title.strip(),
+        'author': author.strip(),
+        'isbn': isbn.strip(),
+        'quantity': str(quantity), # Store as string for CSV consistency
+        'available': str(quantity),
+    }
+    store.add_book(book)
+    return get_book(book['id'])
+
+# --- Members ---
+
+@instrumented()
+def get_member(member_id):
+    """Returns a member, or raises NotFoundError."""
+    member = get_store().get_member(member_id)
+    if not member:
+        raise NotFoundError(f"Member with ID '{member_id}' not found.")
+    return _row(member)
+
+@instrumented()
+def member_page(start=0, size=20):
+    """Returns {'members': [...], 'next_start': position of the next page or None}."""
+    members, next_start = get_store().member_page(start, size)
+    return {'members': [_row(member) for member in members], 'next_start': next_start}
+
+@instrumented()
+def register_member(name, contact):
+    """Registers a new member. Returns the member."""
+    store = get_store()
+    member = {'id': str(store.reserve_ids('members')), 'name': name.strip(), 'contact': contact.strip()}
+    store.add_member(member)
+    return get_member(member['id'])
+
+@instrumented()
+def member_loans(member_id):
+    """Returns the member's active loans, each with its 'book' (None if the book is gone)."""
+    store = get_store()
+    get_member(member_id)
+    loans = []
+    for loan in store.loans_for_member(member_id):
+        book = store.get_book(loan['book_id'])
+        loans.append(dict(_row(loan), book=_row(book) if book else None))
+    return loans
+
+# --- Loans ---
+
+@instrumented()
+def borrow_book(member_id, book_id):
+    """Lends a copy of a book to a member. Returns {'loan', 'member', 'book'} after the change."""
+    store = get_store()
+    member = get_member(member_id)
+    book = store.get_book(book_id)
+    if not book:
+        raise NotFoundError(f"Book with ID '{book_id}' not found.")
+    loan = store.borrow(member, book)
+    return {'loan': _row(loan), 'member': member, 'book': get_book(book_id)}
+
+@instrumented()
+def return_book(member_id, book_id):
+    """Takes back the member's copy of a book. Returns {'loan', 'member', 'book'} after the change."""
+    store = get_store()
+    member = get_member(member_id)
+    loan = next((loan for loan in store.loans_for_member(member_id) if loan['book_id'] == book_id), None)
+    if not loan:
+        raise NotFoundError(f"Book with ID '{book_id}' was not found in {member['name']}'s borrowed list.")
+    if not store.get_book(book_id):
+        raise NotFoundError(f"Book with ID '{book_id}' not found in library inventory. (Data inconsistency)")
+    ready = store.return_loan(loan)
+    return {'loan': _row(loan), 'member': member, 'book': get_book(book_id), 'holds_ready': _holds(store, ready)}
+
+def _resolve_items(store, items):
+    """Maps scanned book ids or ISBNs to books. Returns (books, problems)."""
+    books, problems = [], []
+    for item in items:
+        item = str(item).strip()
+        book = store.get_book(item) or store.get_book_by_isbn(item)
+        if book:
+            books.append(book)
+        else:
+            problems.append(f"No book with ID or ISBN '{item}'.")
+    return books, problems
+
+@instrumented()
+def borrow_books(member_id, items):
+    """Checks out several books (ids or ISBNs) to one member, all or nothing, in one write.
+
+    Returns {'member', 'loans', 'books'}; raises LibraryError listing every
+    item that cannot be lent, in which case nothing is lent.
+    """
+    store = get_store()
+    member = get_member(member_id)
+    if not items:
+        raise InvalidRequestError("No books given.")
+    books, problems = _resolve_items(store, items)
+    if problems:
+        raise NotFoundError("\n".join(problems))
+    loans = store.borrow_many(member, books)
+    return {'member': member, 'loans': [_row(loan) for loan in loans],
+            'books': [get_book(book_id) for book_id in dict.fromkeys(loan['book_id'] for loan in loans)]}
+
+@instrumented()
+def return_books(member_id, items):
+    """Takes back several books (ids or ISBNs) from one member, all or nothing, in one write.
+
+    Each item closes one of the member's loans of that book, oldest first.
+    Returns {'member', 'loans', 'books', 'holds_ready'}, the last being the
+    holds the returned copies were set aside for.
+    """
+    store = get_store()
+    member = get_member(member_id)
+    if not items:
+        raise InvalidRequestError("No books given.")
+    books, problems = _resolve_items(store, items)
+    open_loans = {} # book_id -> the member's loans of it not yet picked
+    for loan in store.loans_for_member(member_id):
+        open_loans.setdefault(loan['book_id'], []).append(loan)
+    loans = []
+    for book in books:
+        if open_loans.get(book['id']):
+            loans.append(open_loans[book['id']].pop(0))
+        else:
+            problems.append(f"Book with ID '{book['id']}' was not found in {member['name']}'s borrowed list.")
+    if problems:
+        raise NotFoundError("\n".join(problems))
+    ready = store.return_many(loans)
+    return {'member': member, 'loans': [_row(loan) for loan in loans],
+            'books': [get_book(book_id) for book_id in dict.fromkeys(loan['book_id'] for loan in loans)],
+            'holds_ready': _holds(store, ready)}
+
+# --- Holds ---
+
+def _hold(store, hold, position=0, queue_length=0):
+    """A hold as a dict, with the member's name, the book's title and its place in the queue."""
+    member = store.get_member(hold['member_id'])
+    book = store.get_book(hold['book_id'])
+    return dict(_row(hold), member_name=member['name'] if member else '',
+                title=book['title'] if book else '', position=position, queue_length=queue_length)
+
+def _holds(store, holds):
+    return [_hold(store, hold) for hold in holds]
+
+@instrumented()
+def place_hold(member_id, book_id, priority=0):
+    """Puts a member in the queue for a book. Returns the hold, 'ready' if a copy was free."""
+    store = get_store()
+    member = get_member(member_id)
+    book = get_book(book_id)
+    try:
+        priority = int(priority)
+    except (TypeError, ValueError):
+        raise InvalidRequestError("Invalid priority. Please enter a whole number.") from None
+    hold = store.place_hold(member, book, priority)
+    return _hold(store, hold, *store.hold_position(hold))
+
+@instrumented()
+def member_holds(member_id):
+    """Returns the member's open holds, oldest first, with their place in the queue (0 once ready)."""
+    store = get_store()
+    get_member(member_id)
+    return [_hold(store, hold, position, queue_length)
+            for hold, position, queue_length in store.holds_for_member(member_id)]
+
+@instrumented()
+def cancel_hold(member_id, hold_id):
+    """Cancels one of the member's holds. Returns the hold as it was."""
+    store = get_store()
+    member = get_member(member_id)
+    hold = store.get_hold(str(hold_id).strip())
+    if not hold or hold['member_id'] != member_id:
+        raise NotFoundError(f"Hold '{hold_id}' was not found in {member['name']}'s holds.")
+    store.cancel_hold(hold)
+    return _hold(store, hold)
+
+@instrumented()
+def expire_holds():
+    """Closes the ready holds not picked up in time. Returns them."""
+    store = get_store()
+    return _holds(store, store.expire_holds())
+
+@instrumented()
+def overdue_loans(today=None):
+    """Returns the overdue loans, earliest due first, with member name and book title.
+
+    Unless the data changed since, the rows are the ones computed last
+    time for the same date; treat them as read-only.
+    """
+    today = today or datetime.date.today()
+    with get_store().pinned() as store: # So the rows cached are the ones of this version
+        return list(_overdue_loans(store.data_version(), today))
+
+@functools.lru_cache(maxsize=REPORT_CACHE_SIZE)
+def _overdue_loans(version, today):
+    store = get_store()
+    overdue = []
+    for loan in store.overdue_loans(today):
+        member = store.get_member(loan['member_id'])
+        book = store.get_book(loan['book_id'])
+        if member and book:
+            overdue.append({
+                'member_id': member['id'],
+                'member_name': member['name'],
+                'book_id': book['id'],
+                'book_title': book['title'],
+                'borrowed_date': loan['borrowed_on'],
+                'due_date': loan['due_on'],
+                'overdue_by_days': (today - datetime.date.fromisoformat(loan['due_on'])).days,
+            })
+    return tuple(overdue)
+
+# --- Reports ---
+
+@instrumented()
+def library_totals():
+    """Returns the running library totals, plus how many titles have a copy on the shelf."""
+    with get_store().pinned() as store:
+        totals = store.totals().as_dict()
+        totals['total_borrowed'] = totals['total_copies'] - totals['total_available']
+        totals['available_titles'] = store.available_book_count()
+    return totals
+
+@instrumented()
+def library_report(today=None):
+    """Returns {'totals': library_totals(), 'overdue': overdue_loans()}, memoized like overdue_loans()."""
+    today = today or datetime.date.today()
+    with get_store().pinned() as store:
+        report = _library_report(store.data_version(), today)
+    return {'totals': dict(report['totals']), 'overdue': list(report['overdue'])}
+
+@functools.lru_cache(maxsize=REPORT_CACHE_SIZE)
+def _library_report(version, today):
+    # Called inside library_report()'s pinned() block, so the totals and the
+    # overdue rows come from the state 'version' names: a write landing in
+    # between must not be cached under this version's key.
+    return {'totals': library_totals(), 'overdue': _overdue_loans(version, today)}
+
+def precompute_reports(today=None):
+    """Computes the library report for the current data and date unless that is done already.
+
+    Returns True if it had to compute it.
+    """
+    global _precomputed
+    with store_lock:
+        key = (get_store().data_version(), today or datetime.date.today())
+        if key == _precomputed:
+            return False
+        library_report(key[1])
+        _precomputed = key
+        return True
+
+def start_report_worker(interval=PRECOMPUTE_INTERVAL):
+    """Starts a daemon thread that recomputes the report after changes, here or at other terminals."""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                precompute_reports()
+            except (LibraryError, OSError):
+                pass # Storage busy or unreadable for now: try again next time
+
+    thread = threading.Thread(target=run, name='report-worker', daemon=True)
+    thread.start()
+    return thread
+
+@instrumented()
+def verify_totals():
+    """Recounts the totals from the raw rows. Returns {field: [running, recounted]} for any drift."""
+    store = get_store()
+    return {field: list(values) for field, values in store.totals().drift(store.recount_totals()).items()}
+
+# --- Circulation analytics ---
+
+def _period(period):
+    """Checks a period name; 'all' (lifetime) becomes None."""
+    if period == 'all':
+        return None
+    if period not in PERIODS:
+        raise InvalidRequestError(f"Unknown period '{period}'. Use all, {', '.join(PERIODS)}.")
+    return period
+
+@instrumented()
+def circulation_summary(period='month', on=None):
+    """Returns {'period', 'key', 'borrows', 'returns'} for the day, week or month holding 'on'."""
+    on = on or datetime.date.today()
+    period = _period(period) or 'month'
+    borrows, returns = get_store().circulation().totals(period, on)
+    return {'period': period, 'key': period_key(period, on), 'borrows': borrows, 'returns': returns}
+
+@instrumented()
+def top_books(period='month', on=None, limit=TOP_LIMIT):
+    """Returns the most borrowed books in a period ('all' for ever), with their borrow counts."""
+    store = get_store()
+    top = store.circulation().top_books(_period(period), on or datetime.date.today(), limit)
+    books = []
+    for book_id, borrows in top:
+        book = store.get_book(book_id)
+        books.append({'book_id': book_id, 'title': book['title'] if book else '',
+                      'author': book['author'] if book else '', 'borrows': borrows})
+    return books
+
+@instrumented()
+def top_members(period='month', on=None, limit=TOP_LIMIT):
+    """Returns the members who borrowed most in a period ('all' for ever), with their counts."""
+    store = get_store()
+    top = store.circulation().top_members(_period(period), on or datetime.date.today(), limit)
+    members = []
+    for member_id, borrows in top:
+        member = store.get_member(member_id)
+        members.append({'member_id': member_id, 'name': member['name'] if member else '', 'borrows': borrows})
+    return members
+
+@instrumented()
+def member_activity(member_id):
+    """Returns a member's lifetime borrows, returns and last active date, or raises NotFoundError."""
+    get_member(member_id)
+    return get_store().circulation().member_activity(member_id)
+
+@instrumented()
+def book_utilization(on=None, limit=TOP_LIMIT):
+    """Returns the busiest titles of the month holding 'on': share of copy-days out on loan."""
+    store = get_store()
+    today = datetime.date.today()
+
+    def copies(book_id):
+        book = store.get_book(book_id)
+        return book['quantity'] if book else 0
+
+    books = []
+    for book_id, loan_days, utilization in store.circulation().utilization(on or today, today, copies)[:limit]:
+        book = store.get_book(book_id)
+        books.append({'book_id': book_id, 'title': book['title'], 'copies': book['quantity'],
+                      'loan_days': loan_days, 'utilization': round(utilization, 4)})
+    return books
+
+ANALYTICS_EXPORTS = { # file name -> (function(period, on), columns)
+    'top_books.csv': (lambda period, on: top_books(period, on, limit=None),
+                      ['book_id', 'title', 'author', 'borrows']),
+    'top_members.csv': (lambda period, on: top_members(period, on, limit=None),
+                        ['member_id', 'name', 'borrows']),
+    'utilization.csv': (lambda period, on: book_utilization(on, limit=None),
+                        ['book_id', 'title', 'copies', 'loan_days', 'utilization']),
+}
+
+@instrumented()
+def export_analytics(folder, period='month', on=None):
+    """Writes the full analytics lists to CSV files in a folder. Returns the paths written."""
+    _period(period)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for file_name, (rows, fieldnames) in ANALYTICS_EXPORTS.items():
+        path = os.path.join(folder, file_name)
+        save_data(path, rows(period, on), fieldnames)
+        paths.append(path)
+    return paths
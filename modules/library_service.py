@@ -0,0 +1,334 @@
+"""Local HTTP/JSON service over modules/library_api.py.
+
+One process owns the in-memory library and serves many front-desk and
+self-checkout clients at once (python main.py serve):
+
+    GET  /books?start=0&size=20&available=1   GET  /books/search?q=...&limit=50
+    GET  /books/<id>                           POST /books    {title, author, isbn, quantity}
+    GET  /members?start=0&size=20              GET  /members/<id>
+    GET  /members/<id>/loans                   POST /members  {name, contact}
+    POST /loans    {member_id, book_id}        POST /returns  {member_id, book_id}
+    POST /loans/batch   {member_id, items}     POST /returns/batch  {member_id, items}
+    GET  /overdue?date=YYYY-MM-DD              GET  /report?verify=1
+    GET  /totals                               GET  /members/<id>/activity
+    GET  /analytics/summary?period=month&date=YYYY-MM-DD
+    GET  /analytics/top-books?period=month&date=YYYY-MM-DD&limit=50   (period: all, day, week, month)
+    GET  /analytics/top-members?period=month&date=YYYY-MM-DD&limit=50
+    GET  /analytics/utilization?date=YYYY-MM-DD&limit=50
+    POST /holds    {member_id, book_id, priority}   GET  /members/<id>/holds
+    POST /holds/<id>/cancel    {member_id}
+    GET  /branches/search?q=...&limit=50       GET  /branches/availability?isbn=...
+    GET  /branches/report?date=YYYY-MM-DD      (every branch, see modules/branches.py)
+
+Requests run on a thread pool behind a read/write lock: reads run side
+by side, writes one at a time with no read in progress. Changes made by
+other processes on the same data are picked up every REFRESH_INTERVAL
+seconds, also under the write side of the lock; every HOLD_SWEEP_INTERVAL
+seconds, holds not picked up in time are closed as well. Cross-branch
+queries never touch this process's store and skip the lock, so a slow
+branch holds up no one else.
+"""
+import asyncio
+import contextlib
+import datetime
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+import modules.branches as branches
+import modules.library_api as api
+from modules.library_api import LibraryError, NotFoundError, InvalidRequestError
+from modules.library_store import get_store
+
+REFRESH_INTERVAL = 1.0 # Seconds between picking up changes made by other processes
+HOLD_SWEEP_INTERVAL = 60.0 # Seconds between closing ready holds past their pickup expiry
+MAX_BODY_BYTES = 1024 * 1024
+WORKER_THREADS = 8
+
+
+class ReadWriteLock:
+    """asyncio lock for many readers or one writer. A waiting writer holds off new readers."""
+
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextlib.asynccontextmanager
+    async def reading(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writer and not self._writers_waiting)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def writing(self):
+        async with self._condition:
+            self._writers_waiting += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writer and not self._readers)
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def _field(body, name):
+    value = body.get(name)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise InvalidRequestError(f"Missing '{name}'.")
+    return str(value)
+
+def _items(body):
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        raise InvalidRequestError("'items' must be a non-empty list of book IDs or ISBNs.")
+    return [str(item) for item in items]
+
+def _int_param(query, name, default, minimum=None):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise InvalidRequestError(f"'{name}' must be a whole number.") from None
+    if minimum is not None and value < minimum:
+        raise InvalidRequestError(f"'{name}' must be at least {minimum}.")
+    return value
+
+def _date_param(query):
+    if 'date' not in query:
+        return None
+    try:
+        return datetime.date.fromisoformat(query['date'])
+    except ValueError:
+        raise InvalidRequestError("'date' must be YYYY-MM-DD.") from None
+
+def _priority(body):
+    try:
+        return int(body.get('priority', 0))
+    except (TypeError, ValueError):
+        raise InvalidRequestError("'priority' must be a whole number.") from None
+
+def _report(match, query, body):
+    report = api.library_report(_date_param(query))
+    if query.get('verify') in ('1', 'true', 'yes'):
+        report['drift'] = api.verify_totals()
+    return HTTPStatus.OK, report
+
+# (method, path pattern, 'read', 'write' or None (no lock), handler(match, query, body) -> (status, payload))
+ROUTES = [
+    ('GET', r'/books', 'read', lambda match, query, body: (HTTPStatus.OK, api.book_page(
+        _int_param(query, 'start', 0, minimum=0), _int_param(query, 'size', 20, minimum=1),
+        available_only=query.get('available') in ('1', 'true', 'yes')))),
+    ('GET', r'/books/search', 'read', lambda match, query, body: (HTTPStatus.OK, {'books': api.search_books(
+        query.get('q', ''), _int_param(query, 'limit', api.SEARCH_RESULT_LIMIT, minimum=1))})),
+    ('GET', r'/books/([^/]+)', 'read', lambda match, query, body: (HTTPStatus.OK, api.get_book(match[1]))),
+    ('POST', r'/books', 'write', lambda match, query, body: (HTTPStatus.CREATED, api.add_book(
+        _field(body, 'title'), str(body.get('author', '')), str(body.get('isbn', '')), body.get('quantity')))),
+    ('GET', r'/members', 'read', lambda match, query, body: (HTTPStatus.OK, api.member_page(
+        _int_param(query, 'start', 0, minimum=0), _int_param(query, 'size', 20, minimum=1)))),
+    ('GET', r'/members/([^/]+)', 'read', lambda match, query, body: (HTTPStatus.OK, api.get_member(match[1]))),
+    ('GET', r'/members/([^/]+)/loans', 'read', lambda match, query, body: (HTTPStatus.OK, {
+        'loans': api.member_loans(match[1])})),
+    ('POST', r'/members', 'write', lambda match, query, body: (HTTPStatus.CREATED, api.register_member(
+        _field(body, 'name'), str(body.get('contact', ''))))),
+    ('POST', r'/loans', 'write', lambda match, query, body: (HTTPStatus.CREATED, api.borrow_book(
+        _field(body, 'member_id'), _field(body, 'book_id')))),
+    ('POST', r'/returns', 'write', lambda match, query, body: (HTTPStatus.OK, api.return_book(
+        _field(body, 'member_id'), _field(body, 'book_id')))),
+    ('POST', r'/loans/batch', 'write', lambda match, query, body: (HTTPStatus.CREATED, api.borrow_books(
+        _field(body, 'member_id'), _items(body)))),
+    ('POST', r'/returns/batch', 'write', lambda match, query, body: (HTTPStatus.OK, api.return_books(
+        _field(body, 'member_id'), _items(body)))),
+    ('GET', r'/overdue', 'read', lambda match, query, body: (HTTPStatus.OK, {
+        'overdue': api.overdue_loans(_date_param(query))})),
+    ('GET', r'/report', 'read', _report),
+    ('GET', r'/totals', 'read', lambda match, query, body: (HTTPStatus.OK, api.library_totals())),
+    ('GET', r'/members/([^/]+)/activity', 'read', lambda match, query, body: (HTTPStatus.OK,
+        api.member_activity(match[1]))),
+    ('GET', r'/analytics/summary', 'read', lambda match, query, body: (HTTPStatus.OK, api.circulation_summary(
+        query.get('period', 'month'), _date_param(query)))),
+    ('GET', r'/analytics/top-books', 'read', lambda match, query, body: (HTTPStatus.OK, {'books': api.top_books(
+        query.get('period', 'month'), _date_param(query), _int_param(query, 'limit', api.TOP_LIMIT, minimum=1))})),
+    ('GET', r'/analytics/top-members', 'read', lambda match, query, body: (HTTPStatus.OK, {'members': api.top_members(
+        query.get('period', 'month'), _date_param(query), _int_param(query, 'limit', api.TOP_LIMIT, minimum=1))})),
+    ('GET', r'/analytics/utilization', 'read', lambda match, query, body: (HTTPStatus.OK, {
+        'books': api.book_utilization(_date_param(query), _int_param(query, 'limit', api.TOP_LIMIT, minimum=1))})),
+    ('GET', r'/branches/search', None, lambda match, query, body: (HTTPStatus.OK, branches.search_books(
+        query.get('q', ''), _int_param(query, 'limit', api.SEARCH_RESULT_LIMIT, minimum=1)))),
+    ('GET', r'/branches/availability', None, lambda match, query, body: (HTTPStatus.OK, branches.availability(
+        query.get('isbn', '')))),
+    ('GET', r'/branches/report', None, lambda match, query, body: (HTTPStatus.OK, branches.library_report(
+        _date_param(query)))),
+    ('POST', r'/holds', 'write', lambda match, query, body: (HTTPStatus.CREATED, api.place_hold(
+        _field(body, 'member_id'), _field(body, 'book_id'), _priority(body)))),
+    ('GET', r'/members/([^/]+)/holds', 'read', lambda match, query, body: (HTTPStatus.OK, {
+        'holds': api.member_holds(match[1])})),
+    ('POST', r'/holds/([^/]+)/cancel', 'write', lambda match, query, body: (HTTPStatus.OK, api.cancel_hold(
+        _field(body, 'member_id'), match[1]))),
+]
+_COMPILED_ROUTES = [(method, re.compile(pattern), kind, handler) for method, pattern, kind, handler in ROUTES]
+
+
+class LibraryService:
+    """Serves library_api over HTTP from the process-wide LibraryStore."""
+
+    def __init__(self, host='127.0.0.1', port=8080):
+        self.host = host
+        self.port = port
+        self._store = get_store()
+        self._lock = None # Created inside the event loop
+        self._executor = ThreadPoolExecutor(max_workers=WORKER_THREADS)
+
+    async def _run(self, kind, function, *args):
+        """Runs a blocking call on the thread pool under the read or write side of the lock, or none."""
+        loop = asyncio.get_running_loop()
+        if kind is None:
+            return await loop.run_in_executor(self._executor, function, *args)
+        section = self._lock.writing() if kind == 'write' else self._lock.reading()
+        async with section:
+            return await loop.run_in_executor(self._executor, function, *args)
+
+    async def _refresh_loop(self):
+        loop = asyncio.get_running_loop()
+        swept_at = loop.time()
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
+            try:
+                await self._run('write', self._store.refresh)
+                await self._run('read', api.precompute_reports) # So GET /report answers from the cache
+                if loop.time() - swept_at >= HOLD_SWEEP_INTERVAL:
+                    await self._run('write', self._store.expire_holds)
+                    swept_at = loop.time()
+            except (LibraryError, OSError) as error:
+                # Storage busy or unreadable for now: try again next time
+                # rather than stop following other processes for good.
+                print(f"Background refresh failed: {error}", file=sys.stderr)
+
+    def _route(self, method, path):
+        allowed = False
+        for route_method, pattern, kind, handler in _COMPILED_ROUTES:
+            match = pattern.fullmatch(path)
+            if match:
+                if route_method == method:
+                    return match, kind, handler
+                allowed = True
+        if allowed:
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not supported on {path}.")
+        raise HttpError(HTTPStatus.NOT_FOUND, f"No such resource: {path}")
+
+    async def _respond(self, method, target, raw_body):
+        """Returns (status, payload) for one request."""
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            match, kind, handler = self._route(method, url.path.rstrip('/') or '/')
+            try:
+                body = json.loads(raw_body) if raw_body else {}
+            except (ValueError, UnicodeDecodeError):
+                raise HttpError(HTTPStatus.BAD_REQUEST, "The request body is not valid JSON.") from None
+            if not isinstance(body, dict):
+                raise HttpError(HTTPStatus.BAD_REQUEST, "The request body must be a JSON object.")
+            return await self._run(kind, handler, match, query, body)
+        except HttpError as error:
+            return error.status, {'error': str(error)}
+        except NotFoundError as error:
+            return HTTPStatus.NOT_FOUND, {'error': str(error)}
+        except InvalidRequestError as error:
+            return HTTPStatus.BAD_REQUEST, {'error': str(error)}
+        except LibraryError as error: # Out of stock, already returned, busy
+            return HTTPStatus.CONFLICT, {'error': str(error)}
+        except Exception as error:
+            print(f"Error handling {method} {target}: {error!r}", file=sys.stderr)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Internal error."}
+
+    async def _handle_connection(self, reader, writer):
+        """Serves requests on one connection until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._write_response(writer, HTTPStatus.BAD_REQUEST, {'error': "Bad request line."}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version.upper() == 'HTTP/1.1')
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_BYTES:
+                    await self._write_response(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                               {'error': "Request body too large."}, False)
+                    break
+                raw_body = await reader.readexactly(length) if length else b''
+                status, payload = await self._respond(method.upper(), target, raw_body)
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass # Client went away or sent garbage
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _write_response(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        writer.write((f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                      "Content-Type: application/json\r\n"
+                      f"Content-Length: {len(body)}\r\n"
+                      f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve_forever(self, ready=None):
+        """Runs the service until cancelled. 'ready' (an asyncio.Event) is set once it listens."""
+        self._lock = ReadWriteLock()
+        self._store.auto_refresh = False # Refreshes happen under the write lock only
+        await self._run('write', self._store.refresh)
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1] # The real one when started on port 0
+        refresher = asyncio.create_task(self._refresh_loop())
+        print(f"Library service listening on http://{self.host}:{self.port}/")
+        if ready:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresher.cancel()
+            await self._run('write', self._store.compact) # Fold the loans journal into the CSV files
+            self._store.auto_refresh = True
+
+def serve(host='127.0.0.1', port=8080):
+    """Runs the library service in the foreground until Ctrl+C."""
+    service = LibraryService(host, port)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        print("\nLibrary service stopped.")
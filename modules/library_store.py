@@ -0,0 +1,736 @@
+import contextlib
+import datetime
+import hashlib
+import itertools
+import os
+from collections import Counter
+from modules.aggregates import LibraryTotals
+from modules.analytics import Circulation
+from modules.due_index import DueDateIndex
+from modules.holds import HoldQueues, HOLD_OPS
+from modules.instrumentation import instrumented, record_io
+from modules.records import BookTable, MemberTable, Member, Loan, Hold
+from modules.search_index import SearchIndex, SEARCH_FIELDS, SEARCH_INDEX_VERSION
+from modules.snapshot import Snapshot, open_snapshot, write_snapshot
+from modules.storage import open_repository, CsvRepository, ConcurrentUpdateError
+from utils import (max_numeric_id, normalize_isbn, LOAN_PERIOD, HOLD_PICKUP_PERIOD,
+                   DATA_DIR, CIRCULATION_LOG_FILE, CIRCULATION_ROLLUP_FILE, SEARCH_INDEX_FILE)
+
+WRITE_ATTEMPTS = 5 # Tries for a borrow or return that keeps losing to other terminals
+
+_versions = itertools.count(1) # Data versions, unique across every store in the process
+
+
+def _single_or_batch(entries):
+    """Journal entry for a list of changes: a plain entry for one, a batch for more."""
+    return entries[0] if len(entries) == 1 else {'op': 'batch', 'entries': entries}
+
+def _entries(entry):
+    return entry['entries'] if entry['op'] == 'batch' else [entry]
+
+def _check_page(start, size):
+    if start < 0 or size < 1:
+        raise ValueError(f"Bad page: start {start}, size {size} (start must be 0 or more, size at least 1).")
+
+
+class LibraryError(Exception):
+    """An operation that cannot be carried out; the message is meant for the user."""
+
+
+class OutOfStockError(LibraryError):
+    """A borrow refused only because no copy is free; the member may place a hold instead."""
+
+
+class LibraryStore:
+    """Process-wide in-memory copy of books, members, loans and holds.
+
+    Rows come from a storage repository (see modules.storage.Repository) and stay in
+    memory as typed records (see modules.records: books column by column,
+    members and loans as slotted objects), indexed by id, ISBN, and for
+    active loans by member, book and due date. The repository is only asked what changed since the last
+    call, so lookups are dictionary hits instead of a fresh load and a
+    linear scan per menu action.
+
+    Borrows and returns are handed to the repository as journal-style
+    entries holding the new values (the new loan or the id of the closed
+    loan, and the book's new 'available' count) and applied in memory as
+    the repository hands them back. Since entries carry new values rather
+    than deltas, applying one twice is harmless. Hold changes (see
+    modules.holds) travel the same way, in the same entry as the borrow
+    or return that causes them.
+    """
+
+    def __init__(self, repository=None):
+        self._repository = repository or open_repository()
+        self._books = BookTable()
+        self._members = MemberTable()
+        self._loans = {} # loan_id -> Loan
+        self._books_by_isbn = None # normalized isbn -> position in the book table; built on the first ISBN lookup
+        self._search_index = None # Loaded or built on the first search
+        self._loans_by_member = {} # member_id -> [loan, ...]; short lists, cheaper than dicts
+        self._loans_by_book = {} # book_id -> [loan, ...]
+        self._loans_by_due_date = DueDateIndex()
+        self._totals = LibraryTotals()
+        self._version = next(_versions) # Changes whenever books, members or loans change
+        data_dir = self._repository.data_dir
+        self._circulation = Circulation(os.path.join(data_dir, os.path.basename(CIRCULATION_LOG_FILE)),
+                                        os.path.join(data_dir, os.path.basename(CIRCULATION_ROLLUP_FILE)))
+        self._holds = HoldQueues()
+        self._search_index_file = os.path.join(data_dir, os.path.basename(SEARCH_INDEX_FILE))
+        # Reads refresh from storage first. A server that shares the store
+        # between threads turns this off and calls refresh() itself while no
+        # reads are running; writes always refresh.
+        self.auto_refresh = True
+
+    def _refresh(self):
+        """Refreshes before a read, unless auto_refresh has been turned off."""
+        if self.auto_refresh:
+            self.refresh()
+
+    def refresh(self):
+        """Picks up changes from storage, reloading everything if the repository asks to."""
+        rows, entries = self._repository.refresh()
+        if rows is not None:
+            self._load(*rows)
+        for entry in entries:
+            self._apply(entry)
+        if rows is not None or entries:
+            self._version = next(_versions)
+
+    def data_version(self):
+        """Returns a number that changes with every borrow, return, new book or new member.
+
+        Changes made at other terminals count once picked up. No two
+        stores in a process share a version, so results computed from a
+        store can be cached against it (see library_api.library_report()).
+        """
+        self._refresh()
+        return self._version
+
+    def write_lock(self):
+        """Context manager keeping other writers, here or at other terminals, out; re-entrant.
+
+        For a check and the write that depends on it, e.g. that no stored
+        book has an ISBN about to be added (see modules.bulk_import).
+        """
+        return self._repository.write_lock()
+
+    @contextlib.contextmanager
+    def pinned(self):
+        """Refreshes once, then answers the reads inside the block from that state alone.
+
+        For results put together from several reads, which must all agree
+        with the data_version() read among them.
+        """
+        self._refresh()
+        auto_refresh, self.auto_refresh = self.auto_refresh, False
+        try:
+            yield self
+        finally:
+            self.auto_refresh = auto_refresh
+
+    @instrumented('library_store.load')
+    def _load(self, books, members, loans, holds):
+        if isinstance(books, Snapshot):
+            self._books = BookTable.from_snapshot(books)
+            self._members = MemberTable.from_snapshot(members)
+        else:
+            self._books = BookTable(books)
+            self._members = MemberTable(members)
+        self._loans = {loan.loan_id: loan for loan in map(Loan.from_values, loans)}
+        self._holds.load(holds)
+        self._totals = LibraryTotals()
+        self._books_by_isbn = None
+        self._totals.unique_books = len(self._books)
+        self._totals.total_copies = sum(self._books.quantity)
+        self._totals.total_available = sum(self._books.available)
+        self._totals.total_members = len(self._members)
+        self._search_index = None
+        self._loans_by_member = {}
+        self._loans_by_book = {}
+        for loan in self._loans.values():
+            self._index_loan(loan, by_due_date=False)
+        self._loans_by_due_date = DueDateIndex(self._loans.values())
+        record_io(rows_read=len(self._books) + len(self._members) + len(self._loans) + len(self._holds))
+
+    def _apply(self, entry):
+        """Applies one borrow, return, hold or batch entry to the in-memory rows."""
+        if entry['op'] == 'batch':
+            for change in entry['entries']:
+                self._apply(change)
+            return
+        if entry['op'] in HOLD_OPS:
+            self._holds.apply(entry)
+            return
+        position = self._books.position(entry['book_id'])
+        if position is not None:
+            self._totals.set_available(self._books.available[position], entry['available'])
+            self._books.set_value(position, 'available', entry['available'])
+        if entry['op'] == 'borrow':
+            if entry['loan']['loan_id'] not in self._loans:
+                loan = self._loans[entry['loan']['loan_id']] = Loan(entry['loan'])
+                self._index_loan(loan)
+        elif entry['op'] == 'return':
+            loan = self._loans.pop(entry['loan_id'], None)
+            if loan:
+                self._unindex_loan(loan)
+
+    def _isbn_positions(self):
+        if self._books_by_isbn is None:
+            self._books_by_isbn = {isbn: position for position, isbn in enumerate(map(normalize_isbn, self._books.isbns))
+                                   if isbn}
+        return self._books_by_isbn
+
+    def _index_isbn(self, book):
+        isbn = normalize_isbn(book['isbn'])
+        if isbn and self._books_by_isbn is not None:
+            self._books_by_isbn[isbn] = self._books.position(book['id'])
+
+    def _index_loan(self, loan, by_due_date=True):
+        self._totals.open_loan(first_for_member=loan.member_id not in self._loans_by_member)
+        self._loans_by_member.setdefault(loan.member_id, []).append(loan)
+        self._loans_by_book.setdefault(loan.book_id, []).append(loan)
+        if by_due_date:
+            self._loans_by_due_date.add(loan)
+
+    def _unindex_loan(self, loan):
+        self._loans_by_due_date.remove(loan)
+        for index, key in ((self._loans_by_member, loan.member_id), (self._loans_by_book, loan.book_id)):
+            loans = index.get(key)
+            if loans and loan in loans:
+                loans.remove(loan)
+                if not loans:
+                    del index[key]
+        self._totals.close_loan(last_for_member=loan.member_id not in self._loans_by_member)
+
+    # --- Books ---
+
+    def books(self):
+        """Returns all books in storage order."""
+        self._refresh()
+        return list(self._books)
+
+    def get_book(self, book_id):
+        """Returns the book with the given id, or None."""
+        self._refresh()
+        return self._books.get(book_id)
+
+    def get_book_by_isbn(self, isbn):
+        """Returns the book with the given ISBN, or None. Hyphens, spaces and case do not matter."""
+        self._refresh()
+        position = self._isbn_positions().get(normalize_isbn(isbn))
+        return None if position is None else self._books.view(position)
+
+    def isbns(self):
+        """Returns the normalized ISBNs of every book (see utils.normalize_isbn()), as a live set-like view."""
+        self._refresh()
+        return self._isbn_positions().keys()
+
+    def add_book(self, book):
+        """Adds a new book and stores it."""
+        self.add_books([book])
+
+    def add_books(self, books):
+        """Adds new books and stores them in one batch."""
+        with self._repository.write_lock():
+            self.refresh()
+            self._repository.add_rows('books', books)
+        added = [self._books.append(book) for book in books]
+        for book in added:
+            self._index_isbn(book)
+            self._totals.add_book(book)
+        if self._search_index is not None:
+            self._search_index.add_many(added)
+        self._version = next(_versions)
+
+    def book_page(self, start, size, available_only=False):
+        """Returns (books, next_start) for one page of books in storage order.
+
+        'start' is a position in storage order: 0 for the first page, then
+        the next_start of the page before. next_start is None on the last
+        page. With available_only, positions are found by scanning the
+        availability bitmap, so no other book is looked at.
+        """
+        _check_page(start, size) # A negative start would count from the end
+        self._refresh()
+        if not available_only:
+            end = min(start + size, len(self._books))
+            next_start = end if end < len(self._books) else None
+            return [self._books.view(position) for position in range(start, end)], next_start
+        books = []
+        bits = self._books.available_bits
+        position = bits.find(1, start)
+        while position != -1 and len(books) < size:
+            books.append(self._books.view(position))
+            position = bits.find(1, position + 1)
+        return books, (position if position != -1 else None)
+
+    def available_book_count(self):
+        """Returns how many titles have at least one copy on the shelf."""
+        self._refresh()
+        return self._books.available_bits.count(1)
+
+    def search_books(self, query, limit=None, scored=False):
+        """Returns books matching every word of the query, best match first.
+
+        Prefixes count; if no book matches, so do misspellings (see
+        SearchIndex.search()). With scored, returns (book, score) pairs.
+        """
+        self._refresh()
+        if scored:
+            return [(self._books.get(book_id), score)
+                    for book_id, score in self._search().search(query, limit, scored=True)]
+        return [self._books.get(book_id) for book_id in self._search().search(query, limit)]
+
+    def _search(self):
+        """Returns the search index, loading the saved one or building it on first use."""
+        if self._search_index is None:
+            self._search_index = self._saved_search_index() or SearchIndex(self._books.rows(SEARCH_FIELDS))
+        return self._search_index
+
+    @instrumented('library_store.load_search_index')
+    def _saved_search_index(self):
+        """Returns the index compact() saved, caught up with the books added since, or None.
+
+        It is used as is while the books file has the signature it had
+        when the index was saved. Otherwise (compacted, edited, or books
+        added) the indexed fields of the books it covers must still hash
+        to the saved digest.
+        """
+        snapshot = open_snapshot(self._search_index_file)
+        saved = snapshot.sources if snapshot else None
+        if not isinstance(saved, dict) or saved.get('version') != SEARCH_INDEX_VERSION:
+            return None
+        count = saved['books']
+        if count > len(self._books):
+            return None
+        signature = self._repository.table_signature('books')
+        if (signature is None or list(signature) != saved['signature']) and self._search_digest(count) != saved['digest']:
+            return None
+        index = SearchIndex.from_snapshot(snapshot)
+        index.add_rows(self._books.rows(SEARCH_FIELDS, start=count))
+        return index
+
+    def _search_digest(self, count):
+        """Hashes the indexed fields of the first 'count' books."""
+        digest = hashlib.blake2b(digest_size=16)
+        for field in SEARCH_FIELDS:
+            values = '\x00'.join(itertools.islice(self._books.column(field), count))
+            digest.update(values.encode('utf-8', 'surrogatepass') + b'\x01')
+        return digest.hexdigest()
+
+    def _save_search_index(self):
+        """Saves the search index, so later starts load it instead of building it."""
+        signature = self._repository.table_signature('books') # Taken first: a later change fails the check
+        self._refresh()
+        index = self._search()
+        count = len(self._books)
+        write_snapshot(self._search_index_file, index.columns(), {
+            'version': SEARCH_INDEX_VERSION, 'books': count,
+            'signature': list(signature) if signature else None, 'digest': self._search_digest(count),
+        })
+
+    # --- Members ---
+
+    def members(self):
+        """Returns all members in storage order."""
+        self._refresh()
+        return list(self._members.values())
+
+    def get_member(self, member_id):
+        """Returns the member with the given id, or None."""
+        self._refresh()
+        return self._members.get(member_id)
+
+    def add_member(self, member):
+        """Adds a new member and stores it."""
+        self.add_members([member])
+
+    def add_members(self, members):
+        """Adds new members and stores them in one batch."""
+        with self._repository.write_lock():
+            self.refresh()
+            self._repository.add_rows('members', members)
+        for member in members:
+            self._members.add(Member(member))
+            self._totals.add_member()
+        self._version = next(_versions)
+
+    def member_page(self, start, size):
+        """Returns (members, next_start) for one page of members; see book_page()."""
+        _check_page(start, size)
+        self._refresh()
+        end = min(start + size, len(self._members))
+        next_start = end if end < len(self._members) else None
+        return [self._members.at(position) for position in range(start, end)], next_start
+
+    # --- Ids ---
+
+    def reserve_ids(self, entity, count=1):
+        """Reserves 'count' new ids for 'books', 'members' or 'loans' and returns the first.
+
+        Ids come from a persisted sequence, so a deleted record's id is never
+        handed out again. The existing rows are only scanned the first time
+        an entity's sequence is created.
+        """
+        self.refresh()
+        return self._reserve_ids(entity, count)
+
+    def _reserve_ids(self, entity, count):
+        table = {'books': self._books.ids, 'members': self._members, 'loans': self._loans,
+                 'holds': self._holds.ids()}[entity]
+        return self._repository.reserve_ids(entity, count, seed=lambda: max_numeric_id(table))
+
+    # --- Totals ---
+
+    def totals(self):
+        """Returns the running library totals."""
+        self._refresh()
+        return self._totals
+
+    def recount_totals(self):
+        """Recomputes the totals from every row, for checking the running ones."""
+        self._refresh()
+        return LibraryTotals.count(self._books, self._members.values(), list(self._loans.values()))
+
+    # --- Loans ---
+
+    def loans(self):
+        """Returns all active loans."""
+        self._refresh()
+        return list(self._loans.values())
+
+    def loans_for_member(self, member_id):
+        """Returns the active loans of one member."""
+        self._refresh()
+        return list(self._loans_by_member.get(member_id, ()))
+
+    def loans_for_book(self, book_id):
+        """Returns the active loans of one book."""
+        self._refresh()
+        return list(self._loans_by_book.get(book_id, ()))
+
+    def overdue_loans(self, today=None):
+        """Returns loans whose due date has passed, earliest due first."""
+        self._refresh()
+        today = today or datetime.date.today()
+        return [self._loans[loan_id] for loan_id in self._loans_by_due_date.due_before(today.isoformat())]
+
+    def borrow(self, member, book):
+        """Lends a copy of the book to the member and records it. Returns the new loan.
+
+        Raises LibraryError if no copy is available once the latest changes
+        from other terminals are taken into account.
+        """
+        return self.borrow_many(member, [book])[0]
+
+    def borrow_many(self, member, books):
+        """Lends one copy of each book to the member as one all-or-nothing change.
+
+        A book may appear more than once. Copies set aside for other
+        members' holds cannot be lent; the member's own ready hold on a
+        book is fulfilled by borrowing it. Every item is checked before
+        anything is written; LibraryError (OutOfStockError if only copies
+        are lacking) lists all the items that cannot be lent. Returns the
+        new loans, in the order of 'books'.
+        """
+        if not books:
+            return []
+        def change():
+            available = {} # book_id -> count free for this member once the earlier items are lent
+            problems = []
+            out_of_stock = True
+            for book in books:
+                current = self._books.get(book['id'])
+                if not current:
+                    problems.append(f"Book with ID '{book['id']}' not found.")
+                    out_of_stock = False
+                    continue
+                count = available.get(book['id'], current['available'] -
+                                      self._holds.reserved_for_others(book['id'], member['id']))
+                if count <= 0:
+                    if current['available'] > 0:
+                        problems.append(f"Book '{current['title']}' is out of stock: "
+                                        "the copies on the shelf are set aside for holds.")
+                    else:
+                        problems.append(f"Book '{current['title']}' is currently out of stock.")
+                    continue
+                available[book['id']] = count - 1
+            if problems:
+                raise (OutOfStockError if out_of_stock else LibraryError)("\n".join(problems))
+
+            borrowed_on = datetime.date.today()
+            first_loan_id = self._reserve_ids('loans', len(books))
+            available = {}
+            entries = []
+            for loan_id, book in enumerate(books, start=first_loan_id):
+                count = available.get(book['id'], self._books.get(book['id'])['available'])
+                available[book['id']] = count - 1
+                loan = {
+                    'loan_id': str(loan_id),
+                    'member_id': member['id'],
+                    'book_id': book['id'],
+                    'borrowed_on': borrowed_on.isoformat(),
+                    'due_on': (borrowed_on + LOAN_PERIOD).isoformat(),
+                }
+                entries.append({'op': 'borrow', 'loan': loan, 'book_id': book['id'],
+                                'available': str(count - 1), 'expected_available': str(count)})
+            for book_id in dict.fromkeys(book['id'] for book in books):
+                hold = self._holds.open_hold(member['id'], book_id)
+                if hold: # Recorded with the loan, so a copy is never both lent and set aside
+                    entries.append({'op': 'hold_close', 'hold_id': hold.hold_id, 'reason': 'fulfilled'})
+            return _single_or_batch(entries)
+        self._sweep_holds()
+        return [change['loan'] for change in _entries(self._write(change)) if change['op'] == 'borrow']
+
+    def return_loan(self, loan):
+        """Closes a loan, puts the copy back on the shelf and records it.
+
+        Returns the holds the copy was set aside for (see return_many()).
+        Raises LibraryError if the loan was already closed, e.g. at another terminal.
+        """
+        return self.return_many([loan])
+
+    def return_many(self, loans):
+        """Closes several loans as one all-or-nothing change; LibraryError lists every problem.
+
+        Copies coming back go to the next waiting holds on their books.
+        Returns the holds made ready.
+        """
+        if not loans:
+            return []
+        def change():
+            problems = []
+            seen = set()
+            for loan in loans:
+                if loan['loan_id'] not in self._loans or loan['loan_id'] in seen:
+                    problems.append(f"Loan {loan['loan_id']} has already been returned.")
+                elif not self._books.get(loan['book_id']):
+                    problems.append(f"Book with ID '{loan['book_id']}' not found in library inventory.")
+                seen.add(loan['loan_id'])
+            if problems:
+                raise LibraryError("\n".join(problems))
+
+            available = {}
+            entries = []
+            for loan in loans:
+                count = available.get(loan['book_id'], self._books.get(loan['book_id'])['available'])
+                available[loan['book_id']] = count + 1
+                entries.append({'op': 'return', 'loan_id': loan['loan_id'], 'book_id': loan['book_id'],
+                                'available': str(count + 1), 'expected_available': str(count)})
+            returned = [loan['book_id'] for loan in loans]
+            return _single_or_batch(entries + self._ready_entries(returned, freed=returned))
+        self._sweep_holds()
+        return self._made_ready(self._write(change))
+
+    # --- Holds ---
+
+    def _sweep_holds(self):
+        """Closes ready holds past their pickup expiry. Returns them.
+
+        Each expired hold's copy goes to the next hold in line, in the same
+        entry.
+        """
+        today = datetime.date.today().isoformat()
+        self.refresh()
+        if not self._holds.expired(today):
+            return [] # The usual case: no write, no lock
+        expired = []
+        def change():
+            expired[:] = self._holds.expired(today)
+            if not expired:
+                return None # Another terminal swept them first
+            freed = [hold.book_id for hold in expired]
+            return _single_or_batch(
+                [{'op': 'hold_close', 'hold_id': hold.hold_id, 'reason': 'expired'} for hold in expired] +
+                self._ready_entries(freed, freed=freed, closed={hold.hold_id for hold in expired}))
+        self._write(change)
+        return expired
+
+    def _ready_entries(self, book_ids, freed=(), placed=(), closed=()):
+        """Entries setting free copies of the books aside for the holds at the front of their queues.
+
+        Called while building an entry, from the state before it: 'freed'
+        has a book id per copy the entry frees (a return, or a ready hold
+        closing), 'placed' the holds it adds and 'closed' the ids of the
+        holds it closes. A copy is free when it is on the shelf and not
+        already set aside.
+        """
+        expires_on = (datetime.date.today() + HOLD_PICKUP_PERIOD).isoformat()
+        freed = Counter(freed)
+        entries = []
+        for book_id in dict.fromkeys(book_ids):
+            book = self._books.get(book_id)
+            free = book['available'] - self._holds.ready_count(book_id) + freed[book_id] if book else 0
+            if free <= 0:
+                continue
+            queue = [hold for hold in self._holds.next_waiting(book_id, free + len(closed))
+                     if hold.hold_id not in closed]
+            queue = sorted(queue + [hold for hold in placed if hold.book_id == book_id], key=Hold.queue_key)
+            entries += [{'op': 'hold_ready', 'hold_id': hold.hold_id, 'book_id': book_id, 'expires_on': expires_on}
+                        for hold in queue[:free]]
+        return entries
+
+    def _made_ready(self, entry):
+        """Returns the holds an entry just recorded made ready."""
+        ready = (self._holds.get(change['hold_id']) for change in _entries(entry) if change['op'] == 'hold_ready')
+        return [hold for hold in ready if hold]
+
+    def place_hold(self, member, book, priority=0):
+        """Puts the member in the book's queue. Returns the hold.
+
+        Holds with a higher priority are served first, equal ones in the
+        order placed. If a copy is free the hold is ready at once. Raises
+        LibraryError if the member already holds the book.
+        """
+        def change():
+            if self._holds.open_hold(member['id'], book['id']):
+                raise LibraryError(f"Member '{member['name']}' already has a hold on '{book['title']}'.")
+            hold = {
+                'hold_id': str(self._reserve_ids('holds', 1)),
+                'member_id': member['id'],
+                'book_id': book['id'],
+                'priority': str(int(priority)),
+                'placed_on': datetime.date.today().isoformat(),
+                'status': 'waiting',
+                'expires_on': '',
+            }
+            return _single_or_batch([{'op': 'hold_place', 'hold': hold}] +
+                                    self._ready_entries([book['id']], placed=[Hold(hold)]))
+        self._sweep_holds()
+        return self._holds.get(_entries(self._write(change))[0]['hold']['hold_id'])
+
+    def cancel_hold(self, hold):
+        """Closes a hold; a copy set aside for it goes to the next in line."""
+        def change():
+            current = self._holds.get(hold['hold_id'])
+            if not current:
+                raise LibraryError(f"Hold {hold['hold_id']} is no longer open.")
+            freed = [current.book_id] if current.status == 'ready' else []
+            return _single_or_batch([{'op': 'hold_close', 'hold_id': current.hold_id, 'reason': 'cancelled'}] +
+                                    self._ready_entries([current.book_id], freed=freed, closed={current.hold_id}))
+        self._sweep_holds()
+        self._write(change)
+
+    def expire_holds(self):
+        """Closes ready holds not picked up in time. Returns them."""
+        return self._sweep_holds()
+
+    def get_hold(self, hold_id):
+        """Returns an open hold, or None."""
+        self._refresh()
+        return self._holds.get(hold_id)
+
+    def holds_for_member(self, member_id):
+        """Returns the member's open holds, oldest first, as (hold, queue position, queue length).
+
+        The position is 0 for a ready hold, else 1 for the next in line.
+        """
+        self._refresh()
+        return [(hold, self._holds.position(hold), self._holds.queue_length(hold.book_id))
+                for hold in self._holds.for_member(member_id)]
+
+    def hold_position(self, hold):
+        """Returns (queue position, queue length) of an open hold, as in holds_for_member()."""
+        self._refresh()
+        return self._holds.position(hold), self._holds.queue_length(hold['book_id'])
+
+    def held_copies(self, book_id):
+        """Returns how many copies of the book on the shelf are set aside for holds."""
+        self._refresh()
+        return self._holds.ready_count(book_id)
+
+    def _write(self, make_entry):
+        """Builds an entry from fresh state and records it, retrying lost compare-and-swaps.
+
+        make_entry() runs under the repository's write lock right after a
+        refresh, so the counts it reads are the latest committed ones. It
+        may return None if there is nothing left to write.
+        """
+        for _ in range(WRITE_ATTEMPTS):
+            with self._repository.write_lock():
+                self.refresh()
+                entry = make_entry()
+                if entry is None:
+                    return None
+                events = self._circulation_events(entry)
+                try:
+                    self._repository.record(entry)
+                except ConcurrentUpdateError:
+                    continue # Someone else got there first: re-read and try again
+                self._circulation.record(events)
+                self.refresh() # Picks up the entry just recorded
+                if self._repository.needs_compaction():
+                    self.compact()
+                return entry
+        raise LibraryError("The library data is busy; please try again.")
+
+    def _circulation_events(self, entry):
+        """Returns the analytics events for an entry about to be recorded; returns are dated today."""
+        today = datetime.date.today().isoformat()
+        events = []
+        for change in _entries(entry):
+            if change['op'] == 'borrow':
+                loan = change['loan']
+                events.append({'op': 'borrow', 'on': loan['borrowed_on'], 'loan_id': loan['loan_id'],
+                               'member_id': loan['member_id'], 'book_id': loan['book_id']})
+            elif change['op'] == 'return':
+                loan = self._loans[change['loan_id']]
+                events.append({'op': 'return', 'on': today, 'loan_id': loan.loan_id,
+                               'member_id': loan.member_id, 'book_id': loan.book_id,
+                               'borrowed_on': loan.borrowed_on or today})
+        return events
+
+    def circulation(self):
+        """Returns the circulation analytics (modules.analytics.Circulation) of this data."""
+        return self._circulation
+
+    @instrumented('library_store.compact')
+    def compact(self, snapshot=False):
+        """Folds recorded loan and hold changes into storage (the CSV snapshots for the CSV backend).
+
+        With snapshot, or once one is kept, also (re)writes the binary
+        snapshot the CSV backend loads from. Returns its path, or None.
+        The analytics rollup is saved too, when enough events came in
+        since (always with snapshot). With snapshot, whatever the backend,
+        the search index is saved as well (after the locks are released).
+        """
+        path = None
+        with self._repository.write_lock():
+            self.refresh()
+            self._repository.compact(list(self._books), list(self._loans.values()), self._holds.holds())
+            self._circulation.save(force=snapshot)
+            if snapshot or self._repository.snapshot_due():
+                path = self._repository.write_snapshot(self._books.columns(), self._members.columns(),
+                                                       list(self._loans.values()))
+        if snapshot:
+            self._save_search_index()
+        return path
+
+    def export_rows(self):
+        """Returns (books, members, loans, holds) rows as currently held in memory."""
+        self._refresh()
+        return list(self._books), list(self._members.values()), list(self._loans.values()), self._holds.holds()
+
+
+_store = None
+
+def get_store():
+    """Returns the process-wide LibraryStore, creating it on first use."""
+    global _store
+    if _store is None:
+        _store = LibraryStore()
+    return _store
+
+def configure_store(repository):
+    """Makes the process-wide LibraryStore use the given repository."""
+    global _store
+    _store = LibraryStore(repository)
+    return _store
+
+def migrate_csv_to_sqlite(data_dir=DATA_DIR):
+    """Copies the CSV data, journal included, into the SQLite database. Returns the row counts."""
+    csv_repository = CsvRepository(data_dir)
+    books, members, loans, holds = LibraryStore(csv_repository).export_rows()
+    open_repository('sqlite', data_dir).replace_all(books, members, loans, holds, csv_repository.sequences())
+    return len(books), len(members), len(loans), len(holds)
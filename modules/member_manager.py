@@ -1,19 +1,10 @@
-from utils import load_data, save_data, generate_id, BOOKS_FILE, MEMBERS_FILE
 import modules.book_manager as bm
-
-MEMBER_FIELDNAMES = ['id', 'name', 'contact', 'borrowed_books'] # borrowed_books will store a string representation of a list
-
-def _get_members():
-    """Helper to load members data."""
-    return load_data(MEMBERS_FILE)
-
-def _save_members(members):
-    """Helper to save members data."""
-    save_data(MEMBERS_FILE, members, MEMBER_FIELDNAMES)
+import modules.library_api as api
+from modules.library_api import LibraryError
+from modules.pager import page_through, api_pages, PAGE_SIZE
 
 def register_new_member():
     """Registers a new member to the system."""
-    members = _get_members()
     print("\n" + "="*40)
     print("          REGISTER NEW MEMBER")
     print("="*40)
@@ -21,42 +12,37 @@ def register_new_member():
     name = input("Enter member name: ").strip()
     contact = input("Enter contact information (e.g., email or phone): ").strip()
     
-    member_id = generate_id(members)
-    new_member = {
-        'id': member_id,
-        'name': name,
-        'contact': contact,
-        'borrowed_books': '[]' # Initialize as empty list string
-    }
-    members.append(new_member)
-    _save_members(members)
-    print(f"\nMember '{name}' registered successfully with ID: {member_id}.")
+    member = api.register_member(name, contact)
+    print(f"\nMember '{name}' registered successfully with ID: {member['id']}.")
     print("="*40)
 
 def display_all_members():
-    """Displays all registered members."""
-    members = _get_members()
+    """Displays all registered members, one page at a time."""
     print("\n" + "="*70)
     print("                   ALL REGISTERED MEMBERS")
     print("="*70)
-    if not members:
+    total = api.library_totals()['total_members']
+    if not total:
         print("No members registered yet.")
         return
 
-    print(f"{'ID':<5} {'Name':<30} {'Contact':<25}")
-    print("-" * 70)
-    for member in members:
-        print(f"{member['id']:<5} {member['name']:<30} {member['contact']:<25}")
-    print("="*70)
+    def print_page(members, page_number):
+        print(f"\nPage {page_number} of {-(-total // PAGE_SIZE)} ({total} members)")
+        print(f"{'ID':<5} {'Name':<30} {'Contact':<25}")
+        print("-" * 70)
+        for member in members:
+            print(f"{member['id']:<5} {member['name']:<30} {member['contact']:<25}")
+        print("="*70)
+
+    page_through(api_pages(api.member_page, 'members'), print_page)
 
 def view_member_borrowed_books():
     """Allows viewing books borrowed by a specific member."""
-    members = _get_members()
     print("\n" + "="*40)
     print("         VIEW MEMBER'S BORROWED BOOKS")
     print("="*40)
 
-    if not members:
+    if not api.library_totals()['total_members']:
         print("No members registered yet.")
         return
 
@@ -64,3 +50,40 @@ def view_member_borrowed_books():
     bm.display_member_borrowed_books(member_id)
     print("="*40)
 
+def view_member_holds():
+    """Shows a member's holds and their place in each queue, and lets one be cancelled."""
+    print("\n" + "="*60)
+    print("              VIEW MEMBER'S HOLDS")
+    print("="*60)
+
+    member_id = input("Enter Member ID: ").strip()
+    try:
+        member = api.get_member(member_id)
+        holds = api.member_holds(member_id)
+    except LibraryError as error:
+        print(error)
+        return
+    if not holds:
+        print(f"Member '{member['name']}' has no holds.")
+        return
+
+    print(f"{'Hold':<6} {'Book ID':<8} {'Title':<30} {'Status':<30}")
+    print("-" * 60)
+    for hold in holds:
+        if hold['status'] == 'ready':
+            status = f"ready, pick up by {hold['expires_on']}"
+        else:
+            status = f"waiting, {hold['position']} of {hold['queue_length']}"
+        print(f"{hold['hold_id']:<6} {hold['book_id']:<8} {hold['title']:<30} {status:<30}")
+    print("-" * 60)
+
+    hold_id = input("Enter a Hold number to cancel it (blank to keep all): ").strip()
+    if hold_id:
+        try:
+            hold = api.cancel_hold(member_id, hold_id)
+        except LibraryError as error:
+            print(error)
+            return
+        print(f"Hold #{hold['hold_id']} on '{hold['title']}' cancelled.")
+    print("="*60)
+
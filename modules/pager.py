@@ -0,0 +1,49 @@
+import os
+
+DEFAULT_PAGE_SIZE = 20 # Rows per page in the listings unless LIBRARY_PAGE_SIZE says otherwise
+
+
+def _page_size(value):
+    """Reads a LIBRARY_PAGE_SIZE setting: a bad one falls back to the default, a small one to 1."""
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+
+PAGE_SIZE = _page_size(os.environ.get('LIBRARY_PAGE_SIZE', DEFAULT_PAGE_SIZE))
+
+
+def page_through(fetch_page, print_rows, page_size=PAGE_SIZE):
+    """Shows a listing one page at a time with next/previous navigation.
+
+    fetch_page(start, size) returns (rows, next_start) as LibraryStore's
+    *_page methods do; print_rows(rows, page_number) prints one page.
+    Returns without prompting when everything fits on one page.
+    """
+    starts = [0] # Start of every page up to the current one, for going back
+    while True:
+        rows, next_start = fetch_page(starts[-1], page_size)
+        print_rows(rows, len(starts))
+        if next_start is None and len(starts) == 1:
+            return
+
+        options = []
+        if next_start is not None:
+            options.append("Enter/n = next")
+        if len(starts) > 1:
+            options.append("p = previous")
+        options.append("q = back to menu")
+        choice = input(f"[{', '.join(options)}]: ").strip().lower()
+        if choice in ('', 'n') and next_start is not None:
+            starts.append(next_start)
+        elif choice == 'p' and len(starts) > 1:
+            starts.pop()
+        elif choice in ('', 'q'):
+            return
+
+def api_pages(fetch_page, key, **options):
+    """Adapts a library_api *_page function, which returns a dict, to page_through()."""
+    def fetch(start, size):
+        page = fetch_page(start, size, **options)
+        return page[key], page['next_start']
+    return fetch
@@ -0,0 +1,398 @@
+import bisect
+import sys
+from array import array
+from utils import BOOK_FIELDNAMES, MEMBER_FIELDNAMES, LOAN_FIELDNAMES, HOLD_FIELDNAMES
+
+
+def _count(value):
+    """Parses a stored counter once, treating blanks and junk as 0."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def _text(value):
+    return '' if value is None else str(value)
+
+def _shared(value):
+    """Interns strings that repeat across rows (ids, authors, dates) so they are stored once."""
+    return sys.intern(_text(value))
+
+def _find_in_snapshot(ids, id_order, record_id):
+    """Returns the position of an id in a snapshot's id column by bisecting its id order, or None.
+
+    The last of equal ids wins, as in a dict built in storage order.
+    """
+    index = bisect.bisect_right(id_order, record_id, key=ids.__getitem__) - 1
+    if index >= 0 and ids[id_order[index]] == record_id:
+        return id_order[index]
+    return None
+
+def _id_order(ids):
+    """Positions sorted by id, the index _find_in_snapshot() bisects."""
+    ids = list(ids)
+    return array('i', sorted(range(len(ids)), key=ids.__getitem__))
+
+
+class Record:
+    """Fixed-field row with __slots__ instead of a per-row dict.
+
+    Fields read as attributes or, like the CSV rows they replace, as
+    record['field'] and record.get('field'), so csv.DictWriter and the
+    menu code take them as they are.
+    """
+
+    __slots__ = ()
+    FIELDS = []
+
+    def __init__(self, row):
+        for field in self.FIELDS:
+            setattr(self, field, _shared(row.get(field)))
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        setattr(self, field, _shared(value))
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def keys(self):
+        return list(self.FIELDS)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()})"
+
+
+class Member(Record):
+    __slots__ = MEMBER_FIELDNAMES
+    FIELDS = MEMBER_FIELDNAMES
+
+    def __init__(self, row):
+        self.id = _shared(row.get('id'))
+        self.name = _text(row.get('name'))
+        self.contact = _text(row.get('contact'))
+
+    @classmethod
+    def from_values(cls, values):
+        """Builds a member from an (id, name, contact) tuple as utils.read_rows() yields."""
+        member = cls.__new__(cls)
+        member_id, member.name, member.contact = values
+        member.id = sys.intern(member_id)
+        return member
+
+
+class MemberTable:
+    """Members in storage order, looked up by id like a dict of Member records.
+
+    Built from a binary snapshot (from_snapshot()), a Member is only made
+    from the mapped columns the first time it is asked for, and ids are
+    found by bisecting the snapshot's id order, as in BookTable.
+    """
+
+    def __init__(self, rows=()):
+        self._members = {} # id -> Member, every one made so far
+        self._ids = [] # Storage order
+        self._columns = None # Snapshot (names, contacts) not yet made into Members
+        self._id_order = None
+        for member in map(Member.from_values, rows):
+            self._members[member.id] = member
+            self._ids.append(member.id)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Builds the table over a modules.snapshot.Snapshot without decoding a single row."""
+        table = cls()
+        table._ids = snapshot.column('members', 'id')
+        table._id_order = snapshot.column('members', 'id_order')
+        table._columns = (snapshot.column('members', 'name'), snapshot.column('members', 'contact'))
+        return table
+
+    def _from_snapshot(self, position):
+        name, contact = self._columns
+        member = Member.from_values((self._ids[position], name[position], contact[position]))
+        self._members[member.id] = member
+        return member
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, member_id):
+        return self.get(member_id) is not None
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def get(self, member_id, default=None):
+        member = self._members.get(member_id)
+        if member is None and self._columns is not None:
+            position = _find_in_snapshot(self._ids, self._id_order, member_id)
+            if position is not None:
+                member = self._from_snapshot(position)
+        return default if member is None else member
+
+    def __getitem__(self, member_id):
+        member = self.get(member_id)
+        if member is None:
+            raise KeyError(member_id)
+        return member
+
+    def at(self, position):
+        """Returns the member at a position in storage order."""
+        member_id = self._ids[position]
+        member = self._members.get(member_id)
+        if member is None and self._columns is not None:
+            member = self._from_snapshot(position)
+        return member
+
+    def values(self):
+        return map(self.at, range(len(self._ids)))
+
+    def add(self, member):
+        self._members[member.id] = member
+        self._ids.append(member.id)
+
+    def columns(self):
+        """Returns the columns for modules.snapshot.write_snapshot(), 'id_order' included."""
+        ids = list(self._ids)
+        # Members never change once registered: the snapshot's values still
+        # hold, and only members added since need reading.
+        names, contacts = ([], []) if self._columns is None else map(list, self._columns)
+        for member_id in ids[len(names):]:
+            member = self._members[member_id]
+            names.append(member.name)
+            contacts.append(member.contact)
+        id_order = self._id_order
+        if id_order is None or len(id_order) != len(ids):
+            id_order = _id_order(ids)
+        return {'id': ids, 'name': names, 'contact': contacts, 'id_order': id_order}
+
+
+class Loan(Record):
+    __slots__ = LOAN_FIELDNAMES
+    FIELDS = LOAN_FIELDNAMES
+
+    def __init__(self, row):
+        intern = sys.intern
+        self.loan_id = intern(row['loan_id'])
+        self.member_id = intern(row['member_id'])
+        self.book_id = intern(row['book_id'])
+        self.borrowed_on = intern(row.get('borrowed_on') or '')
+        self.due_on = intern(row.get('due_on') or '')
+
+    @classmethod
+    def from_values(cls, values):
+        """Builds a loan from a LOAN_FIELDNAMES tuple as utils.read_rows() yields."""
+        intern = sys.intern
+        loan = cls.__new__(cls)
+        loan_id, member_id, book_id, borrowed_on, due_on = values
+        loan.loan_id = intern(loan_id)
+        loan.member_id = intern(member_id)
+        loan.book_id = intern(book_id)
+        loan.borrowed_on = intern(borrowed_on)
+        loan.due_on = intern(due_on)
+        return loan
+
+
+class Hold(Record):
+    """A member waiting for a copy of a book ('waiting'), or with one set aside ('ready')."""
+
+    __slots__ = HOLD_FIELDNAMES
+    FIELDS = HOLD_FIELDNAMES
+
+    @classmethod
+    def from_values(cls, values):
+        """Builds a hold from a HOLD_FIELDNAMES tuple as utils.read_rows() yields."""
+        return cls(dict(zip(HOLD_FIELDNAMES, values)))
+
+    def queue_key(self):
+        """Sort key in the book's queue: higher priority first, then first come, first served."""
+        return (-_count(self.priority), _count(self.hold_id), self.hold_id)
+
+
+class Book:
+    """View of one row of a BookTable; reads and writes go to the table's columns."""
+
+    __slots__ = ('_table', '_position')
+
+    def __init__(self, table, position):
+        self._table = table
+        self._position = position
+
+    def __getitem__(self, field):
+        return self._table._columns[field][self._position]
+
+    def __setitem__(self, field, value):
+        self._table.set_value(self._position, field, value)
+
+    def get(self, field, default=None):
+        column = self._table._columns.get(field)
+        return default if column is None else column[self._position]
+
+    def keys(self):
+        return list(BookTable.FIELDS)
+
+    def as_dict(self):
+        return {field: self[field] for field in BookTable.FIELDS}
+
+    def __eq__(self, other):
+        return (isinstance(other, Book) and other._table is self._table
+                and other._position == self._position)
+
+    def __hash__(self):
+        return hash((id(self._table), self._position))
+
+    def __repr__(self):
+        return f"Book({self.as_dict()})"
+
+
+class BookTable:
+    """Books stored column by column.
+
+    'quantity' and 'available' are parsed once into array('i') columns;
+    the string columns are plain lists, with ids and authors interned.
+    A book is addressed by its position (storage order) and handed out
+    as a Book view. available_bits holds one byte per position, 1 while
+    a copy is on the shelf, so available-only scans run in C. A table
+    built from a binary snapshot (from_snapshot()) reads its strings
+    straight from the mapped file and finds ids through the snapshot's
+    id-sorted index.
+    """
+
+    FIELDS = BOOK_FIELDNAMES
+
+    def __init__(self, rows=()):
+        self.ids = []
+        self.titles = []
+        self.authors = []
+        self.isbns = []
+        self.quantity = array('i')
+        self.available = array('i')
+        self.available_bits = bytearray()
+        self._positions = {} # id -> position
+        self._id_order = None # Snapshot positions sorted by id, for bisecting; see from_snapshot()
+        self._bind_columns()
+        self.extend(rows)
+
+    def _bind_columns(self):
+        self._columns = {'id': self.ids, 'title': self.titles, 'author': self.authors,
+                         'isbn': self.isbns, 'quantity': self.quantity, 'available': self.available}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Builds the table over a modules.snapshot.Snapshot without decoding a single row.
+
+        The counters are copied out in one go, as they change; every string
+        stays in the mapped file until read. Ids are found by bisecting the
+        snapshot's id order and remembered in the id index once found.
+        """
+        table = cls()
+        table.ids = snapshot.column('books', 'id')
+        table._id_order = snapshot.column('books', 'id_order')
+        table.titles = snapshot.column('books', 'title')
+        table.authors = snapshot.column('books', 'author')
+        table.isbns = snapshot.column('books', 'isbn')
+        table.quantity = snapshot.counters('books', 'quantity')
+        table.available = snapshot.counters('books', 'available')
+        table.available_bits = bytearray(snapshot.column('books', 'available_bits'))
+        table._bind_columns()
+        return table
+
+    def columns(self):
+        """Returns the columns for modules.snapshot.write_snapshot().
+
+        That is every field, plus 'available_bits' and 'id_order', the
+        positions sorted by id that from_snapshot() bisects.
+        """
+        id_order = self._id_order
+        if id_order is None or len(id_order) != len(self.ids): # Not over a snapshot, or books added since
+            id_order = _id_order(self.ids)
+        return dict(self._columns, available_bits=self.available_bits, id_order=id_order)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (Book(self, position) for position in range(len(self.ids)))
+
+    def column(self, field):
+        """Returns the column of one field, in storage order."""
+        return self._columns[field]
+
+    def append(self, row):
+        """Adds a book from a row dict (string values, as read from storage). Returns its view."""
+        position = len(self.ids)
+        book_id = _shared(row.get('id'))
+        self._positions[book_id] = position
+        self.ids.append(book_id)
+        self.titles.append(_text(row.get('title')))
+        self.authors.append(_shared(row.get('author')))
+        self.isbns.append(_text(row.get('isbn')))
+        self.quantity.append(_count(row.get('quantity')))
+        available = _count(row.get('available'))
+        self.available.append(available)
+        self.available_bits.append(available > 0)
+        return Book(self, position)
+
+    def extend(self, rows):
+        """Adds books from BOOK_FIELDNAMES tuples with int counts, as utils.read_rows() yields."""
+        intern = sys.intern
+        positions = self._positions
+        ids, titles, authors, isbns = self.ids, self.titles, self.authors, self.isbns
+        quantity, available, bits = self.quantity, self.available, self.available_bits
+        for book_id, title, author, isbn, copies, on_shelf in rows:
+            book_id = intern(book_id)
+            positions[book_id] = len(ids)
+            ids.append(book_id)
+            titles.append(title)
+            authors.append(intern(author))
+            isbns.append(isbn)
+            quantity.append(copies)
+            available.append(on_shelf)
+            bits.append(on_shelf > 0)
+
+    def rows(self, fields, start=0):
+        """Returns an iterator of tuples of the fields for the books from position 'start' on.
+
+        Read straight from the columns, in bulk where a snapshot column allows.
+        """
+        columns = [self._columns[field] for field in fields]
+        if start:
+            positions = range(start, len(self.ids))
+            columns = [map(column.__getitem__, positions) for column in columns]
+        return zip(*columns)
+
+    def position(self, book_id):
+        """Returns the position of a book id, or None."""
+        position = self._positions.get(book_id)
+        if position is None and self._id_order is not None:
+            position = _find_in_snapshot(self.ids, self._id_order, book_id)
+            if position is not None:
+                self._positions[book_id] = position
+        return position
+
+    def get(self, book_id):
+        """Returns the view of a book id, or None."""
+        position = self.position(book_id)
+        return None if position is None else Book(self, position)
+
+    def view(self, position):
+        return Book(self, position)
+
+    def set_value(self, position, field, value):
+        if field == 'id':
+            raise KeyError("A book's id cannot change")
+        if field in ('quantity', 'available'):
+            value = _count(value)
+            if field == 'available':
+                self.available_bits[position] = value > 0
+        else:
+            value = _text(value)
+        self._columns[field][position] = value
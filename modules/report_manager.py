@@ -1,85 +1,40 @@
-from utils import load_data, BOOKS_FILE, MEMBERS_FILE
 import datetime
+import modules.branches as branches
+import modules.library_api as api
+import modules.instrumentation as instrumentation
+from modules.analytics import period_key
+from modules.library_api import LibraryError
 
-def generate_library_report():
+ANALYTICS_ROWS = 10 # Rows shown per list; exports hold every row
+
+def generate_library_report(verify=False):
     """Generates a comprehensive library report."""
-    books = load_data(BOOKS_FILE)
-    members = load_data(MEMBERS_FILE)
+    report = api.library_report()
+    totals = report['totals']
 
     print("\n" + "="*80)
     print("                       LIBRARY REPORT")
     print("="*80)
 
     # --- Book Summary ---
-    total_books = len(books)
-    total_quantity = sum(int(b.get('quantity', '0')) for b in books)
-    total_available = sum(int(b.get('available', '0')) for b in books)
-    total_borrowed = total_quantity - total_available
-
     print("\n--- Book Summary ---")
-    print(f"Total Unique Books: {total_books}")
-    print(f"Total Book Copies: {total_quantity}")
-    print(f"Total Available Books: {total_available}")
-    print(f"Total Books Currently Borrowed: {total_borrowed}")
+    print(f"Total Unique Books: {totals['unique_books']}")
+    print(f"Total Book Copies: {totals['total_copies']}")
+    print(f"Total Available Books: {totals['total_available']}")
+    print(f"Total Books Currently Borrowed: {totals['total_borrowed']}")
     print("-" * 80)
 
     # --- Member Summary ---
-    total_members = len(members)
-    members_with_borrowed_books = 0
-    total_books_borrowed_across_members = 0
-    
-    for member in members:
-        borrowed_books_list = []
-        if 'borrowed_books' in member and isinstance(member['borrowed_books'], str) and member['borrowed_books']:
-            try:
-                borrowed_books_list = eval(member['borrowed_books'])
-                if borrowed_books_list:
-                    members_with_borrowed_books += 1
-                    total_books_borrowed_across_members += len(borrowed_books_list)
-            except (SyntaxError, NameError):
-                pass
-
     print("\n--- Member Summary ---")
-    print(f"Total Registered Members: {total_members}")
-    print(f"Members with Books Currently Borrowed: {members_with_borrowed_books}")
-    print(f"Total Books Borrowed (counting multiple books per member): {total_books_borrowed_across_members}")
+    print(f"Total Registered Members: {totals['total_members']}")
+    print(f"Members with Books Currently Borrowed: {totals['members_with_loans']}")
+    print(f"Total Books Borrowed (counting multiple books per member): {totals['active_loans']}")
     print("-" * 80)
 
     # --- Overdue Books (Detailed) ---
     print("\n--- Overdue Books ---")
-    overdue_found = False
-    today = datetime.date.today()
-    borrow_duration_limit = datetime.timedelta(days=14) 
-
-    overdue_books_list = []
-
-    for member in members:
-        borrowed_books_list = []
-        if 'borrowed_books' in member and isinstance(member['borrowed_books'], str) and member['borrowed_books']:
-            try:
-                borrowed_books_list = eval(member['borrowed_books'])
-            except (SyntaxError, NameError):
-                pass 
-
-        for entry in borrowed_books_list:
-            try:
-                book_id, borrow_date_str = entry.split(':')
-                borrow_date = datetime.date.fromisoformat(borrow_date_str)
-                
-                if today - borrow_date > borrow_duration_limit:
-                    book = next((b for b in books if b['id'] == book_id), None)
-                    if book:
-                        overdue_by_days = (today - borrow_date - borrow_duration_limit).days
-                        overdue_books_list.append({
-                            'member_id': member['id'],
-                            'member_name': member['name'],
-                            'book_title': book['title'],
-                            'borrowed_date': borrow_date_str,
-                            'overdue_by_days': overdue_by_days
-                        })
-                        overdue_found = True
-            except (ValueError, IndexError):
-                pass
+    overdue_books_list = report['overdue']
+    overdue_found = bool(overdue_books_list)
 
     if overdue_found:
         print(f"{'Member ID':<10} {'Member Name':<20} {'Book Title':<30} {'Borrowed Date':<15} {'Overdue By (days)':<20}")
@@ -90,3 +45,121 @@ def generate_library_report():
         print("No overdue books found.")
     print("="*80)
 
+    if verify:
+        verify_totals()
+
+def generate_branch_report():
+    """Generates the library report of every branch, with the totals combined."""
+    report = branches.library_report()
+    totals = report['totals']
+
+    print("\n" + "="*100)
+    print("                              ALL-BRANCH LIBRARY REPORT")
+    print("="*100)
+    for branch, error in report['errors'].items():
+        print(f"Branch '{branch}' could not be reached: {error}")
+
+    print("\n--- Branch Summary ---")
+    print(f"{'Branch':<12} {'Titles':<10} {'Copies':<10} {'Available':<10} {'Borrowed':<10} {'Members':<10} {'Overdue':<10}")
+    print("-" * 100)
+    for row in report['branches']:
+        print(f"{row['branch']:<12} {row['unique_books']:<10} {row['total_copies']:<10} {row['total_available']:<10} {row['total_borrowed']:<10} {row['total_members']:<10} {row['overdue']:<10}")
+    if totals:
+        print("-" * 100)
+        print(f"{'All':<12} {totals['unique_books']:<10} {totals['total_copies']:<10} {totals['total_available']:<10} {totals['total_borrowed']:<10} {totals['total_members']:<10} {len(report['overdue']):<10}")
+
+    print("\n--- Overdue Books ---")
+    if report['overdue']:
+        print(f"{'Branch':<12} {'Member ID':<10} {'Member Name':<20} {'Book Title':<30} {'Borrowed Date':<15} {'Overdue By (days)':<20}")
+        print("-" * 100)
+        for loan in report['overdue']:
+            print(f"{loan['branch']:<12} {loan['member_id']:<10} {loan['member_name']:<20} {loan['book_title']:<30} {loan['borrowed_date']:<15} {loan['overdue_by_days']:<20}")
+    else:
+        print("No overdue books found.")
+    print("="*100)
+
+def verify_totals():
+    """Recounts the report totals from the raw rows and flags any drift."""
+    drift = api.verify_totals()
+
+    print("\n--- Totals Verification ---")
+    if not drift:
+        print("All running totals match a full recount.")
+    else:
+        print(f"{'Counter':<25} {'Running':<10} {'Recounted':<10}")
+        print("-" * 45)
+        for field, (counted, expected) in drift.items():
+            print(f"{field:<25} {counted:<10} {expected:<10}")
+    print("="*80)
+    return drift
+
+def display_circulation_analytics(period='month', on=None, export_folder=None):
+    """Shows borrowing activity for a period: most borrowed titles, busiest titles, most active members."""
+    on = on or datetime.date.today()
+    summary = api.circulation_summary(period, on)
+    label = "all time" if period == 'all' else f"{period} {period_key(period, on)}"
+
+    print("\n" + "="*80)
+    print(f"                 CIRCULATION ANALYTICS ({label})")
+    print("="*80)
+    print(f"Borrows this {summary['period']} ({summary['key']}): {summary['borrows']}")
+    print(f"Returns this {summary['period']} ({summary['key']}): {summary['returns']}")
+
+    print("\n--- Most Borrowed Titles ---")
+    books = api.top_books(period, on, limit=ANALYTICS_ROWS)
+    if books:
+        print(f"{'ID':<8} {'Title':<35} {'Author':<25} {'Borrows':<8}")
+        print("-" * 80)
+        for book in books:
+            print(f"{book['book_id']:<8} {book['title']:<35} {book['author']:<25} {book['borrows']:<8}")
+    else:
+        print("No borrowing recorded yet.")
+
+    print(f"\n--- Title Utilization (month {period_key('month', on)}) ---")
+    busiest = api.book_utilization(on, limit=ANALYTICS_ROWS)
+    if busiest:
+        print(f"{'ID':<8} {'Title':<35} {'Copies':<7} {'Days Out':<9} {'Utilization':<11}")
+        print("-" * 80)
+        for book in busiest:
+            print(f"{book['book_id']:<8} {book['title']:<35} {book['copies']:<7} {book['loan_days']:<9} "
+                  f"{book['utilization']:<11.1%}")
+    else:
+        print("No copy-days on loan this month.")
+
+    print("\n--- Most Active Members ---")
+    members = api.top_members(period, on, limit=ANALYTICS_ROWS)
+    if members:
+        print(f"{'ID':<8} {'Name':<35} {'Borrows':<8}")
+        print("-" * 80)
+        for member in members:
+            print(f"{member['member_id']:<8} {member['name']:<35} {member['borrows']:<8}")
+    else:
+        print("No borrowing recorded yet.")
+    print("="*80)
+
+    if export_folder:
+        for path in api.export_analytics(export_folder, period, on):
+            print(f"Exported '{path}'.")
+
+def circulation_analytics():
+    """Asks for a period, shows the analytics and offers a CSV export."""
+    period = input("Period (day, week, month or all) [month]: ").strip().lower() or 'month'
+    try:
+        display_circulation_analytics(period)
+        folder = input("\nFolder to export the full lists to as CSV (blank to skip): ").strip()
+        if folder:
+            for path in api.export_analytics(folder, period):
+                print(f"Exported '{path}'.")
+    except LibraryError as error:
+        print(f"\n{error}")
+
+def display_performance_stats():
+    """Shows the time and I/O spent per operation so far this session."""
+    print("\n" + "="*108)
+    print("                                     PERFORMANCE STATS (this session)")
+    print("="*108)
+    if not instrumentation.stats():
+        print("Nothing measured yet.")
+        return
+    print("\n".join(instrumentation.stats_table()))
+    print("="*108)
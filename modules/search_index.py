@@ -0,0 +1,258 @@
+import bisect
+import heapq
+import re
+import unicodedata
+from array import array
+from collections import Counter
+from utils import normalize_isbn
+
+_WORD_RE = re.compile(r'\w+')
+_ISBN_RE = re.compile(r'[\dxX][\dxX\-]*')
+
+# Score of a match in each field; an exact token match counts double a prefix match.
+FIELD_WEIGHTS = {'title': 3, 'author': 2, 'isbn': 1}
+SEARCH_FIELDS = ['id'] + list(FIELD_WEIGHTS) # Columns an index is built from, see SearchIndex.add_rows()
+FUZZY_THRESHOLD = 0.2 # Least trigram similarity for a word to count as a misspelling of a term
+FUZZY_WORDS = 8 # Most similar words a misspelt term is matched against
+FUZZY_MIN_LENGTH = 3 # Shorter terms only match by prefix
+SEARCH_INDEX_VERSION = 2 # Bumped whenever a saved index would no longer fit this code
+
+
+def normalize(text):
+    """Lowercases text and strips accents, so 'García ' and 'garcia' index alike."""
+    text = text.casefold()
+    if not text.isascii():
+        text = ''.join(ch for ch in unicodedata.normalize('NFKD', text) if not unicodedata.combining(ch))
+    return text
+
+def tokenize(text):
+    """Splits text into normalized word tokens; surrounding spaces and punctuation drop out."""
+    return _WORD_RE.findall(normalize(text))
+
+def query_terms(query):
+    """Splits a search query into terms; hyphenated ISBNs stay one term."""
+    terms = []
+    for chunk in query.split():
+        if _ISBN_RE.fullmatch(chunk) and any(ch.isdigit() for ch in chunk):
+            terms.append(normalize_isbn(chunk))
+        else:
+            terms.extend(tokenize(chunk))
+    return terms
+
+def trigrams(word):
+    """Returns the set of three-letter pieces of a word, padded as in PostgreSQL's pg_trgm."""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Inverted index from title, author and ISBN tokens to book ids.
+
+    Distinct tokens are also kept in a sorted list, so every token that
+    starts with a query term is found by bisecting to the term and reading
+    forward. Multi-term queries intersect the per-term matches (AND) and
+    rank the survivors by summed field weights.
+
+    For typos, the title and author words are also indexed by trigram:
+    the words sharing trigrams with a term are counted from the trigrams'
+    postings, so finding the similar ones costs in the size of the
+    vocabulary touched, not of the catalogue. They are only looked at
+    when a search finds nothing by prefix (see search()).
+    """
+
+    def __init__(self, rows=()):
+        self._postings = {} # token -> {book_id: weight of the best field it appears in}
+        self._words = [] # Title and author tokens; a word's number is its place here
+        self._word_numbers = {} # word -> number
+        self._word_sizes = array('i') # number -> how many trigrams the word has
+        self._trigrams = {} # trigram -> array of the numbers of the words holding it
+        self._tokens = []
+        self.add_rows(rows)
+
+    def _index(self, book_id, title, author, isbn):
+        """Adds a book's tokens to the postings. Returns tokens seen for the first time."""
+        new_tokens = []
+        for field, value in (('title', title), ('author', author), ('isbn', isbn)):
+            weight = FIELD_WEIGHTS[field]
+            tokens = [normalize_isbn(value)] if field == 'isbn' else tokenize(value or '')
+            for token in tokens:
+                if not token:
+                    continue
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    new_tokens.append(token)
+                if postings.get(book_id, 0) < weight:
+                    postings[book_id] = weight
+                if field != 'isbn' and token not in self._word_numbers:
+                    self._add_word(token)
+        return new_tokens
+
+    def _add_word(self, word):
+        number = self._word_numbers[word] = len(self._words)
+        self._words.append(word)
+        grams = trigrams(word)
+        self._word_sizes.append(len(grams))
+        for gram in grams:
+            numbers = self._trigrams.get(gram)
+            if numbers is None:
+                numbers = self._trigrams[gram] = array('i')
+            numbers.append(number)
+
+    def columns(self):
+        """Returns the index as tables of columns for modules.snapshot.write_snapshot(); see from_snapshot().
+
+        Postings refer to books by their number in the 'books' table and
+        trigrams to words by their number, so nothing but plain strings
+        and integer arrays is stored.
+        """
+        numbers = {} # book id -> number
+        books, weights, token_ends = array('i'), array('b'), array('Q')
+        for token in self._tokens:
+            postings = self._postings[token]
+            books.extend(numbers.setdefault(book_id, len(numbers)) for book_id in postings)
+            weights.extend(postings.values())
+            token_ends.append(len(books))
+        grams = list(self._trigrams)
+        gram_words, gram_ends = array('i'), array('Q')
+        for gram in grams:
+            gram_words.extend(self._trigrams[gram])
+            gram_ends.append(len(gram_words))
+        return {
+            'books': {'id': list(numbers)},
+            'tokens': {'token': self._tokens, 'end': token_ends},
+            'postings': {'book': books, 'weight': weights},
+            'words': {'word': self._words, 'size': self._word_sizes},
+            'trigrams': {'trigram': grams, 'end': gram_ends},
+            'trigram_words': {'word': gram_words},
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Rebuilds an index from a modules.snapshot.Snapshot of the tables columns() returned."""
+        index = cls()
+        book_ids = list(snapshot.column('books', 'id'))
+        books, weights = snapshot.counters('postings', 'book'), snapshot.counters('postings', 'weight')
+        index._tokens = list(snapshot.column('tokens', 'token'))
+        start = 0
+        for token, end in zip(index._tokens, snapshot.counters('tokens', 'end')):
+            index._postings[token] = dict(zip(map(book_ids.__getitem__, books[start:end]), weights[start:end]))
+            start = end
+        index._words = list(snapshot.column('words', 'word'))
+        index._word_numbers = {word: number for number, word in enumerate(index._words)}
+        index._word_sizes = snapshot.counters('words', 'size')
+        gram_words = snapshot.counters('trigram_words', 'word')
+        start = 0
+        for gram, end in zip(snapshot.column('trigrams', 'trigram'), snapshot.counters('trigrams', 'end')):
+            index._trigrams[gram] = gram_words[start:end]
+            start = end
+        return index
+
+    def add(self, book):
+        """Indexes one new book without rebuilding the index."""
+        self.add_many([book])
+
+    def add_many(self, books):
+        """Indexes new books (mappings with SEARCH_FIELDS) without rebuilding the index."""
+        self.add_rows([book[field] for field in SEARCH_FIELDS] for book in books)
+
+    def add_rows(self, rows):
+        """Indexes (id, title, author, isbn) tuples without rebuilding the index."""
+        new_tokens = []
+        for row in rows:
+            new_tokens.extend(self._index(*row))
+        if len(new_tokens) > 64:
+            # Cheaper to merge one sorted batch than to insort each token.
+            self._tokens = sorted(self._tokens + new_tokens)
+        else:
+            for token in new_tokens:
+                bisect.insort(self._tokens, token)
+
+    def similar_words(self, term, threshold=FUZZY_THRESHOLD, limit=None):
+        """Returns [(word, similarity)] for title and author words close to a term, most similar first.
+
+        Similarity is the share of trigrams two words have in common
+        (Jaccard), from 0 to 1; words below the threshold are left out.
+        """
+        grams = trigrams(term)
+        shared = Counter()
+        for gram in grams:
+            numbers = self._trigrams.get(gram)
+            if numbers:
+                shared.update(numbers)
+        similar = []
+        for number, common in shared.items():
+            similarity = common / (len(grams) + self._word_sizes[number] - common)
+            if similarity >= threshold:
+                similar.append((self._words[number], similarity))
+        if limit:
+            return heapq.nlargest(limit, similar, key=lambda pair: pair[1])
+        similar.sort(key=lambda pair: pair[1], reverse=True)
+        return similar
+
+    def _term_postings(self, term, threshold=None):
+        """Yields (postings, factor) for the tokens a term matches.
+
+        Tokens starting with the term count once, the term itself twice.
+        With a threshold, the FUZZY_WORDS words most similar to the term
+        count by their similarity, so below any prefix match.
+        """
+        position = bisect.bisect_left(self._tokens, term)
+        while position < len(self._tokens) and self._tokens[position].startswith(term):
+            token = self._tokens[position]
+            yield self._postings[token], 2 if token == term else 1
+            position += 1
+        if threshold is not None and len(term) >= FUZZY_MIN_LENGTH:
+            for word, similarity in self.similar_words(term, threshold, FUZZY_WORDS):
+                yield self._postings[word], similarity
+
+    def _term_scores(self, term, threshold=None, candidates=None):
+        """Scores every book the term matches, or only the candidates among them."""
+        scores = {}
+        for postings, factor in self._term_postings(term, threshold):
+            if candidates is not None and len(candidates) < len(postings):
+                # Fewer books left in the running than hold the token: look them up instead.
+                pairs = [(book_id, postings[book_id]) for book_id in candidates if book_id in postings]
+            else:
+                pairs = postings.items()
+            for book_id, weight in pairs:
+                score = weight * factor
+                if scores.get(book_id, 0) < score:
+                    scores[book_id] = score
+        return scores
+
+    def _match(self, terms, threshold=None):
+        """Returns {book_id: score} for the books matching every term."""
+        results = None
+        # Longest terms first: they tend to match fewest books and shrink the set early.
+        for term in sorted(set(terms), key=len, reverse=True):
+            scores = self._term_scores(term, threshold, results)
+            if results is None:
+                results = scores
+            else:
+                results = {book_id: score + scores[book_id]
+                           for book_id, score in results.items() if book_id in scores}
+            if not results:
+                return {}
+        return results
+
+    def search(self, query, limit=None, fuzzy=True, threshold=FUZZY_THRESHOLD, scored=False):
+        """Returns ids of books matching every term of the query, best match first.
+
+        Terms match the tokens they start. If that finds nothing and fuzzy
+        is on, the search is run again letting terms also match similar
+        words, so a misspelt title or author still finds the book; exact
+        and prefix matches still rank first. With scored, returns
+        (book_id, score) pairs instead, e.g. to merge several indexes.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        results = self._match(terms)
+        if fuzzy and not results:
+            results = self._match(terms, threshold)
+        if limit:
+            ranked = heapq.nlargest(limit, results, key=results.get)
+        else:
+            ranked = sorted(results, key=results.get, reverse=True)
+        return [(book_id, results[book_id]) for book_id in ranked] if scored else ranked
@@ -0,0 +1,191 @@
+"""Binary snapshots: whole tables in one file that opens with mmap, without parsing.
+
+Counter columns (array('i'), and bytearrays such as 'available_bits')
+are stored as they are in memory. Any other column is a sequence of
+strings, stored as one UTF-8 heap (each value followed by a NUL) plus
+an array('Q') of the offset where each value starts. The file holds
+SNAPSHOT_MAGIC, a 4-byte header length, the JSON header, then every
+column at the 8-byte aligned offset the header gives.
+"""
+import itertools
+import json
+import mmap
+import operator
+import os
+import sys
+from array import array
+from modules.instrumentation import instrumented, record_io
+from utils import ensure_data_dir_exists, fsync_dir, INT_FIELDS
+
+SNAPSHOT_MAGIC = b'LIBSNAP1'
+
+def _aligned(size):
+    return -(-size // 8) * 8
+
+@instrumented()
+def write_snapshot(file_path, tables, sources):
+    """Writes whole tables, {table: {field: values}}, to a snapshot file, replacing it atomically.
+
+    'sources' is kept in the header for the reader to check the snapshot
+    against (file signatures for the CSV backend).
+    """
+    sections = [] # (offset, buffer), in file order
+    header = {'byteorder': sys.byteorder, 'sources': sources, 'tables': {}}
+    offset = 0
+    for table, columns in tables.items():
+        header['tables'][table] = described = {}
+        for field, values in columns.items():
+            if isinstance(values, (array, bytearray, bytes, memoryview)): # memoryview: a column read from a snapshot
+                sections.append((offset, values))
+                kind = values.typecode if isinstance(values, array) else getattr(values, 'format', 'B')
+                described[field] = {'kind': kind, 'offset': offset, 'count': len(values)}
+                offset = _aligned(offset + len(memoryview(values).cast('B')))
+                continue
+            values = list(values) # Read once, even from a HeapColumn
+            text = '\x00'.join(values)
+            heap = (text + '\x00').encode('utf-8') if values else b''
+            if len(heap) == len(text) + (1 if values else 0): # All ASCII: byte offsets are string offsets
+                lengths = map(len, values)
+            else:
+                lengths = (len(value.encode('utf-8')) for value in values)
+            offsets = array('Q', [0])
+            offsets.extend(itertools.accumulate(map(operator.add, lengths, itertools.repeat(1)))) # +1 for the NUL
+            heap_offset = _aligned(offset + len(offsets) * offsets.itemsize)
+            sections.append((offset, offsets))
+            sections.append((heap_offset, heap))
+            described[field] = {'kind': 'text', 'offset': offset, 'count': len(values),
+                                'heap': heap_offset, 'heap_size': len(heap),
+                                'nul_free': text.count('\x00') == max(len(values) - 1, 0)}
+            offset = _aligned(heap_offset + len(heap))
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(SNAPSHOT_MAGIC) + 4 + len(header_bytes))
+    ensure_data_dir_exists(os.path.dirname(file_path) or '.')
+    temp_path = file_path + '.tmp'
+    with open(temp_path, mode='wb') as file:
+        file.write(SNAPSHOT_MAGIC + len(header_bytes).to_bytes(4, 'little') + header_bytes)
+        for section_offset, buffer in sections:
+            file.write(b'\x00' * (data_start + section_offset - file.tell())) # Alignment padding
+            file.write(buffer)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+    fsync_dir(file_path)
+    record_io(rows_written=sum(max((column['count'] for column in described.values()), default=0)
+                               for described in header['tables'].values()),
+              bytes_written=os.path.getsize(file_path))
+
+
+class HeapColumn:
+    """Column of strings inside a snapshot, decoded one value at a time on access.
+
+    Nothing is decoded or copied up front: the offsets and the heap are
+    memoryviews of the mapped file. Values changed or appended later are
+    kept in Python on top of it.
+    """
+
+    __slots__ = ('_offsets', '_heap', '_nul_free', '_count', '_changed', '_appended')
+
+    def __init__(self, offsets, heap, nul_free=False):
+        self._offsets = offsets
+        self._heap = heap
+        self._nul_free = nul_free # No value holds a NUL, so the heap can be split at them
+        self._count = len(offsets) - 1
+        self._changed = {} # position -> value set since the snapshot was written
+        self._appended = []
+
+    def __len__(self):
+        return self._count + len(self._appended)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if position >= self._count:
+            return self._appended[position - self._count]
+        if position < 0:
+            raise IndexError(position)
+        value = self._changed.get(position)
+        if value is None:
+            value = str(self._heap[self._offsets[position]:self._offsets[position + 1] - 1], 'utf-8')
+        return value
+
+    def __setitem__(self, position, value):
+        if position < 0:
+            position += len(self)
+        if position >= self._count:
+            self._appended[position - self._count] = value
+        elif position >= 0:
+            self._changed[position] = value
+        else:
+            raise IndexError(position)
+
+    def __iter__(self):
+        if not self._nul_free or self._changed:
+            return map(self.__getitem__, range(len(self)))
+        values = str(self._heap, 'utf-8').split('\x00') # Everything in one pass
+        values.pop() # After the last NUL
+        return itertools.chain(values, self._appended)
+
+    def append(self, value):
+        self._appended.append(value)
+
+
+class Snapshot:
+    """A snapshot file opened with mmap (see write_snapshot()).
+
+    Counters come back as memoryviews of the mapping and text columns as
+    HeapColumns over it, so opening costs next to nothing whatever the
+    table sizes. On Windows, where a mapped file cannot be replaced, the
+    file is read into memory instead.
+    """
+
+    def __init__(self, file_path):
+        with open(file_path, mode='rb') as file:
+            if os.name == 'nt':
+                self._buffer = memoryview(file.read())
+            else:
+                self._buffer = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        if bytes(self._buffer[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError(f"'{file_path}' is not a library snapshot")
+        header_size = int.from_bytes(self._buffer[len(SNAPSHOT_MAGIC):len(SNAPSHOT_MAGIC) + 4], 'little')
+        header_end = len(SNAPSHOT_MAGIC) + 4 + header_size
+        header = json.loads(bytes(self._buffer[len(SNAPSHOT_MAGIC) + 4:header_end]))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"'{file_path}' was written on a machine with another byte order")
+        self.sources = header['sources']
+        self.tables = header['tables']
+        self._data_start = _aligned(header_end)
+
+    def row_count(self, table):
+        return next(iter(self.tables[table].values()))['count']
+
+    def column(self, table, field):
+        """Returns a memoryview for a counter column, a HeapColumn for a text one."""
+        column = self.tables[table][field]
+        start = self._data_start + column['offset']
+        if column['kind'] != 'text':
+            size = array(column['kind']).itemsize if column['kind'] != 'B' else 1
+            return self._buffer[start:start + column['count'] * size].cast(column['kind'])
+        offsets = self._buffer[start:start + (column['count'] + 1) * 8].cast('Q')
+        heap_start = self._data_start + column['heap']
+        return HeapColumn(offsets, self._buffer[heap_start:heap_start + column['heap_size']], column['nul_free'])
+
+    def counters(self, table, field):
+        """Returns a counter column copied into an array, which can then change."""
+        view = self.column(table, field)
+        copy = array(view.format)
+        copy.frombytes(view.cast('B'))
+        return copy
+
+    def rows(self, table, fieldnames):
+        """Returns a table as the tuples read_rows() yields."""
+        columns = [self.counters(table, field) if field in INT_FIELDS else list(self.column(table, field))
+                   for field in fieldnames]
+        return zip(*columns)
+
+def open_snapshot(file_path):
+    """Opens a snapshot file, or returns None if it is missing or unreadable."""
+    try:
+        return Snapshot(file_path)
+    except (OSError, ValueError, KeyError):
+        return None
@@ -0,0 +1,528 @@
+"""Storage backends behind LibraryStore: CSV files plus a journal, or SQLite.
+
+Both implement Repository. The CSV helpers in utils are plain file
+code; the ones used here are wrapped below so their time and I/O count
+in the performance stats (see modules/instrumentation.py).
+"""
+import ast
+import contextlib
+import datetime
+import os
+import sqlite3
+import threading
+import utils
+from modules.instrumentation import instrumented, record_io
+from modules.snapshot import open_snapshot, write_snapshot
+from utils import (read_header, read_rows, rows_as_tuples, truncate_journal, file_lock, file_signature,
+                   reserve_ids, read_sequences, ensure_data_dir_exists,
+                   BOOK_FIELDNAMES, MEMBER_FIELDNAMES, LOAN_FIELDNAMES, HOLD_FIELDNAMES, LOAN_PERIOD, COMPACT_EVERY,
+                   DATA_DIR, MEMBERS_FILE, LEGACY_MEMBERS_FILE, LOANS_JOURNAL_FILE, SEQUENCES_FILE, SNAPSHOT_FILE,
+                   SQLITE_FILE, STORAGE_BACKEND)
+
+
+def _size(file_path):
+    return os.path.getsize(file_path) if os.path.exists(file_path) else 0
+
+@instrumented()
+def load_data(file_path):
+    """Loads data from a CSV file as one dict per row (see utils.load_data())."""
+    rows = utils.load_data(file_path)
+    record_io(rows_read=len(rows))
+    return rows
+
+@instrumented()
+def save_data(file_path, data, fieldnames):
+    """Saves data to a CSV file, replacing it atomically (see utils.save_data())."""
+    utils.save_data(file_path, data, fieldnames)
+    record_io(rows_written=len(data), bytes_written=_size(file_path))
+
+@instrumented()
+def append_data(file_path, data, fieldnames):
+    """Appends rows to a CSV file in one write (see utils.append_data())."""
+    size = _size(file_path)
+    utils.append_data(file_path, data, fieldnames)
+    record_io(rows_written=len(data), bytes_written=_size(file_path) - size)
+
+@instrumented()
+def append_journal(file_path, entry):
+    """Appends one entry to a journal file and forces it to disk (see utils.append_journal())."""
+    size = _size(file_path)
+    utils.append_journal(file_path, entry)
+    record_io(rows_written=1, bytes_written=_size(file_path) - size)
+
+@instrumented()
+def read_journal(file_path, offset=0, end=None):
+    """Reads journal entries written after a byte offset (see utils.read_journal())."""
+    entries, offset = utils.read_journal(file_path, offset, end)
+    record_io(rows_read=len(entries))
+    return entries, offset
+
+
+class ConcurrentUpdateError(Exception):
+    """Raised when a compare-and-swap finds the row changed by someone else."""
+
+
+class Repository:
+    """Persistence interface behind LibraryStore.
+
+    The store keeps every row in memory and asks the repository for what
+    changed. Loan changes travel as journal-style entries:
+    {'op': 'borrow', 'loan': {...}, 'book_id': ..., 'available': ...} and
+    {'op': 'return', 'loan_id': ..., 'book_id': ..., 'available': ...},
+    where 'available' is the book's new count; hold changes as the
+    'hold_place', 'hold_ready' and 'hold_close' entries described in
+    modules/holds.py. {'op': 'batch', 'entries': [...]} groups several of
+    them into one all-or-nothing change, such as a borrow and the hold it
+    fulfils.
+    """
+
+    data_dir = DATA_DIR # Where files kept beside the tables (analytics) go
+
+    def write_lock(self):
+        """Context manager serializing writers across processes; re-entrant within one."""
+        return contextlib.nullcontext()
+
+    def refresh(self):
+        """Returns (rows, entries).
+
+        'rows' is a (books, members, loans, holds) tuple when the store must
+        reload everything, else None. Each is an iterable of value tuples in
+        *_FIELDNAMES order, with 'quantity' and 'available' as ints, as
+        read_rows() yields them, except that books and members may both
+        come as a Snapshot to build their tables from. 'entries' are changes to
+        apply on top, including those recorded through this repository
+        since the last call.
+        """
+        raise NotImplementedError
+
+    def record(self, entry):
+        """Durably records one entry (a batch included), all of it or nothing.
+
+        'expected_available' in a borrow or return is the book's count the
+        change was based on; if storage no longer holds that count, or a
+        hold change finds the hold moved on, ConcurrentUpdateError is
+        raised and nothing is written.
+        """
+        raise NotImplementedError
+
+    def add_rows(self, table, rows):
+        """Stores new 'books' or 'members' rows."""
+        raise NotImplementedError
+
+    def needs_compaction(self):
+        """True when compact() is due."""
+        return False
+
+    def table_signature(self, table):
+        """Returns something that changes whenever the stored table does, or None if the backend cannot tell."""
+        return None
+
+    def compact(self, books, loans, holds, members=None):
+        """Folds recorded entries into the stored tables, given their current rows."""
+
+    def snapshot_due(self):
+        """True when a binary snapshot is kept and no longer matches the stored tables."""
+        return False
+
+    def write_snapshot(self, books, members, loans):
+        """Writes a binary snapshot of the tables (books and members as their tables' columns()).
+
+        Returns its path, or None if this backend does not use snapshots.
+        """
+        return None
+
+    def reserve_ids(self, entity, count, seed):
+        """Reserves 'count' consecutive ids for an entity and returns the first one."""
+        raise NotImplementedError
+
+
+class CsvRepository(Repository):
+    """CSV snapshots of each table plus an append-only loans journal.
+
+    Borrows, returns and hold changes are appended to the journal (one
+    fsync per entry, so a borrow and the hold it fulfils land together)
+    and only folded back into the CSV snapshots by compact(). A snapshot
+    changed by another process makes refresh() reload everything and
+    replay the whole journal; otherwise it just reads the journal's tail.
+
+    Every write happens under an advisory lock on 'library.lock' in the
+    data directory. Writers refresh after taking it, and record() refuses
+    (ConcurrentUpdateError) an entry if anything was written since that
+    refresh, so an 'available' count is never decided from stale data.
+    """
+
+    TABLES = [('books', BOOK_FIELDNAMES), ('members', MEMBER_FIELDNAMES), ('loans', LOAN_FIELDNAMES),
+              ('holds', HOLD_FIELDNAMES)]
+    SNAPSHOT_TABLES = ['books', 'members', 'loans'] # Holds are few: always read from their CSV file
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        self._files = {table: os.path.join(data_dir, table + '.csv') for table, _ in self.TABLES}
+        self._files['members'] = os.path.join(data_dir, os.path.basename(MEMBERS_FILE))
+        legacy_members = os.path.join(data_dir, os.path.basename(LEGACY_MEMBERS_FILE))
+        if not os.path.exists(self._files['members']) and os.path.exists(legacy_members):
+            self._files['members'] = legacy_members # Keep using the file an earlier version wrote
+        self._fieldnames = dict(self.TABLES)
+        self._journal_file = os.path.join(data_dir, os.path.basename(LOANS_JOURNAL_FILE))
+        self._sequences_file = os.path.join(data_dir, os.path.basename(SEQUENCES_FILE))
+        self._lock_file = os.path.join(data_dir, 'library.lock')
+        self._snapshot_file = os.path.join(data_dir, os.path.basename(SNAPSHOT_FILE))
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._signatures = {} # table -> signature at our last load or write
+        self._journal_offset = 0
+        self._journal_entries = 0 # Entries not yet folded into the snapshots
+
+    def _is_stale(self):
+        journal_size = file_signature(self._journal_file)
+        journal_size = journal_size[1] if journal_size else 0
+        return (journal_size < self._journal_offset
+                or any(file_signature(path) != self._signatures.get(table, False)
+                       for table, path in self._files.items()))
+
+    def _saved(self, table):
+        self._signatures[table] = file_signature(self._files[table])
+
+    @contextlib.contextmanager
+    def write_lock(self):
+        with self._thread_lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with file_lock(self._lock_file):
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+
+    def refresh(self):
+        with self._thread_lock:
+            if self._is_stale():
+                # A reload may have to migrate old data, which writes.
+                with self.write_lock():
+                    return self._refresh()
+            return self._refresh()
+
+    def _refresh(self):
+        rows = None
+        legacy = False
+        if self._is_stale():
+            # Someone else compacted or rewrote the data: start over from the
+            # snapshots and replay the whole journal. The tables stream
+            # straight into the store.
+            legacy = 'borrowed_books' in read_header(self._files['members'])
+            snapshot = open_snapshot(self._snapshot_file) if not legacy else None
+            if snapshot and snapshot.sources == self._sources():
+                # The snapshot mirrors the CSV files as they are: no parsing.
+                rows = (snapshot, snapshot, snapshot.rows('loans', LOAN_FIELDNAMES),
+                        read_rows(self._files['holds'], HOLD_FIELDNAMES))
+            elif not legacy:
+                rows = tuple(read_rows(self._files[table], fieldnames) for table, fieldnames in self.TABLES)
+            for table in self._files:
+                self._saved(table)
+            self._journal_offset = 0
+            self._journal_entries = 0
+        entries = []
+        journal = file_signature(self._journal_file)
+        if journal and journal[1] > self._journal_offset: # Only read (and time) a journal that grew
+            entries, self._journal_offset = read_journal(self._journal_file, self._journal_offset)
+            self._journal_entries += len(entries)
+        if legacy:
+            rows = self._migrate_borrowed_books(load_data(self._files['books']), load_data(self._files['members']),
+                                                load_data(self._files['loans']), entries)
+            rows = tuple(list(rows_as_tuples(table_rows, fieldnames))
+                         for table_rows, (_, fieldnames) in zip(rows, self.TABLES))
+            rows += (read_rows(self._files['holds'], HOLD_FIELDNAMES),)
+            entries = []
+        return rows, entries
+
+    def _migrate_borrowed_books(self, books, members, loans, entries):
+        """One-shot conversion of the old 'borrowed_books' column into loan records."""
+        books_by_id = {book['id']: book for book in books}
+        members_by_id = {member['id']: member for member in members}
+        for entry in entries: # Written before loans had their own table
+            if entry.get('book_id') in books_by_id:
+                books_by_id[entry['book_id']]['available'] = entry['available']
+            if 'borrowed_books' in entry and entry.get('member_id') in members_by_id:
+                members_by_id[entry['member_id']]['borrowed_books'] = entry['borrowed_books']
+
+        if not os.path.exists(self._files['loans']):
+            loans = []
+            for member in members:
+                try:
+                    borrowed = ast.literal_eval(member.get('borrowed_books') or '[]')
+                except (SyntaxError, ValueError):
+                    borrowed = [] # Unreadable list: nothing to migrate
+                for borrowed_entry in borrowed:
+                    try:
+                        book_id, borrow_date_str = borrowed_entry.split(':')
+                        borrowed_on = datetime.date.fromisoformat(borrow_date_str)
+                    except (ValueError, AttributeError):
+                        continue # Skip malformed entries
+                    loans.append({
+                        'member_id': member['id'],
+                        'book_id': book_id,
+                        'borrowed_on': borrowed_on.isoformat(),
+                        'due_on': (borrowed_on + LOAN_PERIOD).isoformat(),
+                    })
+            first_id = self.reserve_ids('loans', len(loans), seed=lambda: 0) if loans else 0
+            for loan_id, loan in enumerate(loans, start=first_id):
+                loan['loan_id'] = str(loan_id)
+        for member in members:
+            member.pop('borrowed_books', None)
+        self.compact(books, loans, load_data(self._files['holds']), members)
+        return books, members, loans
+
+    def record(self, entry):
+        with self.write_lock():
+            self._check_fresh()
+            append_journal(self._journal_file, entry)
+
+    def _check_fresh(self):
+        """Refuses to write from state that other processes have moved past."""
+        self._drop_torn_entry()
+        journal_size = file_signature(self._journal_file)
+        if self._is_stale() or (journal_size[1] if journal_size else 0) != self._journal_offset:
+            raise ConcurrentUpdateError("Data changed since it was read.")
+
+    def _drop_torn_entry(self):
+        """Cuts off a last journal line that a writer crashed part-way through. Callers hold write_lock()."""
+        journal = file_signature(self._journal_file)
+        if not journal or journal[1] <= self._journal_offset or self._is_stale():
+            return
+        with open(self._journal_file, mode='r+b') as file:
+            file.seek(self._journal_offset)
+            if b'\n' in file.read():
+                return # Whole entries not read yet: a real conflict
+            # Writers append under the lock we hold, so nobody is still
+            # writing this line; left in place it would fail every write.
+            file.truncate(self._journal_offset)
+            os.fsync(file.fileno())
+
+    def add_rows(self, table, rows):
+        with self.write_lock():
+            append_data(self._files[table], rows, self._fieldnames[table])
+            self._saved(table)
+
+    def needs_compaction(self):
+        return self._journal_entries >= COMPACT_EVERY
+
+    def table_signature(self, table):
+        return file_signature(self._files[table])
+
+    def compact(self, books, loans, holds, members=None):
+        # Callers hold write_lock() and have refreshed, so the rows include
+        # every journal entry that is about to be truncated.
+        if members is None and not self._journal_entries:
+            return # Nothing to fold in
+        self._check_fresh()
+        # Loans before members: if the migration stops in between, the loans
+        # file exists and the next start only has to drop the old column.
+        save_data(self._files['loans'], loans, LOAN_FIELDNAMES)
+        self._saved('loans')
+        save_data(self._files['holds'], holds, HOLD_FIELDNAMES)
+        self._saved('holds')
+        if members is not None:
+            save_data(self._files['members'], members, MEMBER_FIELDNAMES)
+            self._saved('members')
+        save_data(self._files['books'], books, BOOK_FIELDNAMES)
+        self._saved('books')
+        truncate_journal(self._journal_file)
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def _sources(self):
+        """Signatures of the CSV files, as a snapshot records them."""
+        return {table: list(file_signature(self._files[table]) or []) for table in self.SNAPSHOT_TABLES}
+
+    def snapshot_due(self):
+        if not os.path.exists(self._snapshot_file):
+            return False # Only kept once the compact command has written one
+        snapshot = open_snapshot(self._snapshot_file)
+        return not snapshot or snapshot.sources != self._sources()
+
+    def write_snapshot(self, books, members, loans):
+        # Callers hold write_lock() and have compacted, so the CSV files
+        # hold exactly these rows.
+        self._check_fresh()
+        write_snapshot(self._snapshot_file, {
+            'books': books,
+            'members': members,
+            'loans': {field: [loan[field] for loan in loans] for field in LOAN_FIELDNAMES},
+        }, self._sources())
+        return self._snapshot_file
+
+    def reserve_ids(self, entity, count, seed):
+        return reserve_ids(entity, count, seed, sequences_file=self._sequences_file)
+
+    def sequences(self):
+        """Returns the last id handed out per entity."""
+        return read_sequences(self._sequences_file)
+
+
+class SqliteRepository(Repository):
+    """SQLite database in WAL mode with indexed books, members, loans and holds tables.
+
+    Borrows and returns are one transaction each: an INSERT or DELETE on
+    loans plus a single UPDATE of the book's 'available' column, with the
+    hold changes they cause in the same transaction. Changes
+    committed by other processes are noticed through PRAGMA data_version
+    and make refresh() reload everything.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS books (
+            id TEXT PRIMARY KEY, title TEXT, author TEXT, isbn TEXT,
+            quantity INTEGER NOT NULL DEFAULT 0, available INTEGER NOT NULL DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS books_isbn ON books (isbn);
+        CREATE TABLE IF NOT EXISTS members (id TEXT PRIMARY KEY, name TEXT, contact TEXT);
+        CREATE TABLE IF NOT EXISTS loans (
+            loan_id TEXT PRIMARY KEY, member_id TEXT NOT NULL, book_id TEXT NOT NULL,
+            borrowed_on TEXT, due_on TEXT);
+        CREATE INDEX IF NOT EXISTS loans_member ON loans (member_id);
+        CREATE INDEX IF NOT EXISTS loans_book ON loans (book_id);
+        CREATE INDEX IF NOT EXISTS loans_due ON loans (due_on);
+        CREATE TABLE IF NOT EXISTS holds (
+            hold_id TEXT PRIMARY KEY, member_id TEXT NOT NULL, book_id TEXT NOT NULL,
+            priority TEXT, placed_on TEXT, status TEXT NOT NULL, expires_on TEXT);
+        CREATE UNIQUE INDEX IF NOT EXISTS holds_member_book ON holds (member_id, book_id);
+        CREATE INDEX IF NOT EXISTS holds_book ON holds (book_id, status);
+        CREATE TABLE IF NOT EXISTS sequences (entity TEXT PRIMARY KEY, last_id INTEGER NOT NULL);
+    """
+    TABLES = CsvRepository.TABLES
+
+    def __init__(self, db_file=SQLITE_FILE):
+        ensure_data_dir_exists(os.path.dirname(db_file) or '.')
+        self.db_file = db_file
+        self.data_dir = os.path.dirname(db_file) or '.'
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE.
+        self._connection = sqlite3.connect(db_file, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(self.SCHEMA)
+        self._data_version = None
+        self._pending = [] # Entries recorded here, handed back by the next refresh()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _select(self, table, fieldnames):
+        cursor = self._connection.execute(f"SELECT {', '.join(fieldnames)} FROM {table} ORDER BY rowid")
+        # Same tuples as read_rows() yields for the CSV backend.
+        return rows_as_tuples((dict(zip(fieldnames, row)) for row in cursor), fieldnames)
+
+    def refresh(self):
+        rows = None
+        data_version = self._connection.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            rows = tuple(self._select(table, fieldnames) for table, fieldnames in self.TABLES)
+            self._pending = [] # Already part of the rows
+        entries, self._pending = self._pending, []
+        return rows, entries
+
+    @instrumented('storage.sqlite_record')
+    def record(self, entry):
+        changes = entry['entries'] if entry['op'] == 'batch' else [entry]
+        with self._transaction() as connection:
+            for change in changes:
+                if change['op'].startswith('hold_'):
+                    self._record_hold_change(connection, change)
+                else:
+                    self._record_change(connection, change)
+            self._check_set_aside(connection, {change['book_id'] for change in changes if 'book_id' in change})
+        self._pending.append(entry)
+        record_io(rows_written=len(changes))
+
+    def _record_change(self, connection, entry):
+        # Compare-and-swap: only update the count the change was based on.
+        updated = connection.execute('UPDATE books SET available = ? WHERE id = ? AND available = ?',
+                                     (int(entry['available']), entry['book_id'],
+                                      int(entry['expected_available']))).rowcount
+        if entry['op'] == 'borrow':
+            loan = entry['loan']
+            connection.execute('INSERT INTO loans VALUES (?, ?, ?, ?, ?)',
+                               [loan[field] for field in LOAN_FIELDNAMES])
+        else:
+            updated = updated and connection.execute('DELETE FROM loans WHERE loan_id = ?',
+                                                     (entry['loan_id'],)).rowcount
+        if not updated:
+            raise ConcurrentUpdateError(f"Book '{entry['book_id']}' changed since it was read.")
+
+    def _record_hold_change(self, connection, entry):
+        # Each change only applies to the hold as it was read.
+        if entry['op'] == 'hold_place':
+            try:
+                connection.execute('INSERT INTO holds VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                   [entry['hold'][field] for field in HOLD_FIELDNAMES])
+            except sqlite3.IntegrityError:
+                raise ConcurrentUpdateError("The member's hold on the book was placed elsewhere.") from None
+            return
+        if entry['op'] == 'hold_ready':
+            updated = connection.execute("UPDATE holds SET status = 'ready', expires_on = ? "
+                                         "WHERE hold_id = ? AND status = 'waiting'",
+                                         (entry['expires_on'], entry['hold_id'])).rowcount
+        else:
+            updated = connection.execute('DELETE FROM holds WHERE hold_id = ?', (entry['hold_id'],)).rowcount
+        if not updated:
+            raise ConcurrentUpdateError(f"Hold {entry['hold_id']} changed since it was read.")
+
+    def _check_set_aside(self, connection, book_ids):
+        """Refuses a change that leaves more copies set aside for ready holds than are on the shelf."""
+        for book_id in book_ids:
+            ready, available = connection.execute(
+                "SELECT (SELECT COUNT(*) FROM holds WHERE book_id = ? AND status = 'ready'), "
+                "(SELECT available FROM books WHERE id = ?)", (book_id, book_id)).fetchone()
+            if available is not None and ready > available:
+                raise ConcurrentUpdateError(f"Copies of book '{book_id}' were set aside since it was read.")
+
+    @instrumented('storage.sqlite_add_rows')
+    def add_rows(self, table, rows):
+        fieldnames = dict(self.TABLES)[table]
+        with self._transaction() as connection:
+            connection.executemany(
+                f"INSERT INTO {table} ({', '.join(fieldnames)}) VALUES ({', '.join('?' * len(fieldnames))})",
+                ([row.get(field) for field in fieldnames] for row in rows))
+        record_io(rows_written=len(rows))
+
+    def compact(self, books, loans, holds, members=None):
+        self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def reserve_ids(self, entity, count, seed):
+        with self._transaction() as connection:
+            row = connection.execute('SELECT last_id FROM sequences WHERE entity = ?', (entity,)).fetchone()
+            last_id = row[0] if row else seed()
+            connection.execute('INSERT OR REPLACE INTO sequences VALUES (?, ?)', (entity, last_id + count))
+        return last_id + 1
+
+    def replace_all(self, books, members, loans, holds, sequences):
+        """Replaces the whole database contents in one transaction."""
+        with self._transaction() as connection:
+            for (table, fieldnames), rows in zip(self.TABLES, (books, members, loans, holds)):
+                connection.execute(f"DELETE FROM {table}")
+                connection.executemany(
+                    f"INSERT INTO {table} ({', '.join(fieldnames)}) VALUES ({', '.join('?' * len(fieldnames))})",
+                    ([row.get(field) for field in fieldnames] for row in rows))
+            connection.execute('DELETE FROM sequences')
+            connection.executemany('INSERT INTO sequences VALUES (?, ?)', sequences.items())
+
+
+def open_repository(backend=None, data_dir=DATA_DIR):
+    """Opens the configured storage backend ('csv' or 'sqlite') on a data directory."""
+    backend = backend or STORAGE_BACKEND
+    if backend == 'csv':
+        return CsvRepository(data_dir)
+    if backend == 'sqlite':
+        return SqliteRepository(os.path.join(data_dir, os.path.basename(SQLITE_FILE)))
+    raise ValueError(f"Unknown storage backend '{backend}' (expected 'csv' or 'sqlite').")
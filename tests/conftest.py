@@ -0,0 +1,28 @@
+"""Fixtures shared by the tests: a small library in a temporary data directory."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The repository root
+
+from modules.library_store import LibraryStore # noqa: E402
+from modules.storage import open_repository # noqa: E402
+
+BOOKS = [
+    {'id': '1', 'title': 'Java', 'author': 'Deitel', 'isbn': '9780133807806', 'quantity': '2', 'available': '2'},
+    {'id': '2', 'title': 'Python Crash Course', 'author': 'Matthes', 'isbn': '9781593279288',
+     'quantity': '1', 'available': '1'},
+    {'id': '3', 'title': 'Clean Code', 'author': 'Martin', 'isbn': '9780132350884', 'quantity': '3', 'available': '3'},
+]
+MEMBERS = [{'id': str(number), 'name': f"Member {number}", 'contact': ''} for number in range(1, 4)]
+
+
+@pytest.fixture
+def library(tmp_path):
+    """Path of a data directory holding BOOKS and MEMBERS (CSV backend)."""
+    data_dir = str(tmp_path / 'data')
+    store = LibraryStore(open_repository('csv', data_dir))
+    store.add_books(BOOKS)
+    store.add_members(MEMBERS)
+    return data_dir
@@ -0,0 +1,77 @@
+"""Circulation analytics: rollups per day, week and month, and the month files they are saved to."""
+import datetime
+import json
+import os
+
+from modules.analytics import Circulation
+
+DAY = datetime.date
+
+
+def borrow(loan_id, book_id, member_id, on):
+    return {'op': 'borrow', 'on': on, 'loan_id': loan_id, 'member_id': member_id, 'book_id': book_id}
+
+def give_back(loan_id, book_id, member_id, on, borrowed_on):
+    return {'op': 'return', 'on': on, 'loan_id': loan_id, 'member_id': member_id, 'book_id': book_id,
+            'borrowed_on': borrowed_on}
+
+def open_circulation(tmp_path):
+    return Circulation(str(tmp_path / 'circulation.log'), str(tmp_path / 'circulation.json'))
+
+def month_files(tmp_path):
+    return sorted(os.listdir(tmp_path / 'circulation'))
+
+EVENTS = [ # ISO week 22 of 2024 runs from Monday 27 May to Sunday 2 June
+    borrow('1', 'b1', 'm1', '2024-05-30'),
+    borrow('2', 'b1', 'm2', '2024-05-31'),
+    borrow('3', 'b2', 'm1', '2024-05-31'),
+    give_back('1', 'b1', 'm1', '2024-06-03', '2024-05-30'),
+]
+
+
+def test_events_are_rolled_up_per_day_week_and_month(tmp_path):
+    circulation = open_circulation(tmp_path)
+    circulation.record(EVENTS)
+    assert circulation.totals('day', DAY(2024, 5, 31)) == (2, 0)
+    assert circulation.totals('month', DAY(2024, 5, 1)) == (3, 0)
+    assert circulation.totals('month', DAY(2024, 6, 1)) == (0, 1)
+    assert circulation.totals('week', DAY(2024, 6, 2)) == (3, 0) # Both months' parts of the week
+    assert circulation.totals('week', DAY(2024, 6, 3)) == (0, 1)
+    assert circulation.top_books('month', DAY(2024, 5, 1)) == [('b1', 2), ('b2', 1)]
+    assert circulation.top_members() == [('m1', 2), ('m2', 1)]
+    assert circulation.member_activity('m1') == {'member_id': 'm1', 'borrows': 2, 'returns': 1,
+                                                 'last_active': '2024-06-03'}
+
+def test_utilization_splits_loans_across_months(tmp_path):
+    circulation = open_circulation(tmp_path)
+    circulation.record(EVENTS)
+    may = circulation.utilization(DAY(2024, 5, 1), DAY(2024, 6, 10), lambda book_id: 1)
+    may = {book_id: days for book_id, days, _ in may}
+    assert may == {'b1': 2 + 1, 'b2': 1} # Loan 1's 30 and 31 May, loan 2 and loan 3 still open on the 31st
+    june = circulation.utilization(DAY(2024, 6, 1), DAY(2024, 6, 10), lambda book_id: 2)
+    assert [(book_id, days) for book_id, days, _ in june] == [('b1', 2 + 9), ('b2', 9)]
+    assert june[0][2] == 11 / (2 * 9)
+
+def test_a_save_writes_a_file_per_month_and_a_start_reads_it_back(tmp_path):
+    circulation = open_circulation(tmp_path)
+    circulation.record(EVENTS)
+    assert circulation.save(force=True)
+    assert [name.split('.')[0] for name in month_files(tmp_path)] == ['2024-05', '2024-06']
+    with open(tmp_path / 'circulation.json', encoding='utf-8') as file:
+        assert json.load(file)['offset'] == os.path.getsize(tmp_path / 'circulation.log')
+
+    reopened = open_circulation(tmp_path)
+    assert reopened.totals('week', DAY(2024, 6, 2)) == (3, 0)
+    assert reopened.top_members() == [('m1', 2), ('m2', 1)]
+
+    may_file = month_files(tmp_path)[0]
+    reopened.record([borrow('4', 'b2', 'm2', '2024-06-05')])
+    assert reopened.save(force=True)
+    assert month_files(tmp_path)[0] == may_file # May's buckets did not change...
+    assert len(month_files(tmp_path)) == 2 # ...and June's old file is gone
+    assert open_circulation(tmp_path).totals('month', DAY(2024, 6, 1)) == (1, 1)
+
+def test_an_unsaved_log_is_replayed_from_the_start(tmp_path):
+    open_circulation(tmp_path).record(EVENTS)
+    assert not open_circulation(tmp_path).save() # Too few events for an unforced save
+    assert open_circulation(tmp_path).totals('month', DAY(2024, 5, 1)) == (3, 0)
@@ -0,0 +1,63 @@
+"""Batch borrows and returns: one bad item and nothing in the batch is written."""
+import os
+
+import pytest
+
+import modules.library_api as library_api
+from modules.library_api import NotFoundError
+from modules.library_store import LibraryStore, LibraryError, OutOfStockError
+from modules.storage import open_repository
+from utils import read_journal
+
+
+def open_store(data_dir):
+    return LibraryStore(open_repository('csv', data_dir))
+
+def state(store):
+    """The open loans and each book's available count."""
+    return sorted(loan['loan_id'] for loan in store.loans()), {book['id']: book['available'] for book in store.books()}
+
+def journal_entries(data_dir):
+    return read_journal(os.path.join(data_dir, 'loans.journal'))[0]
+
+
+def test_one_bad_book_and_the_whole_borrow_is_refused(library):
+    store = open_store(library)
+    before = state(store)
+    member = store.get_member('1')
+    with pytest.raises(LibraryError, match="'9' not found"):
+        store.borrow_many(member, [store.get_book('1'), {'id': '9'}, store.get_book('3')])
+    with pytest.raises(OutOfStockError):
+        store.borrow_many(member, [store.get_book('1'), store.get_book('2'), store.get_book('2')]) # One copy of 2
+    assert state(store) == before
+    assert state(open_store(library)) == before
+    assert journal_entries(library) == []
+
+def test_one_bad_loan_and_the_whole_return_is_refused(library):
+    store = open_store(library)
+    loans = store.borrow_many(store.get_member('1'), [store.get_book('1'), store.get_book('3')])
+    store.return_loan(loans[0])
+    before = state(store)
+    with pytest.raises(LibraryError, match='already been returned'):
+        store.return_many([loans[1], loans[0]])
+    assert state(store) == before
+    assert state(open_store(library)) == before
+    assert len(journal_entries(library)) == 2 # The batch borrow and the single return only
+
+def test_a_good_batch_is_one_entry(library):
+    store = open_store(library)
+    store.borrow_many(store.get_member('1'), [store.get_book('1'), store.get_book('1'), store.get_book('3')])
+    assert [entry['op'] for entry in journal_entries(library)] == ['batch']
+    assert state(open_store(library))[1] == {'1': 0, '2': 1, '3': 2}
+
+def test_the_api_resolves_every_item_before_writing(library, monkeypatch):
+    store = open_store(library)
+    monkeypatch.setattr(library_api, 'get_store', lambda: store)
+    before = state(store)
+    with pytest.raises(NotFoundError):
+        library_api.borrow_books('1', ['1', '978-0-13-235088-4', 'no such book'])
+    with pytest.raises(NotFoundError):
+        library_api.return_books('1', ['1'])
+    assert state(store) == before
+    lent = library_api.borrow_books('1', ['1', '978-0-13-235088-4'])
+    assert [loan['book_id'] for loan in lent['loans']] == ['1', '3']
@@ -0,0 +1,60 @@
+"""Bulk imports: loose headers, padding rows, and ISBNs checked against storage at commit time."""
+import csv
+
+import pytest
+
+import modules.bulk_import as bulk_import
+from modules.library_store import LibraryStore
+from modules.storage import open_repository
+
+
+@pytest.fixture
+def store(library, monkeypatch):
+    store = LibraryStore(open_repository('csv', library))
+    monkeypatch.setattr(bulk_import, 'get_store', lambda: store)
+    return store
+
+def write_feed(tmp_path, text):
+    feed_path = tmp_path / 'feed.csv'
+    feed_path.write_text(text, encoding='utf-8')
+    return str(feed_path)
+
+def rejects(feed_path):
+    with open(feed_path.replace('.csv', '.rejects.csv'), newline='', encoding='utf-8') as file:
+        return [(row['line'], row['reason']) for row in csv.DictReader(file)]
+
+
+def test_spaces_in_the_header_and_empty_rows_are_ignored(store, tmp_path):
+    feed = write_feed(tmp_path, "title, author, isbn, quantity\n"
+                                "Dune, Herbert, 9780441013593, 2\n"
+                                ",,,\n"
+                                "Emma, Austen, , 1\n"
+                                ",,,\n")
+    assert bulk_import.import_file('books', feed) == (2, 0)
+    assert [(book['title'], book['author'], book['available']) for book in store.books()[3:]] == [
+        ('Dune', 'Herbert', 2), ('Emma', 'Austen', 1)]
+
+def test_isbns_already_stored_or_repeated_are_rejected(store, tmp_path):
+    feed = write_feed(tmp_path, "title,author,isbn,quantity\n"
+                                "Clean Code again,Martin,978-0-13-235088-4,1\n"
+                                "Dune,Herbert,9780441013593,2\n"
+                                "Dune twice,Herbert,978-0441013593,1\n"
+                                ",Nobody,,1\n")
+    assert bulk_import.import_file('books', feed) == (1, 3)
+    assert rejects(feed) == [('2', "ISBN 978-0-13-235088-4 already in catalogue"),
+                             ('4', "duplicate ISBN 978-0441013593 in feed"), ('5', "missing title")]
+
+def test_a_book_stored_elsewhere_during_the_import_is_not_added_twice(store, library, tmp_path, monkeypatch):
+    other = LibraryStore(open_repository('csv', library)) # Another terminal importing the same book
+    validate, stored, commit = bulk_import._IMPORTERS['books']
+
+    def validate_while_the_other_adds(row, seen):
+        if not other.get_book_by_isbn('9780441013593'):
+            other.add_books([{'id': str(other.reserve_ids('books')), 'title': 'Dune', 'author': 'Herbert',
+                              'isbn': '9780441013593', 'quantity': '1', 'available': '1'}])
+        return validate(row, seen)
+
+    monkeypatch.setitem(bulk_import._IMPORTERS, 'books', (validate_while_the_other_adds, stored, commit))
+    feed = write_feed(tmp_path, "title,author,isbn,quantity\nDune,Herbert,9780441013593,2\n")
+    assert bulk_import.import_file('books', feed) == (0, 1)
+    assert [book['title'] for book in store.books()].count('Dune') == 1
@@ -0,0 +1,34 @@
+"""Borrows and returns from several processes at once leave consistent data and totals."""
+import multiprocessing
+
+import pytest
+
+from benchmarks.stress_checkout import _seed, _worker, check_invariants
+from modules.library_store import LibraryStore
+from modules.storage import open_repository
+
+WORKERS = 8
+OPS = 100 # Per worker; few books keep the workers contending
+
+
+@pytest.mark.parametrize('backend', ['csv', 'sqlite'])
+def test_totals_agree_after_concurrent_writes(tmp_path, backend):
+    data_dir = str(tmp_path)
+    _seed(backend, data_dir, books=3, members=10, copies=2)
+    watcher = LibraryStore(open_repository(backend, data_dir)) # Loaded before, follows the changes after
+    watcher.books()
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_worker, args=(backend, data_dir, OPS, seed, results))
+                 for seed in range(WORKERS)]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join()
+    borrowed = [loan_id for outcome in outcomes for loan_id in outcome[0]]
+    returned = [loan_id for outcome in outcomes for loan_id in outcome[1]]
+
+    assert borrowed and returned
+    assert check_invariants(LibraryStore(open_repository(backend, data_dir)), borrowed, returned) == []
+    assert check_invariants(watcher, borrowed, returned) == []
@@ -0,0 +1,68 @@
+"""Hold queues: their order, copies set aside on return, pickup expiry, and replay on start."""
+import datetime
+
+import pytest
+
+import modules.library_store as library_store
+from modules.library_store import LibraryStore, OutOfStockError
+from modules.storage import open_repository
+
+
+def open_store(data_dir):
+    return LibraryStore(open_repository('csv', data_dir))
+
+def queue(store, book_id):
+    """Member ids holding the book, as (member id, queue position), next in line first."""
+    holds = [hold for member_id in ('1', '2', '3', '4') for hold, _, _ in store.holds_for_member(member_id)]
+    return sorted((hold.member_id, store.hold_position(hold)[0]) for hold in holds if hold.book_id == book_id)
+
+def out_and_queued(store):
+    """Lends book 2's only copy to member 1; members 2, 3 and 4 queue for it, 3 with priority."""
+    store.add_member({'id': '4', 'name': 'Member 4', 'contact': ''})
+    loan = store.borrow(store.get_member('1'), store.get_book('2'))
+    book = store.get_book('2')
+    store.place_hold(store.get_member('2'), book)
+    store.place_hold(store.get_member('3'), book, priority=1)
+    store.place_hold(store.get_member('4'), book)
+    return loan
+
+
+def test_the_queue_goes_by_priority_then_first_come(library):
+    store = open_store(library)
+    out_and_queued(store)
+    assert queue(store, '2') == [('2', 2), ('3', 1), ('4', 3)]
+
+def test_a_returned_copy_is_set_aside_for_the_next_in_line(library):
+    store = open_store(library)
+    loan = out_and_queued(store)
+    ready = store.return_loan(loan)
+    assert [(hold.member_id, hold.status) for hold in ready] == [('3', 'ready')]
+    assert store.held_copies('2') == 1
+    with pytest.raises(OutOfStockError):
+        store.borrow(store.get_member('2'), store.get_book('2'))
+    store.borrow(store.get_member('3'), store.get_book('2')) # Fulfils the hold
+    assert queue(store, '2') == [('2', 1), ('4', 2)]
+    assert store.held_copies('2') == 0
+
+def test_an_expired_hold_releases_its_copy_to_the_next_in_line(library, monkeypatch):
+    monkeypatch.setattr(library_store, 'HOLD_PICKUP_PERIOD', datetime.timedelta(days=-1)) # Ready holds are overdue at once
+    store = open_store(library)
+    store.return_loan(out_and_queued(store))
+    expired = store.expire_holds()
+    assert [hold.member_id for hold in expired] == ['3']
+    assert queue(store, '2') == [('2', 0), ('4', 1)] # Member 2 now has the copy set aside
+    store.expire_holds()
+    store.expire_holds()
+    assert queue(store, '2') == []
+    assert store.held_copies('2') == 0
+    store.borrow(store.get_member('1'), store.get_book('2')) # Back on the shelf for anyone
+
+def test_holds_are_replayed_after_reopening(library):
+    store = open_store(library)
+    store.return_loan(out_and_queued(store))
+    before = queue(store, '2')
+    assert queue(open_store(library), '2') == before
+    store.compact()
+    reopened = open_store(library)
+    assert queue(reopened, '2') == before
+    assert reopened.held_copies('2') == 1
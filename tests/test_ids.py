@@ -0,0 +1,46 @@
+"""Id sequences: an id is handed out once, whichever process asks for it."""
+import multiprocessing
+
+import pytest
+
+from modules.library_store import LibraryStore
+from modules.storage import open_repository
+
+WORKERS = 6
+RESERVATIONS = 40 # Per worker, of one to three ids each
+
+
+def reserve(backend, data_dir, seed, results):
+    store = LibraryStore(open_repository(backend, data_dir))
+    ids = []
+    for number in range(RESERVATIONS):
+        count = (seed + number) % 3 + 1
+        first = store.reserve_ids('books', count)
+        ids.extend(range(first, first + count))
+    results.put(ids)
+
+
+@pytest.mark.parametrize('backend', ['csv', 'sqlite'])
+def test_processes_reserving_at_once_never_share_an_id(tmp_path, backend):
+    data_dir = str(tmp_path)
+    store = LibraryStore(open_repository(backend, data_dir))
+    store.add_books([{'id': '7', 'title': 'Seed', 'author': '', 'isbn': '', 'quantity': '1', 'available': '1'}])
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=reserve, args=(backend, data_dir, seed, results))
+                 for seed in range(WORKERS)]
+    for process in processes:
+        process.start()
+    ids = [book_id for _ in processes for book_id in results.get(timeout=120)]
+    for process in processes:
+        process.join()
+
+    assert len(ids) == len(set(ids))
+    assert sorted(ids) == list(range(8, 8 + len(ids))) # After the highest id in use, with no gaps
+    assert store.reserve_ids('books') == 8 + len(ids)
+
+def test_ids_are_not_reused_after_a_reload(library):
+    store = LibraryStore(open_repository('csv', library))
+    first = store.reserve_ids('members', 2)
+    assert first == 4 # conftest's members are 1 to 3
+    assert LibraryStore(open_repository('csv', library)).reserve_ids('members') == first + 2
@@ -0,0 +1,111 @@
+"""The CSV backend's loans journal: replay on start, and compaction into the CSV files."""
+import os
+
+import modules.storage as storage
+from modules.library_store import LibraryStore
+from modules.storage import open_repository
+from utils import read_journal, read_rows, LOAN_FIELDNAMES
+
+
+def open_store(data_dir):
+    """Opens a store as another process would: nothing shared with the others."""
+    return LibraryStore(open_repository('csv', data_dir))
+
+def state(store):
+    """The open loans, each book's available count and the open holds, for comparing stores."""
+    return ({loan['loan_id']: (loan['member_id'], loan['book_id']) for loan in store.loans()},
+            {book['id']: book['available'] for book in store.books()},
+            sorted((hold['hold_id'], hold['status']) for hold in store.export_rows()[3]))
+
+def journal(data_dir):
+    return os.path.join(data_dir, 'loans.journal')
+
+def circulate(store):
+    """Borrows and returns a few books, a batch and a hold included."""
+    member, other = store.get_member('1'), store.get_member('2')
+    loans = store.borrow_many(member, [store.get_book('1'), store.get_book('2')])
+    store.place_hold(other, store.get_book('2'))
+    store.return_loan(loans[1])
+    store.borrow(other, store.get_book('3'))
+
+
+def test_a_new_store_replays_the_journal(library):
+    store = open_store(library)
+    circulate(store)
+    entries, _ = read_journal(journal(library))
+    assert [entry['op'] for entry in entries] == ['batch', 'hold_place', 'batch', 'borrow']
+    replayed = open_store(library)
+    assert state(replayed) == state(store)
+    assert not replayed.totals().drift(replayed.recount_totals())
+
+def test_a_return_and_the_hold_it_fills_are_one_entry(library):
+    store = open_store(library)
+    circulate(store)
+    entries, _ = read_journal(journal(library))
+    assert [change['op'] for change in entries[2]['entries']] == ['return', 'hold_ready']
+    assert state(open_store(library))[2] == [('1', 'ready')]
+
+def test_compaction_folds_the_journal_into_the_csv_files(library):
+    store = open_store(library)
+    circulate(store)
+    before = state(store)
+    store.compact()
+    assert os.path.getsize(journal(library)) == 0
+    stored = {values[0] for values in read_rows(os.path.join(library, 'loans.csv'), LOAN_FIELDNAMES)}
+    assert stored == set(before[0])
+    assert state(open_store(library)) == before
+
+def test_a_store_follows_another_process_compacting(library):
+    watcher = open_store(library)
+    watcher.books()
+    writer = open_store(library)
+    circulate(writer)
+    writer.compact()
+    writer.return_loan(writer.loans_for_member('2')[0]) # Journaled after the compaction
+    assert state(watcher) == state(writer)
+    assert not watcher.totals().drift(watcher.recount_totals())
+
+def test_a_store_follows_a_file_replaced_with_one_of_the_same_size_and_time(library):
+    watcher = open_store(library)
+    watcher.books()
+    books_file = os.path.join(library, 'books.csv')
+    stat = os.stat(books_file)
+    with open(books_file, 'rb') as file:
+        text = file.read()
+    with open(books_file + '.new', 'wb') as file:
+        file.write(text.replace(b'Java', b'Jave'))
+    os.utime(books_file + '.new', ns=(stat.st_atime_ns, stat.st_mtime_ns)) # As on a coarse-clock filesystem
+    os.replace(books_file + '.new', books_file)
+    assert watcher.get_book('1')['title'] == 'Jave'
+
+def test_entries_replayed_over_their_own_compaction_change_nothing(library):
+    # A crash after compact() saved the CSV files but before it emptied
+    # the journal leaves entries that are already folded in.
+    store = open_store(library)
+    circulate(store)
+    with open(journal(library), 'rb') as file:
+        entries = file.read()
+    store.compact()
+    with open(journal(library), 'wb') as file:
+        file.write(entries)
+    assert state(open_store(library)) == state(store)
+
+def test_a_line_cut_off_by_a_crash_is_skipped_then_dropped(library):
+    store = open_store(library)
+    store.borrow(store.get_member('1'), store.get_book('1'))
+    with open(journal(library), 'a', encoding='utf-8') as file:
+        file.write('{"op": "borrow", "loan": {"loan_id": ') # Never finished
+    restarted = open_store(library)
+    assert len(restarted.loans()) == 1
+    restarted.borrow(restarted.get_member('2'), restarted.get_book('1'))
+    assert state(open_store(library)) == state(restarted)
+    assert len(read_journal(journal(library))[0]) == 2
+
+def test_compaction_runs_by_itself_every_compact_every_entries(library, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPACT_EVERY', 3)
+    store = open_store(library)
+    member = store.get_member('3')
+    for _ in range(2):
+        store.return_loan(store.borrow(member, store.get_book('3')))
+    assert len(read_journal(journal(library))[0]) == 1 # Compacted at the third entry
+    assert state(open_store(library)) == state(store)
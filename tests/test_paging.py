@@ -0,0 +1,45 @@
+"""Book and member pages: following next_start visits every row once, bad bounds are refused."""
+import pytest
+
+from modules.library_api import InvalidRequestError
+from modules.library_service import _int_param
+from modules.library_store import LibraryStore
+from modules.pager import _page_size, DEFAULT_PAGE_SIZE
+from modules.storage import open_repository
+
+
+def walk(page, size, **options):
+    """Every id on the pages from 0 on, following next_start."""
+    ids, start = [], 0
+    while start is not None:
+        rows, start = page(start, size, **options)
+        ids.extend(row['id'] for row in rows)
+    return ids
+
+def test_following_next_start_visits_every_row_once(library):
+    store = LibraryStore(open_repository('csv', library))
+    store.borrow(store.get_member('1'), store.get_book('2')) # Its only copy
+    assert walk(store.book_page, 2) == ['1', '2', '3']
+    assert walk(store.book_page, 1, available_only=True) == ['1', '3']
+    assert walk(store.member_page, 2) == ['1', '2', '3']
+
+@pytest.mark.parametrize('start, size', [(-5, 2), (0, 0), (0, -1)])
+def test_pages_out_of_range_are_refused(library, start, size):
+    store = LibraryStore(open_repository('csv', library))
+    for page in (store.book_page, store.member_page):
+        with pytest.raises(ValueError):
+            page(start, size)
+    with pytest.raises(ValueError):
+        store.book_page(start, size, available_only=True)
+
+def test_query_numbers_below_their_minimum_are_bad_requests():
+    assert _int_param({'size': '5'}, 'size', 20, minimum=1) == 5
+    assert _int_param({}, 'start', 0, minimum=0) == 0
+    for query in ({'size': '0'}, {'size': '-1'}, {'size': 'ten'}):
+        with pytest.raises(InvalidRequestError):
+            _int_param(query, 'size', 20, minimum=1)
+
+@pytest.mark.parametrize('setting, size', [('50', 50), (' 5 ', 5), ('0', 1), ('-3', 1),
+                                           ('', DEFAULT_PAGE_SIZE), ('twenty', DEFAULT_PAGE_SIZE)])
+def test_the_page_size_setting_is_read_leniently(setting, size):
+    assert _page_size(setting) == size
@@ -0,0 +1,84 @@
+"""utils.read_rows() against the standard csv module, on well-formed and messy files."""
+import csv
+
+import pytest
+
+import utils
+from utils import file_delimiter, read_rows, BOOK_FIELDNAMES, INT_FIELDS
+
+HEADER = 'id,title,author,isbn,quantity,available\n'
+
+FILES = {
+    'plain': HEADER + '1,Java,Deitel,111,2,1\n2,Python Crash Course,Matthes,222,1,1\n',
+    'columns reordered, extra and missing': 'available,title,id,shelf\n1,Java,1,A3\n0,Dune,2,B1\n',
+    'tabs': HEADER.replace(',', '\t') + '1\tJava, 2nd ed.\tDeitel\t111\t2\t1\n',
+    'semicolons': HEADER.replace(',', ';') + '1;Java;Deitel;111;2;1\n2;Dune;Herbert;222;3;3\n',
+    'quoted': HEADER + '1,"Java, How to Program","Deitel ""Paul""",111,2,1\n'
+                       '2,"Two\nLines",Matthes,222,1,1\n3,Plain,Author,333,1,0\n',
+    'ragged, blank and padded': HEADER + '1,Java,Deitel\n\n , , , , , \n2, Dune ,Herbert,222,3,3,extra\n',
+    'junk counts': HEADER + '1,Java,Deitel,111,two,\n2,Dune,Herbert,222, 3 ,-1\n',
+    'crlf': (HEADER + '1,Java,Deitel,111,2,1\n2,Dune,Herbert,222,3,3\n').replace('\n', '\r\n'),
+    'no final newline': HEADER + '1,Java,Deitel,111,2,1\n2,Dune,Herbert,222,3,3',
+    'unicode': HEADER + '1,Café Society,Zoë Ångström,111,2,1\n2,東京,著者,222,1,1\n',
+    'header only': HEADER,
+    'empty': '',
+}
+DELIMITERS = {'tabs': '\t', 'semicolons': ';'} # Others use commas
+
+
+def expected_rows(file_path, fieldnames, delimiter=','):
+    """The rows as csv.reader reads them, typed and filtered as read_rows() promises."""
+    with open(file_path, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file.read().splitlines(keepends=True), delimiter=delimiter)
+    header = [name.strip() for name in next(reader, [])]
+    rows = []
+    for parts in reader:
+        row = dict(zip(header, parts))
+        values = [row.get(field, '').strip() for field in fieldnames]
+        if not any(values):
+            continue
+        rows.append(tuple(_count(value) if field in INT_FIELDS else value
+                          for field, value in zip(fieldnames, values)))
+    return rows
+
+def _count(value):
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+def write(tmp_path, text):
+    file_path = tmp_path / 'books.csv'
+    file_path.write_bytes(text.encode('utf-8'))
+    return str(file_path)
+
+
+@pytest.mark.parametrize('name', FILES)
+def test_read_rows_matches_the_csv_module(tmp_path, name):
+    file_path = write(tmp_path, FILES[name])
+    expected = expected_rows(file_path, BOOK_FIELDNAMES, DELIMITERS.get(name, ','))
+    assert list(read_rows(file_path, BOOK_FIELDNAMES)) == expected
+
+@pytest.mark.parametrize('name', FILES)
+def test_the_delimiter_is_detected(tmp_path, name):
+    assert file_delimiter(write(tmp_path, FILES[name])) == DELIMITERS.get(name, ',')
+
+@pytest.mark.parametrize('name', ['plain', 'quoted', 'ragged, blank and padded', 'crlf', 'unicode'])
+def test_rows_split_across_read_blocks(tmp_path, monkeypatch, name):
+    monkeypatch.setattr(utils, 'READ_BLOCK_BYTES', 7) # Every block boundary falls inside a row
+    header, _, body = FILES[name].partition('\n')
+    file_path = write(tmp_path, header + '\n' + body * 40)
+    assert list(read_rows(file_path, BOOK_FIELDNAMES)) == expected_rows(file_path, BOOK_FIELDNAMES)
+
+def test_a_quote_far_into_a_large_file(tmp_path):
+    # The fast path runs up to the first quote, the csv module after it.
+    lines = [f"{number},Title {number},Author {number % 97},{number:013d},{number % 5},{number % 3}\n"
+             for number in range(1, 20000)]
+    lines[15000] = '15001,"Quoted, with a comma",Author,111,1,1\n'
+    file_path = write(tmp_path, HEADER + ''.join(lines))
+    rows = list(read_rows(file_path, BOOK_FIELDNAMES))
+    assert rows == expected_rows(file_path, BOOK_FIELDNAMES)
+    assert len(rows) == 19999
+
+def test_missing_file_reads_as_no_rows(tmp_path):
+    assert list(read_rows(str(tmp_path / 'missing.csv'), BOOK_FIELDNAMES)) == []
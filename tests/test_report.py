@@ -0,0 +1,28 @@
+"""The memoized library report: what is cached under a data version is that version's data."""
+import datetime
+
+import modules.library_api as library_api
+from modules.library_store import LibraryStore
+from modules.storage import open_repository
+
+
+def test_a_write_after_the_version_read_stays_out_of_that_report(library, monkeypatch):
+    store = LibraryStore(open_repository('csv', library))
+    other = LibraryStore(open_repository('csv', library)) # Another terminal on the same data
+    monkeypatch.setattr(library_api, 'get_store', lambda: store)
+    read_version = store.data_version
+
+    def version_then_write():
+        version = read_version()
+        other.borrow(other.get_member('1'), other.get_book('2'))
+        return version
+
+    today = datetime.date.today()
+    monkeypatch.setattr(store, 'data_version', version_then_write)
+    first = library_api.library_report(today)
+    monkeypatch.setattr(store, 'data_version', read_version)
+    assert first['totals']['total_borrowed'] == 0
+    assert first['totals']['available_titles'] == 3
+    assert library_api.library_report(today) != first # The borrow shows under its own version
+    assert library_api.library_report(today)['totals']['total_borrowed'] == 1
+    assert library_api.library_report(today)['totals']['available_titles'] == 2
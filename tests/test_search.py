@@ -0,0 +1,88 @@
+"""Book search: AND over terms, ranking, the misspelling fallback, and the saved index."""
+import os
+
+import modules.library_store as library_store
+from modules.library_store import LibraryStore
+from modules.search_index import SearchIndex, query_terms
+from modules.storage import open_repository
+
+ROWS = [
+    ('1', 'Pythonic Patterns', 'Slatkin', '9780134853987'),
+    ('2', 'Python', 'Lutz', '9781449355739'),
+    ('3', 'Learning Java', 'Python Press', ''),
+    ('4', 'Python Cookbook', 'Beazley', '978-1-4493-4037-7'),
+]
+
+
+def open_store(data_dir):
+    store = LibraryStore(open_repository('csv', data_dir))
+    store.refresh() # Loaded, as before a first search
+    return store
+
+def titles(books):
+    return [book['title'] for book in books]
+
+
+def test_every_term_must_match():
+    index = SearchIndex(ROWS)
+    assert index.search('python cookbook') == ['4']
+    assert index.search('cook beaz') == ['4'] # Prefixes count for every term
+    assert index.search('java slatkin') == []
+
+def test_exact_words_rank_above_prefixes_and_titles_above_authors():
+    ranked = SearchIndex(ROWS).search('python')
+    assert set(ranked[:2]) == {'2', '4'} # The word itself, in a title (3 x 2)
+    assert ranked[2:] == ['3', '1'] # In an author (2 x 2) beats a title prefix (3 x 1)
+    assert SearchIndex(ROWS).search('python', limit=3) == ranked[:3]
+
+def test_misspellings_are_only_tried_when_nothing_else_matches():
+    index = SearchIndex(ROWS)
+    assert set(index.search('pyton')) == {'1', '2', '3', '4'} # 'pythonic' is close enough too
+    assert index.search('pyton', fuzzy=False) == []
+    assert index.search('pyt') == index.search('pyt', fuzzy=False) # A prefix match wins outright
+    assert index.search('zzzzzz') == []
+
+def test_hyphenated_isbns_are_one_term():
+    assert query_terms('978-1-4493-4037-7 Python') == ['9781449340377', 'python']
+    assert query_terms('X-Men 0-13') == ['x', 'men', '013']
+    index = SearchIndex(ROWS)
+    assert index.search('978-1-4493-4037-7') == ['4']
+    assert index.search('9781449340377 cookbook') == ['4']
+    assert set(index.search('978')) == {'1', '2', '4'}
+
+def test_the_store_finds_misspelt_titles(library):
+    assert titles(open_store(library).search_books('pyton')) == ['Python Crash Course']
+
+
+def test_the_saved_index_is_loaded_after_compaction(library):
+    open_store(library).compact(snapshot=True)
+    assert os.path.exists(os.path.join(library, 'search_index.snap'))
+    store = open_store(library)
+    assert store._saved_search_index() is not None
+    store.add_books([{'id': '4', 'title': 'Fluent Python', 'author': 'Ramalho', 'isbn': '9781492056355',
+                      'quantity': '1', 'available': '1'}])
+    reopened = open_store(library)
+    assert titles(reopened.search_books('python')) == ['Python Crash Course', 'Fluent Python']
+    assert reopened._saved_search_index().search('ramalho') == ['4'] # Caught up with the book added since
+
+def test_a_saved_index_of_another_version_is_rebuilt(library, monkeypatch):
+    open_store(library).compact(snapshot=True)
+    monkeypatch.setattr(library_store, 'SEARCH_INDEX_VERSION', library_store.SEARCH_INDEX_VERSION + 1)
+    store = open_store(library)
+    assert store._saved_search_index() is None
+    assert titles(store.search_books('clean')) == ['Clean Code']
+
+def test_a_saved_index_of_edited_books_is_rebuilt(library):
+    open_store(library).compact(snapshot=True)
+    books_file = os.path.join(library, 'books.csv')
+    with open(books_file, encoding='utf-8') as file:
+        text = file.read()
+    with open(books_file, 'w', encoding='utf-8') as file:
+        file.write(text) # Same books, new signature: the digest still matches
+    assert open_store(library)._saved_search_index() is not None
+    with open(books_file, 'w', encoding='utf-8') as file:
+        file.write(text.replace('Clean Code', 'Dirty Code'))
+    store = open_store(library)
+    assert store._saved_search_index() is None
+    assert titles(store.search_books('dirty')) == ['Dirty Code']
+    assert store.search_books('clean') == []
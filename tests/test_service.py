@@ -0,0 +1,56 @@
+"""The HTTP service's background work: it keeps going through storage errors."""
+import asyncio
+
+import modules.library_service as library_service
+from modules.library_store import LibraryError
+
+
+class FlakyStore:
+    """Fails its first refreshes the way a busy or unreadable data directory does."""
+
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.refreshes = 0
+        self.expiries = 0
+
+    def refresh(self):
+        self.refreshes += 1
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def expire_holds(self):
+        self.expiries += 1
+
+
+def test_the_refresh_loop_survives_storage_errors(monkeypatch, capsys):
+    monkeypatch.setattr(library_service, 'REFRESH_INTERVAL', 0)
+    monkeypatch.setattr(library_service, 'HOLD_SWEEP_INTERVAL', 0)
+    monkeypatch.setattr(library_service.api, 'precompute_reports', lambda: None)
+    store = FlakyStore([OSError("disk went away"), LibraryError("The library data is busy; please try again.")])
+    monkeypatch.setattr(library_service, 'get_store', lambda: store)
+    service = library_service.LibraryService()
+
+    async def run():
+        service._lock = library_service.ReadWriteLock()
+        task = asyncio.create_task(service._refresh_loop())
+        while store.expiries < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    service._executor.shutdown()
+    assert store.refreshes >= 4
+    assert 'disk went away' in capsys.readouterr().err
+
+def test_branch_queries_do_not_wait_for_the_store_lock(monkeypatch):
+    monkeypatch.setattr(library_service.branches, 'search_books', lambda query, limit: {'books': [], 'errors': {}})
+    monkeypatch.setattr(library_service, 'get_store', lambda: FlakyStore([]))
+    service = library_service.LibraryService()
+
+    async def run():
+        service._lock = library_service.ReadWriteLock()
+        async with service._lock.writing(): # A long write: local reads would queue behind it
+            return await asyncio.wait_for(service._respond('GET', '/branches/search?q=dune', b''), 5)
+
+    assert asyncio.run(run())[1] == {'books': [], 'errors': {}}
+    service._executor.shutdown()
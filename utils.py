@@ -1,45 +1,395 @@
+import contextlib
 import csv
+import datetime
+import io
+import itertools
+import json
+import operator
 import os
+import re
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
 
 DATA_DIR = 'data'
 BOOKS_FILE = os.path.join(DATA_DIR, 'books.csv')
-MEMBERS_FILE = os.path.join(DATA_DIR, 'members.csv')
+MEMBERS_FILE = os.path.join(DATA_DIR, 'member.csv')
+LEGACY_MEMBERS_FILE = os.path.join(DATA_DIR, 'members.csv') # Used by earlier versions
+LOANS_FILE = os.path.join(DATA_DIR, 'loans.csv')
+LOANS_JOURNAL_FILE = os.path.join(DATA_DIR, 'loans.journal')
+SEQUENCES_FILE = os.path.join(DATA_DIR, 'sequences.json')
+SQLITE_FILE = os.path.join(DATA_DIR, 'library.db')
+SNAPSHOT_FILE = os.path.join(DATA_DIR, 'library.snap') # Binary copy of the CSV tables, see modules/snapshot.py
+METRICS_FILE = os.path.join(DATA_DIR, 'metrics.log') # Timings and I/O per operation, see modules/instrumentation.py
+CIRCULATION_LOG_FILE = os.path.join(DATA_DIR, 'circulation.log') # Every borrow and return, see modules/analytics.py
+CIRCULATION_ROLLUP_FILE = os.path.join(DATA_DIR, 'circulation.json') # Analytics counters saved from that log
+HOLDS_FILE = os.path.join(DATA_DIR, 'holds.csv') # Open holds, see modules/holds.py
+SEARCH_INDEX_FILE = os.path.join(DATA_DIR, 'search_index.snap') # Saved search index, see LibraryStore.compact()
+
+STORAGE_BACKEND = os.environ.get('LIBRARY_BACKEND', 'csv') # 'csv' or 'sqlite'
+LIBRARY_BRANCHES = os.environ.get('LIBRARY_BRANCHES', '') # 'name=data_dir,...'; see branches()
+LOCAL_BRANCH = 'local' # Name of this directory's data when no branches are configured
+
+# Files whose signatures tell whether a branch's books, members, loans or holds changed
+SHARD_FILES = [BOOKS_FILE, MEMBERS_FILE, LEGACY_MEMBERS_FILE, LOANS_FILE, LOANS_JOURNAL_FILE,
+               HOLDS_FILE, SQLITE_FILE, SQLITE_FILE + '-wal']
+
+BOOK_FIELDNAMES = ['id', 'title', 'author', 'isbn', 'quantity', 'available']
+MEMBER_FIELDNAMES = ['id', 'name', 'contact']
+LOAN_FIELDNAMES = ['loan_id', 'member_id', 'book_id', 'borrowed_on', 'due_on']
+HOLD_FIELDNAMES = ['hold_id', 'member_id', 'book_id', 'priority', 'placed_on', 'status', 'expires_on']
+INT_FIELDS = {'quantity', 'available'} # Parsed to int by read_rows()
+
+LOAN_PERIOD = datetime.timedelta(days=14) # How long a book may be kept
+HOLD_PICKUP_PERIOD = datetime.timedelta(days=7) # How long a copy set aside for a hold waits for pickup
+COMPACT_EVERY = 500 # Journal entries between automatic compactions
 
-def ensure_data_dir_exists():
+def ensure_data_dir_exists(data_dir=DATA_DIR):
     """Ensures the data directory exists."""
-    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
+
+def _ensure_parent_dir(file_path):
+    ensure_data_dir_exists(os.path.dirname(file_path) or '.')
+
+SNIFF_BYTES = 64 * 1024 # Start of a file looked at to detect its delimiter
+READ_BLOCK_BYTES = 256 * 1024 # Chunk size read_rows() converts at a time
+_SMALL_INTS = {str(number): number for number in range(10000)} # A dict lookup beats int() on counts
+_delimiters = {} # file path -> delimiter sniffed from it
+
+def file_delimiter(file_path):
+    """Returns the delimiter of a CSV file (comma, tab, ...), sniffed once and cached."""
+    delimiter = _delimiters.get(file_path)
+    if delimiter:
+        return delimiter
+    if not os.path.exists(file_path) or os.stat(file_path).st_size == 0:
+        return ',' # Also what new files are written with
+    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
+        sample = file.read(SNIFF_BYTES)
+    if len(sample) == SNIFF_BYTES and '\n' in sample:
+        sample = sample[:sample.rindex('\n')] # Whole lines only
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=',\t;|').delimiter
+    except csv.Error:
+        delimiter = ',' # Too little to go on
+    _delimiters[file_path] = delimiter
+    return delimiter
 
 def load_data(file_path):
-    """Loads data from a CSV file."""
-    ensure_data_dir_exists()
+    """Loads data from a CSV file as one dict per row, skipping blank rows and stripping values."""
+    _ensure_parent_dir(file_path)
     if not os.path.exists(file_path) or os.stat(file_path).st_size == 0:
         return []
     with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        return list(reader)
+        reader = csv.DictReader(file, delimiter=file_delimiter(file_path))
+        rows = []
+        for row in reader:
+            row = {name.strip(): (value or '').strip()
+                   for name, value in row.items() if name and name.strip()} # Drop padding columns
+            if any(row.values()):
+                rows.append(row)
+        return rows
+
+def read_header(file_path):
+    """Returns the stripped column names of a CSV file ([] if missing or empty)."""
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
+        header = next(csv.reader([file.readline()], delimiter=file_delimiter(file_path)), [])
+    return [name.strip() for name in header]
+
+def read_rows(file_path, fieldnames):
+    """Yields the rows of a CSV table as tuples of the given fields, INT_FIELDS as ints (0 if blank or junk)."""
+    # Fields are matched to the header by name; missing ones read as ''.
+    # Blocks without quotes whose lines all have the same number of fields
+    # are converted column by column in C, several times faster than
+    # csv.DictReader. Ragged blocks go row by row, and from the first
+    # quote on the csv module parses the rest (quoted fields may hold
+    # delimiters or newlines).
+    if not os.path.exists(file_path) or os.stat(file_path).st_size == 0:
+        return iter(())
+    delimiter = file_delimiter(file_path)
+    header = read_header(file_path)
+    file = open(file_path, mode='r', newline='', encoding='utf-8')
+    newline = '\r\n' if file.readline().endswith('\r\n') else '\n' # As the header line ends
+    row_end = delimiter + '\n' + delimiter # Stands in for newline in block_rows()
+    positions = {}
+    for position, name in enumerate(header):
+        positions.setdefault(name, position)
+    indexes = [positions.get(field, 0) for field in fieldnames]
+    missing = [i for i, field in enumerate(fieldnames) if field not in positions]
+    ints = [i for i, field in enumerate(fieldnames) if field in INT_FIELDS]
+    stored_ints = [i for i in ints if i not in missing] # Missing ones read as 0
+    width = max(indexes) + 1
+    pick = operator.itemgetter(*indexes)
+    strip = str.strip
+
+    def typed(parts):
+        """Turns one split line into the output tuple, or None for a blank row."""
+        if len(parts) < width:
+            parts = parts + [''] * (width - len(parts))
+        values = list(map(strip, pick(parts)))
+        for i in missing:
+            values[i] = ''
+        if not any(values):
+            return None
+        for i in ints:
+            try:
+                values[i] = int(values[i])
+            except ValueError:
+                values[i] = 0
+        return tuple(values)
+
+    def block_rows(text):
+        """Converts a block of whole lines without quotes."""
+        # Split the whole block at once into a flat list of fields, with a
+        # '\n' field after each row, and slice out the columns: no per-row
+        # Python code or lists. If every row_width-th field is a row end,
+        # every line had the same number of fields.
+        row_count = text.count('\n')
+        fields = text.replace(newline, row_end).split(delimiter)
+        fields.pop() # After the last row end
+        row_width = len(fields) // row_count if row_count else 0
+        if row_width > width and fields[row_width - 1::row_width].count('\n') == row_count:
+            columns = [fields[position::row_width] if i in ints else list(map(strip, fields[position::row_width]))
+                       for i, position in enumerate(indexes)] # int() skips spaces by itself
+            if '' not in columns[0]: # Every row has its first field (the id): none is blank
+                try:
+                    for i in stored_ints:
+                        try:
+                            columns[i] = list(map(_SMALL_INTS.__getitem__, columns[i]))
+                        except KeyError:
+                            columns[i] = list(map(int, columns[i]))
+                except ValueError:
+                    pass # A blank or junk count: do this block row by row
+                else:
+                    for i in missing:
+                        columns[i] = (0 if i in ints else '',) * row_count
+                    return zip(*columns)
+        lines = text.split('\n')
+        lines.pop() # After the last newline
+        return filter(None, map(typed, map(str.split, lines, itertools.repeat(delimiter))))
+
+    def blocks():
+        """Yields the rows of each block as one iterable, so no Python code runs per row."""
+        with file:
+            carry = ''
+            while True:
+                block = file.read(READ_BLOCK_BYTES)
+                text = carry + block
+                if '"' in text:
+                    # Quoted fields from here on: let the csv module parse the rest.
+                    cut = text.rfind('\n') + 1
+                    lines = itertools.chain(io.StringIO(text[:cut]), [text[cut:] + file.readline()], file)
+                    yield filter(None, map(typed, csv.reader(lines, delimiter=delimiter)))
+                    return
+                if not block: # End of file, maybe on an unterminated line
+                    if text:
+                        yield block_rows(text if text.endswith('\n') else text + newline)
+                    return
+                cut = text.rfind('\n') + 1
+                text, carry = text[:cut], text[cut:]
+                if text:
+                    yield block_rows(text)
+    return itertools.chain.from_iterable(blocks())
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+def rows_as_tuples(rows, fieldnames):
+    """Converts row dicts to the tuples read_rows() yields."""
+    ints = [i for i, field in enumerate(fieldnames) if field in INT_FIELDS]
+    for row in rows:
+        values = [_text(row.get(field)) for field in fieldnames]
+        for i in ints:
+            try:
+                values[i] = int(values[i])
+            except (TypeError, ValueError):
+                values[i] = 0
+        yield tuple(values)
 
 def save_data(file_path, data, fieldnames):
-    """Saves data to a CSV file."""
-    ensure_data_dir_exists()
-    with open(file_path, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
+    """Saves data to a CSV file, keeping the delimiter the file already uses."""
+    _ensure_parent_dir(file_path)
+    delimiter = file_delimiter(file_path)
+    # Write to a temporary file and rename it over the original, so a crash
+    # part-way through never leaves a half-written file behind.
+    temp_path = file_path + '.tmp'
+    with open(temp_path, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore', delimiter=delimiter)
         writer.writeheader()
         writer.writerows(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+    fsync_dir(file_path)
 
-def generate_id(data):
-    """Generates a unique ID for new entries."""
-    if not data:
-        return "1"
-    
-    # Assuming IDs are numeric strings
+def fsync_dir(file_path):
+    """Makes a rename into the file's directory durable (POSIX only)."""
+    if os.name == 'nt':
+        return
+    dir_fd = os.open(os.path.dirname(file_path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+def append_data(file_path, data, fieldnames):
+    """Appends rows to a CSV file in one write, adding the header if the file is new."""
+    _ensure_parent_dir(file_path)
+    delimiter = file_delimiter(file_path)
+    size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+    is_new = size == 0
+    if not is_new:
+        with open(file_path, mode='rb') as file:
+            file.seek(-1, os.SEEK_END)
+            needs_newline = file.read(1) not in (b'\n', b'\r')
+    with open(file_path, mode='a', newline='', encoding='utf-8') as file:
+        if not is_new and needs_newline:
+            file.write('\r\n') # Don't glue the first new row onto an unterminated last line
+        writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore', delimiter=delimiter)
+        if is_new:
+            writer.writeheader()
+        writer.writerows(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+def append_journal(file_path, entry):
+    """Appends one entry to a journal file and forces it to disk."""
+    _ensure_parent_dir(file_path)
+    line = json.dumps(entry) + '\n'
+    with open(file_path, mode='a', encoding='utf-8') as file:
+        file.write(line)
+        file.flush()
+        os.fsync(file.fileno())
+
+def read_journal(file_path, offset=0, end=None):
+    """Returns the journal entries between byte offsets, and the offset to continue from."""
+    if not os.path.exists(file_path) or os.path.getsize(file_path) <= offset:
+        return [], offset
+    with open(file_path, mode='rb') as file:
+        file.seek(offset)
+        chunk = file.read() if end is None else file.read(max(end - offset, 0))
+    complete = chunk[:chunk.rfind(b'\n') + 1] # A line cut off by a crash is left unread
+    entries = []
+    lines = complete.decode('utf-8', errors='replace').split('\n') # One decode, not one per line
+    lines.pop() # After the last newline
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            pass # Skip a corrupted entry rather than refusing to start
+    return entries, offset + len(complete)
+
+def truncate_journal(file_path):
+    """Empties a journal file once its entries are folded into the snapshots."""
+    _ensure_parent_dir(file_path)
+    with open(file_path, mode='w', encoding='utf-8') as file:
+        os.fsync(file.fileno())
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    """Holds an exclusive advisory lock on a lock file for the duration of the block."""
+    _ensure_parent_dir(lock_path)
+    with open(lock_path, mode='a+') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+_ISBN_JUNK_RE = re.compile(r'[^0-9x]')
+
+def normalize_isbn(isbn):
+    """Returns an ISBN as its digits (and a trailing x), so '978-0-13-235088-4' and '9780132350884' match."""
+    isbn = (isbn or '').lower()
+    return isbn if isbn.isascii() and isbn.isdigit() else _ISBN_JUNK_RE.sub('', isbn)
+
+def max_numeric_id(ids):
+    """Returns the highest id that is a number, or 0."""
     max_id = 0
-    for item in data:
+    for item_id in ids:
         try:
-            current_id = int(item.get('id', '0'))
-            if current_id > max_id:
-                max_id = current_id
+            max_id = max(max_id, int(item_id))
         except ValueError:
-            # Handle cases where 'id' might not be a valid integer
-            pass
-    return str(max_id + 1)
+            pass # Ignore ids that are not numbers
+    return max_id
+
+def save_json(file_path, data):
+    """Writes data to a JSON file, replacing it atomically."""
+    _ensure_parent_dir(file_path)
+    temp_path = file_path + '.tmp'
+    with open(temp_path, mode='w', encoding='utf-8') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, file_path)
+    fsync_dir(file_path)
+
+def read_sequences(sequences_file=SEQUENCES_FILE):
+    """Returns the last id handed out per entity."""
+    if not os.path.exists(sequences_file):
+        return {}
+    with open(sequences_file, mode='r', encoding='utf-8') as file:
+        return json.load(file)
+
+def reserve_ids(entity, count=1, seed=None, sequences_file=SEQUENCES_FILE):
+    """Reserves 'count' consecutive ids for an entity and returns the first one."""
+    # The sequences file is bumped under an exclusive lock, so ids never
+    # collide between processes. 'seed' returns the highest id in use the
+    # first time an entity is seen.
+    with file_lock(sequences_file + '.lock'):
+        sequences = read_sequences(sequences_file)
+        last_id = sequences.get(entity)
+        if last_id is None:
+            last_id = seed() if seed else 0
+        sequences[entity] = last_id + count
+        save_json(sequences_file, sequences)
+    return last_id + 1
+
+def file_signature(file_path):
+    """Returns (mtime, size, inode, device) of a file, or None if it does not exist.
+
+    The inode and device tell a file replaced by another (as save_data()
+    does, renaming a new one over it) from one edited in place, even when
+    the two agree on size and, on a coarse-clock filesystem, on mtime.
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino, stat.st_dev)
+
+
+Branch = namedtuple('Branch', ['name', 'data_dir', 'backend'])
+Branch.__doc__ = """One branch's shard of the library: the data directory its main.py runs on."""
+
+def branches(spec=None, backend=None):
+    """Returns the branch shards from 'name=data_dir,...' (default: $LIBRARY_BRANCHES) as Branch tuples."""
+    spec = LIBRARY_BRANCHES if spec is None else spec
+    backend = backend or STORAGE_BACKEND
+    shards = []
+    for entry in filter(None, (entry.strip() for entry in spec.split(','))):
+        name, separator, data_dir = entry.partition('=')
+        if not separator or not name.strip() or not data_dir.strip():
+            raise ValueError(f"Invalid branch '{entry}' (expected name=data_dir).")
+        if any(shard.name == name.strip() for shard in shards):
+            raise ValueError(f"Branch '{name.strip()}' is listed twice.")
+        shards.append(Branch(name.strip(), data_dir.strip(), backend))
+    return shards or [Branch(LOCAL_BRANCH, DATA_DIR, backend)] # None configured: this directory's data
 
+def shard_signature(branch):
+    """Returns the signatures of a branch's data files; any change to its data changes it."""
+    return tuple(file_signature(os.path.join(branch.data_dir, os.path.basename(file_path)))
+                 for file_path in SHARD_FILES)